@@ -0,0 +1,234 @@
+#!/usr/bin/env python3
+"""
+Загрузка истории из листа "Кирим Чиким" в журнал PostgreSQL (ledger_entries)
+
+Лист читается окнами по --chunk строк. Каждое окно разбирается и загружается
+одной транзакцией вместе с отметкой последней обработанной строки в bot_settings,
+поэтому загрузку можно прервать и запустить снова - она продолжится с места остановки.
+
+    python backfill.py                 - загрузить (или продолжить загрузку)
+    python backfill.py --chunk 500     - размер окна
+    python backfill.py --reset         - начать с первой строки (дубликаты не создаются)
+    python backfill.py --until 01.12.2024 - загружать только строки раньше этой даты
+    python backfill.py --retry-failed  - повторить только строки, которые не удалось разобрать
+
+Номера строк, которые не удалось разобрать, сохраняются в bot_settings вместе с
+отметкой прогресса: после исправления листа их можно загрузить через --retry-failed.
+"""
+
+import argparse
+import datetime
+import json
+import logging
+import time
+
+from utils.db_api.ledger import insert_sheet_entries
+from utils.db_api.postgres import get_db_conn
+from utils.misc.amounts import parse_cell
+from utils.sheets import open_worksheet
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+CHECKPOINT_KEY = 'backfill_sheet_row'
+FAILED_ROWS_KEY = 'backfill_failed_rows'
+HEADER_CELLS = ('Сана', 'Дата', 'Date')
+# A: Сана, B: Кирим, C: Чиқим, D: остатка, E: Котегория, F: Изох, G: Объект номи, H: User
+COLUMNS = 'A{start}:H{end}'
+
+
+def parse_date(text):
+    text = text.strip()
+    for fmt in ('%d.%m.%Y', '%m/%d/%Y'):
+        try:
+            return datetime.datetime.strptime(text, fmt).date()
+        except ValueError:
+            continue
+    raise ValueError(f"Noto'g'ri sana: {text!r}")
+
+
+def parse_row(row_number, row):
+    """Строка листа -> кортеж для ledger_entries; None для пустой строки; ValueError для битой"""
+    row = list(row) + [''] * (8 - len(row))
+    date_text, kirim_text, chiqim_text, _balance, category, comment, object_name, user_name = row[:8]
+    if not any(cell.strip() for cell in row[:8]):
+        return None
+    entry_date = parse_date(date_text)
+    kirim = parse_cell(kirim_text)
+    chiqim = parse_cell(chiqim_text)
+    if bool(kirim) == bool(chiqim):
+        raise ValueError(f"Kirim yoki Chiqim bo'lishi kerak: {kirim_text!r} / {chiqim_text!r}")
+    # Отрицательный приход - это расход (и наоборот): остаток считается так же, как в /update_balances
+    net = kirim - chiqim
+    entry_type, amount_minor = ('Kirim', net) if net > 0 else ('Ciqim', -net)
+    return (row_number, entry_date, entry_type, amount_minor, category.strip(), comment.strip() or None,
+            object_name.strip(), user_name.strip() or None)
+
+
+def parse_window(start, rows, until=None):
+    """Разбирает окно строк; возвращает (записи, пропущенные, ошибки)"""
+    entries, skipped, errors = [], 0, []
+    for offset, row in enumerate(rows):
+        row_number = start + offset
+        if row and row[0].strip() in HEADER_CELLS:
+            skipped += 1
+            continue
+        try:
+            entry = parse_row(row_number, row)
+        except ValueError as e:
+            errors.append((row_number, str(e)))
+            continue
+        if entry is None or (until and entry[1] >= until):
+            skipped += 1
+            continue
+        entries.append(entry)
+    return entries, skipped, errors
+
+
+def load_checkpoint(conn):
+    c = conn.cursor()
+    c.execute('SELECT value FROM bot_settings WHERE key=%s', (CHECKPOINT_KEY,))
+    row = c.fetchone()
+    conn.commit()
+    return int(row[0]) if row else 0
+
+
+def load_failed_rows(conn):
+    """Номера строк, которые прошлые запуски не смогли разобрать"""
+    c = conn.cursor()
+    c.execute('SELECT value FROM bot_settings WHERE key=%s', (FAILED_ROWS_KEY,))
+    row = c.fetchone()
+    conn.commit()
+    return set(json.loads(row[0])) if row else set()
+
+
+def default_until(conn):
+    # Записи, сделанные ботом, уже есть в журнале (без sheet_row) - их дни не загружаем повторно
+    c = conn.cursor()
+    c.execute('SELECT MIN(entry_date) FROM ledger_entries WHERE sheet_row IS NULL')
+    row = c.fetchone()
+    conn.commit()
+    return row[0]
+
+
+def _save_setting(c, key, value):
+    c.execute('''INSERT INTO bot_settings (key, value, updated_at) VALUES (%s, %s, NOW())
+                 ON CONFLICT (key) DO UPDATE SET value = EXCLUDED.value, updated_at = NOW()''',
+              (key, value))
+
+
+def save_window(conn, entries, failed_rows, last_row=None):
+    """Записи окна, список неразобранных строк и отметка о прогрессе - одной транзакцией"""
+    c = conn.cursor()
+    try:
+        inserted = insert_sheet_entries(c, entries)
+        _save_setting(c, FAILED_ROWS_KEY, json.dumps(sorted(failed_rows)))
+        if last_row is not None:
+            _save_setting(c, CHECKPOINT_KEY, str(last_row))
+        conn.commit()
+        return inserted
+    except Exception:
+        conn.rollback()
+        raise
+
+
+def _log_errors(errors):
+    for row_number, error in errors[:5]:
+        logger.warning(f"Строка {row_number}: {error}")
+    if len(errors) > 5:
+        logger.warning(f"... и еще {len(errors) - 5} строк с ошибками")
+
+
+def run_backfill(chunk=1000, reset=False, until=None):
+    worksheet = open_worksheet()
+    conn = get_db_conn()
+    try:
+        done = 0 if reset else load_checkpoint(conn)
+        failed_rows = load_failed_rows(conn)
+        if until is None:
+            until = default_until(conn)
+        total_rows = worksheet.row_count
+        logger.info(f"Лист '{worksheet.title}': {total_rows} строк, продолжаем после строки {done}"
+                    + (f", только записи до {until:%d.%m.%Y}" if until else ''))
+
+        totals = {'inserted': 0, 'skipped': 0, 'failed': 0}
+        started = time.monotonic()
+        start = done + 1
+        while start <= total_rows:
+            end = min(start + chunk - 1, total_rows)
+            window_started = time.monotonic()
+            rows = worksheet.get(COLUMNS.format(start=start, end=end))
+            entries, skipped, errors = parse_window(start, rows, until)
+            # Строки окна, разобранные сейчас, убираются из списка, новые ошибки - добавляются
+            failed_rows = {n for n in failed_rows if not start <= n <= end} | {n for n, _error in errors}
+            inserted = save_window(conn, entries, failed_rows, last_row=end)
+            elapsed = time.monotonic() - window_started
+
+            _log_errors(errors)
+            totals['inserted'] += inserted
+            totals['skipped'] += skipped + len(entries) - inserted
+            totals['failed'] += len(errors)
+            logger.info(f"Строки {start}-{end}: загружено {inserted}, пропущено {skipped + len(entries) - inserted}, "
+                        f"ошибок {len(errors)}, {(end - start + 1) / elapsed:.0f} строк/с")
+            start = end + 1
+
+        elapsed = time.monotonic() - started
+        logger.info(f"Готово за {elapsed:.1f} с: загружено {totals['inserted']}, "
+                    f"пропущено {totals['skipped']}, ошибок {totals['failed']}")
+        if failed_rows:
+            logger.warning(f"Не разобрано строк: {len(failed_rows)} (сохранены в bot_settings.{FAILED_ROWS_KEY}), "
+                           f"после исправления листа запустите с --retry-failed")
+        return totals
+    finally:
+        conn.close()
+
+
+def retry_failed(chunk=1000, until=None):
+    """Повторно разбирает только строки из списка неразобранных; отметку прогресса не меняет"""
+    worksheet = open_worksheet()
+    conn = get_db_conn()
+    try:
+        failed_rows = load_failed_rows(conn)
+        if until is None:
+            until = default_until(conn)
+        logger.info(f"Повторяем {len(failed_rows)} неразобранных строк")
+
+        totals = {'inserted': 0, 'skipped': 0, 'failed': 0}
+        pending = sorted(failed_rows)
+        for i in range(0, len(pending), chunk):
+            batch = pending[i:i + chunk]
+            ranges = worksheet.batch_get([COLUMNS.format(start=n, end=n) for n in batch])
+            entries, errors, skipped = [], [], 0
+            for row_number, values in zip(batch, ranges):
+                row_entries, row_skipped, row_errors = parse_window(row_number, values[:1] or [[]], until)
+                entries += row_entries
+                errors += row_errors
+                skipped += row_skipped
+            failed_rows = (failed_rows - set(batch)) | {n for n, _error in errors}
+            inserted = save_window(conn, entries, failed_rows)
+
+            _log_errors(errors)
+            totals['inserted'] += inserted
+            totals['skipped'] += skipped + len(entries) - inserted
+            totals['failed'] += len(errors)
+
+        logger.info(f"Готово: загружено {totals['inserted']}, пропущено {totals['skipped']}, "
+                    f"ошибок {totals['failed']}, осталось неразобранных строк {len(failed_rows)}")
+        return totals
+    finally:
+        conn.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Загрузка истории из Google Sheets в PostgreSQL')
+    parser.add_argument('--chunk', type=int, default=1000, help='строк листа за одно окно')
+    parser.add_argument('--reset', action='store_true', help='начать с первой строки листа')
+    parser.add_argument('--until', type=parse_date, default=None,
+                        help='загружать только записи раньше даты ДД.ММ.ГГГГ')
+    parser.add_argument('--retry-failed', action='store_true',
+                        help='повторить только строки, которые не удалось разобрать')
+    args = parser.parse_args()
+    if args.retry_failed:
+        retry_failed(chunk=args.chunk, until=args.until)
+    else:
+        run_backfill(chunk=args.chunk, reset=args.reset, until=args.until)
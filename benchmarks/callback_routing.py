@@ -0,0 +1,82 @@
+"""
+Стоимость маршрутизации одного нажатия кнопки.
+
+Сравнивает прежнюю цепочку фильтров (lambda c: c.data.startswith(...) в порядке
+регистрации) с CallbackRouter: поиск префикса в словаре и разбор полей.
+Запуск: python -m benchmarks.callback_routing
+"""
+import timeit
+from types import SimpleNamespace
+
+from utils.misc.callback_router import CallbackRouter, pack
+
+# Фильтры в том порядке, в котором хендлеры были зарегистрированы в bot.py
+LEGACY_FILTERS = [
+    lambda c: c.data.startswith('type_'),
+    lambda c: c.data.startswith('cat_'),
+    lambda c: c.data == 'skip_comment',
+    lambda c: c.data.startswith('obj_'),
+    lambda c: c.data in ['confirm_yes', 'confirm_no'],
+    lambda c: c.data.startswith('del_category_'),
+    lambda c: c.data.startswith('edit_category_'),
+    lambda c: c.data.startswith('blockuser_'),
+    lambda c: c.data.startswith('approveuser_') or c.data.startswith('denyuser_'),
+    lambda c: c.data.startswith('approveuser_') or c.data.startswith('denyuser_'),
+    lambda c: c.data.startswith('approve_cat_') or c.data.startswith('deny_cat_'),
+    lambda c: c.data.startswith('approve_obj_') or c.data.startswith('deny_obj_'),
+    lambda c: c.data.startswith('lang_'),
+]
+
+LEGACY_SAMPLES = ['type_kirim', 'cat_Прочие расходы', 'confirm_yes', 'approve_obj_5657091547_Сам Сити',
+                  'lang_ru']
+
+
+def build_router():
+    router = CallbackRouter()
+
+    async def handler(call, **kwargs):
+        pass
+
+    router.route('type', ('kind', str))(handler)
+    router.route('cat', ('category_id', int))(handler)
+    router.route('skip')(handler)
+    router.route('obj', ('object_id', int))(handler)
+    router.route('confirm', ('answer', str))(handler)
+    router.route('delcat', ('category_id', int))(handler)
+    router.route('editcat', ('category_id', int))(handler)
+    router.route('blockuser', ('user_id', int))(handler)
+    router.route('user', ('action', str), ('user_id', int))(handler)
+    router.route('catreq', ('action', str), ('request_id', int))(handler)
+    router.route('objreq', ('action', str), ('request_id', int))(handler)
+    router.route('lang', ('lang', str))(handler)
+    return router
+
+
+ROUTER_SAMPLES = [pack('type', 'kirim'), pack('cat', 17), pack('confirm', 'yes'), pack('objreq', 'approve', 42),
+                  pack('lang', 'ru')]
+
+
+def legacy_route(call):
+    for check in LEGACY_FILTERS:
+        if check(call):
+            # Прежние хендлеры еще разбирали данные через split('_') и '_'.join(...)
+            parts = call.data.split('_')
+            return parts[0], '_'.join(parts[1:])
+    return None
+
+
+def main(number=200000):
+    router = build_router()
+    cases = [
+        ('legacy filter chain', legacy_route, LEGACY_SAMPLES),
+        ('CallbackRouter.check', lambda call: router.check(call), ROUTER_SAMPLES),
+    ]
+    for name, func, samples in cases:
+        calls = [SimpleNamespace(data=data) for data in samples]
+        for call in calls:
+            seconds = timeit.timeit(lambda: func(call), number=number)
+            print(f'{name:22} {call.data:40} {seconds / number * 1e9:8.0f} ns/callback')
+
+
+if __name__ == '__main__':
+    main()
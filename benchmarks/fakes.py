@@ -0,0 +1,163 @@
+"""
+Поддельные внешние сервисы для нагрузочного теста: Telegram Bot API и Google Sheets.
+
+FakeTelegram - aiohttp-сервер с API вида /bot<token>/<method>. Апдейты виртуальных
+пользователей отдаются боту через getUpdates, а каждое сообщение бота попадает
+во "входящие" чата, где его ждет виртуальный пользователь.
+
+FakeSheetsClient повторяет ту часть gspread, которой пользуется бот, и
+задерживает каждую операцию на заданное время (как настоящий API таблиц).
+"""
+import asyncio
+import itertools
+import json
+import random
+import threading
+import time
+
+from aiohttp import web
+
+BOT_USER = {'id': 1, 'is_bot': True, 'first_name': 'Kapital Bot', 'username': 'loadtest_bot'}
+
+
+class FakeTelegram:
+    def __init__(self, latency=0.0):
+        self.latency = latency
+        self.updates = asyncio.Queue()
+        self.inboxes = {}
+        self.requests = {}
+        self._update_ids = itertools.count(1)
+        self._message_ids = itertools.count(1)
+
+    def inbox(self, chat_id) -> asyncio.Queue:
+        queue = self.inboxes.get(chat_id)
+        if queue is None:
+            queue = self.inboxes[chat_id] = asyncio.Queue()
+        return queue
+
+    def push(self, **update):
+        update['update_id'] = next(self._update_ids)
+        self.updates.put_nowait(update)
+
+    def app(self):
+        app = web.Application()
+        app.router.add_post('/bot{token}/{method}', self.handle)
+        return app
+
+    async def handle(self, request: web.Request):
+        method = request.match_info['method']
+        data = dict(await request.post())
+        self.requests[method] = self.requests.get(method, 0) + 1
+        if method == 'getUpdates':
+            return self._ok(await self._get_updates(float(data.get('timeout') or 0), int(data.get('limit') or 100)))
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        if method == 'getMe':
+            return self._ok(BOT_USER)
+        if method == 'getWebhookInfo':
+            return self._ok({'url': '', 'has_custom_certificate': False, 'pending_update_count': 0})
+        if method in ('sendMessage', 'editMessageText'):
+            message = self._message(data)
+            self.inbox(message['chat']['id']).put_nowait((time.perf_counter(), method, message))
+            return self._ok(message)
+        return self._ok(True)
+
+    async def _get_updates(self, timeout, limit):
+        try:
+            batch = [await asyncio.wait_for(self.updates.get(), timeout)]
+        except asyncio.TimeoutError:
+            return []
+        while len(batch) < limit and not self.updates.empty():
+            batch.append(self.updates.get_nowait())
+        return batch
+
+    def _message(self, data):
+        chat_id = int(data['chat_id'])
+        message = {
+            'message_id': int(data.get('message_id') or next(self._message_ids)),
+            'date': int(time.time()),
+            'chat': {'id': chat_id, 'type': 'private'},
+            'from': BOT_USER,
+            'text': data.get('text', ''),
+        }
+        if data.get('reply_markup'):
+            message['reply_markup'] = json.loads(data['reply_markup'])
+        return message
+
+    @staticmethod
+    def _ok(result):
+        return web.json_response({'ok': True, 'result': result})
+
+
+def callback_data(message):
+    """Все callback_data из инлайн-клавиатуры сообщения"""
+    markup = message.get('reply_markup') or {}
+    return [button['callback_data'] for row in markup.get('inline_keyboard', ())
+            for button in row if 'callback_data' in button]
+
+
+class FakeCell:
+    __slots__ = ('value',)
+
+    def __init__(self, value):
+        self.value = value
+
+
+class FakeWorksheet:
+    def __init__(self, title, latency):
+        self.title = title
+        self.latency = latency
+        self.rows = [['Сана', 'Кирим', 'Чиқим', '0', 'Котегория', 'Изох', 'Объект номи', 'User']]
+        self._lock = threading.Lock()
+
+    @property
+    def row_count(self):
+        return len(self.rows)
+
+    def _wait(self):
+        # Как и gspread, операции блокирующие: задержка держит поток вызывающего
+        if self.latency:
+            time.sleep(random.uniform(self.latency * 0.5, self.latency * 1.5))
+
+    def append_row(self, row):
+        self._wait()
+        with self._lock:
+            self.rows.append([str(cell) for cell in row])
+
+    def acell(self, label):
+        self._wait()
+        return FakeCell(self.rows[0][3] if label == 'D1' else '')
+
+    def get_all_values(self):
+        self._wait()
+        with self._lock:
+            return [list(row) for row in self.rows]
+
+    def update_cell(self, row, col, value):
+        self._wait()
+
+    def get(self, _range):
+        self._wait()
+        return []
+
+
+class FakeSpreadsheet:
+    def __init__(self, latency):
+        self.sheet = FakeWorksheet('Кирим Чиким', latency)
+
+    def worksheet(self, name):
+        return self.sheet
+
+    def get_worksheet(self, index):
+        return self.sheet
+
+    def worksheets(self):
+        return [self.sheet]
+
+
+class FakeSheetsClient:
+    def __init__(self, latency=0.0):
+        self.spreadsheet = FakeSpreadsheet(latency)
+
+    def open_by_key(self, key):
+        return self.spreadsheet
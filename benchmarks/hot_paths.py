@@ -0,0 +1,183 @@
+"""
+Функции, через которые проходит каждая запись: время и выделения памяти.
+
+Клавиатуры категорий и объектов, форматирование подтверждения, эмодзи категорий
+и расчет остатков /update_balances замеряются на синтетических справочниках из
+30/300/3000 категорий и объектов (лист - в 10 раз больше строк). Результат
+сравнивается с базой из репозитория (hot_paths_baseline.json): если функция
+стала медленнее или выделяет больше памяти, чем база плюс порог, запуск
+завершается с кодом 1. Без базы (или без записи для замеренной функции) запуск
+тоже завершается ошибкой - базу создает или дополняет только --update-baseline.
+
+Запуск:
+    python -m benchmarks.hot_paths                    - замер и сравнение с базой
+    python -m benchmarks.hot_paths --update-baseline  - сохранить замер как новую базу
+    python -m benchmarks.hot_paths --threshold 0.5    - допустимый рост, доля от базы
+Базу стоит пересохранять на той же машине, где идет сравнение: время зависит от железа.
+"""
+import argparse
+import json
+import os
+import sys
+import timeit
+import tracemalloc
+
+from keyboards.inline.entry import categories_kb, objects_kb
+from utils.misc.amounts import parse_amount, running_balances, format_amount, amount_for_sheet
+from utils.misc.formatting import category_emojis, get_category_with_emoji, clean_emoji, format_summary
+
+SIZES = (30, 300, 3000)
+SHEET_ROWS_PER_ITEM = 10
+BASELINE_FILE = os.path.join(os.path.dirname(__file__), 'hot_paths_baseline.json')
+
+
+def make_catalog(size, prefix):
+    """Строки (id, name); часть названий - категории с эмодзи из category_emojis"""
+    known = list(category_emojis)
+    return [(i, known[i - 1] if i <= len(known) else f'{prefix} {i}') for i in range(1, size + 1)]
+
+
+def make_sheet(rows):
+    """Строки листа A..H в том виде, в каком их отдает get_all_values"""
+    sheet = []
+    for i in range(rows):
+        amount = f'{(i % 997 + 1) * 1000:,}'.replace(',', ' ')
+        kirim, chiqim = (amount, '') if i % 3 == 0 else ('', amount)
+        if i % 50 == 49:
+            kirim = 'итого'  # неверная сумма: строка пропускается
+        sheet.append(['01.12.2024', kirim, chiqim, '', 'Soliq', '-', 'Сам Сити', 'Loadtest'])
+    return sheet
+
+
+def update_balances(sheet):
+    """Расчет /update_balances без записи в таблицу"""
+    return [amount_for_sheet(balance) for _row, balance in running_balances(sheet, first_row=2)]
+
+
+def build_cases():
+    """Имя замера -> функция без аргументов"""
+    summary = {'type': 'Kirim', 'amount': format_amount(parse_amount('1 500 000')), 'category': 'Soliq',
+               'comment': 'Sement 40 qop', 'loyiha': 'Сам Сити', 'dt': '2024-12-01 10:00:00'}
+    cases = {
+        'format_summary': lambda: format_summary(summary),
+        'parse_amount': lambda: parse_amount('1 500 000.50'),
+    }
+    for size in SIZES:
+        categories = make_catalog(size, 'Kategoriya')
+        objects = make_catalog(size, 'Obyekt')
+        names = [name for _id, name in categories]
+        buttons = [get_category_with_emoji(name) for name in names]
+        sheet = make_sheet(size * SHEET_ROWS_PER_ITEM)
+        cases.update({
+            f'get_category_with_emoji[{size}]': lambda names=names: [get_category_with_emoji(n) for n in names],
+            f'clean_emoji[{size}]': lambda buttons=buttons: [clean_emoji(b) for b in buttons],
+            f'get_categories_kb[{size}]': lambda categories=categories: categories_kb(categories),
+            f'get_objects_kb[{size}]': lambda objects=objects: objects_kb(objects),
+            f'update_balances[{len(sheet)}]': lambda sheet=sheet: update_balances(sheet),
+        })
+    return cases
+
+
+def reference():
+    """Эталонная нагрузка: строки, словари и списки, как в замеряемых функциях"""
+    words = {}
+    for i in range(300):
+        text = f'Kategoriya {i}'.replace(' ', '_').lower()
+        words[text] = words.get(text, 0) + len(text.split('_'))
+    return sorted(words.items())
+
+
+def _per_call(timer, number):
+    return timer.timeit(number) / number
+
+
+def measure(func, ref_timer, ref_number):
+    """
+    Время одного вызова, то же время в долях эталонной нагрузки и выделения памяти за вызов.
+
+    Функция и эталон замеряются поочередно (лучшее из 7 серий каждого), поэтому
+    отношение 'rel' почти не зависит от частоты процессора и соседей по машине -
+    с базой сравнивается оно, а не абсолютное время.
+    """
+    timer = timeit.Timer(func)
+    number, _ = timer.autorange()
+    times, ref_times = [], []
+    for _ in range(7):
+        times.append(_per_call(timer, number))
+        ref_times.append(_per_call(ref_timer, ref_number))
+    seconds = min(times)
+
+    tracemalloc.start()
+    try:
+        before = tracemalloc.take_snapshot()
+        result = func()
+        after = tracemalloc.take_snapshot()
+        _current, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    # Блоки, которые вызов создал и которые еще живы (результат), и пик памяти во время вызова
+    blocks = sum(stat.count_diff for stat in after.compare_to(before, 'filename') if stat.count_diff > 0)
+    del result
+    return {'us': round(seconds * 1e6, 2), 'rel': round(seconds / min(ref_times), 4),
+            'blocks': blocks, 'peak_kib': round(peak / 1024, 1)}
+
+
+def compare(results, baseline, threshold):
+    """Список регрессий: (функция, метрика, база, замер)"""
+    regressions = []
+    for name, result in results.items():
+        base = baseline.get(name)
+        if base is None or 'rel' not in base:
+            continue
+        for metric, floor in (('rel', 0.05), ('blocks', 1), ('peak_kib', 1)):
+            # Небольшие абсолютные значения не сравниваем: их разброс больше порога
+            if result[metric] > base[metric] * (1 + threshold) and result[metric] - base[metric] >= floor:
+                regressions.append((name, metric, base[metric], result[metric]))
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Микробенчмарки функций на пути каждой записи')
+    parser.add_argument('--update-baseline', action='store_true', help='сохранить результат как базу')
+    parser.add_argument('--baseline', default=BASELINE_FILE, help='файл с базой')
+    parser.add_argument('--threshold', type=float, default=0.25, help='допустимый рост относительно базы')
+    parser.add_argument('--filter', default='', help='замерять только функции, в имени которых есть строка')
+    args = parser.parse_args()
+
+    try:
+        with open(args.baseline, encoding='utf-8') as f:
+            baseline = json.load(f)
+    except FileNotFoundError:
+        baseline = {}
+
+    ref_timer = timeit.Timer(reference)
+    ref_number, _ = ref_timer.autorange()
+    results = {}
+    print(f"{'function':32} {'us/call':>11} {'rel':>9} {'base rel':>9} {'blocks':>8} {'peak KiB':>9}")
+    for name, func in build_cases().items():
+        if args.filter not in name:
+            continue
+        result = results[name] = measure(func, ref_timer, ref_number)
+        base = baseline.get(name, {}).get('rel', '-')
+        print(f"{name:32} {result['us']:11} {result['rel']:9} {base:>9} {result['blocks']:8} {result['peak_kib']:9}")
+
+    if args.update_baseline:
+        with open(args.baseline, 'w', encoding='utf-8') as f:
+                json.dump({**baseline, **results}, f, indent=2, sort_keys=True)
+        print(f'Baseline saved to {args.baseline}')
+        return
+    # Записи без 'rel' остались от старого формата базы - их тоже нужно пересохранить
+    missing = [name for name in results if 'rel' not in baseline.get(name, {})]
+    for name in missing:
+        print(f'NO BASELINE {name}: run with --update-baseline to store one')
+
+    regressions = compare(results, baseline, args.threshold)
+    for name, metric, base, value in regressions:
+        print(f'REGRESSION {name}: {metric} {base} -> {value} (+{(value / base - 1) * 100:.0f}%)'
+              if base else f'REGRESSION {name}: {metric} {base} -> {value}')
+    if regressions or missing:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
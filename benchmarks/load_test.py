@@ -0,0 +1,289 @@
+"""
+Нагрузочный тест мастера ввода записи.
+
+Диспетчер bot.py работает против поддельного Telegram Bot API и поддельной таблицы
+(benchmarks/fakes.py), PostgreSQL - настоящий. N виртуальных пользователей проходят
+/start -> тип -> сумма -> категория -> комментарий -> объект -> подтверждение с паузами
+"на раздумье" между шагами. В конце выводится пропускная способность, p50/p95/p99 и
+доля ошибок по каждому шагу.
+
+Запуск (база должна быть отдельной: тест пишет пользователей и журнал записей):
+    POSTGRES_DB=kapital_loadtest python -m benchmarks.load_test --users 50 --duration 120
+    python -m benchmarks.load_test --users 200 --sheets-latency 0.8 --storage memory --json run.json
+"""
+import argparse
+import asyncio
+import json
+import math
+import os
+import random
+import time
+
+from aiohttp import web
+
+from benchmarks.fakes import FakeTelegram, FakeSheetsClient, callback_data
+
+USER_ID_BASE = 900000000
+# Ответы бота, которые для виртуального пользователя означают ошибку шага
+ERROR_MARKS = ('⚠️', '❗', '❌')
+
+
+class StepError(Exception):
+    pass
+
+
+def percentile(sorted_values, q):
+    """Перцентиль по ближайшему рангу (значения уже отсортированы)"""
+    if not sorted_values:
+        return None
+    rank = max(1, math.ceil(q / 100 * len(sorted_values)))
+    return sorted_values[rank - 1]
+
+
+class Stats:
+    def __init__(self):
+        self.latencies = {}
+        self.errors = {}
+        self.entries = 0
+
+    def ok(self, step, seconds):
+        self.latencies.setdefault(step, []).append(seconds)
+
+    def error(self, step, kind):
+        errors = self.errors.setdefault(step, {})
+        errors[kind] = errors.get(kind, 0) + 1
+
+    def summary(self, elapsed):
+        steps = {}
+        for step in dict.fromkeys([*self.latencies, *self.errors]):
+            values = sorted(self.latencies.get(step, ()))
+            errors = sum(self.errors.get(step, {}).values())
+            total = len(values) + errors
+            steps[step] = {
+                'count': total,
+                'errors': errors,
+                'error_rate': errors / total if total else 0.0,
+                'error_kinds': self.errors.get(step, {}),
+                **{f'p{q}_ms': _ms(percentile(values, q)) for q in (50, 95, 99)},
+                'max_ms': _ms(values[-1] if values else None),
+            }
+        updates = sum(step['count'] for step in steps.values())
+        return {
+            'elapsed_s': round(elapsed, 2),
+            'entries': self.entries,
+            'entries_per_s': round(self.entries / elapsed, 2) if elapsed else 0.0,
+            'updates_per_s': round(updates / elapsed, 2) if elapsed else 0.0,
+            'steps': steps,
+        }
+
+
+def _ms(seconds):
+    return None if seconds is None else round(seconds * 1000, 1)
+
+
+class VirtualUser:
+    """Один пользователь: отправляет апдейт и ждет ответа бота в своем чате"""
+
+    def __init__(self, index, telegram: FakeTelegram, stats: Stats, args):
+        self.user = {'id': USER_ID_BASE + index, 'is_bot': False, 'first_name': f'Loadtest {index}'}
+        self.telegram = telegram
+        self.stats = stats
+        self.args = args
+        self.inbox = telegram.inbox(self.user['id'])
+        self.keyboard = None
+
+    async def think(self):
+        await asyncio.sleep(random.uniform(*self.args.think))
+
+    async def step(self, name, expect, text=None, data=None):
+        """Отправляет сообщение или нажатие кнопки и ждет ответа, на котором шаг завершен"""
+        while not self.inbox.empty():
+            self.inbox.get_nowait()
+        chat = {'id': self.user['id'], 'type': 'private'}
+        sent_at = time.perf_counter()
+        if data is None:
+            self.telegram.push(message={'message_id': 0, 'date': int(time.time()), 'chat': chat,
+                                        'from': self.user, 'text': text})
+        else:
+            self.telegram.push(callback_query={'id': str(sent_at), 'from': self.user, 'message': self.keyboard,
+                                               'chat_instance': str(self.user['id']), 'data': data})
+        first_reply = None
+        try:
+            while True:
+                received_at, method, message = await asyncio.wait_for(self.inbox.get(), self.args.timeout)
+                first_reply = first_reply or received_at
+                if message['text'].startswith(ERROR_MARKS):
+                    raise StepError(message['text'].split('\n', 1)[0][:40])
+                if expect(method, message):
+                    break
+        except asyncio.TimeoutError:
+            self.stats.error(name, 'timeout')
+            raise StepError('timeout')
+        except StepError as e:
+            self.stats.error(name, str(e))
+            raise
+        self.stats.ok(name, first_reply - sent_at)
+        self.keyboard = message
+        return message
+
+    def pick(self, prefix):
+        options = [data for data in callback_data(self.keyboard) if data.startswith(prefix)]
+        if not options:
+            raise StepError(f'no {prefix} buttons')
+        return random.choice(options)
+
+    async def entry(self):
+        await self.step('type', edited, data=self.pick('type:'))
+        await self.think()
+        amount = random.randint(1, 5000) * 1000
+        text = random.choice([str(amount), f'{amount:,}'.replace(',', ' ')])
+        await self.step('amount', has_buttons('cat:'), text=text)
+        await self.think()
+        await self.step('category', has_buttons('skip'), data=self.pick('cat:'))
+        await self.think()
+        if random.random() < 0.5:
+            await self.step('comment', has_buttons('obj:'), data='skip')
+        else:
+            await self.step('comment', has_buttons('obj:'), text=f'loadtest {random.randint(1, 10 ** 6)}')
+        await self.think()
+        await self.step('object', has_buttons('confirm:'), data=self.pick('obj:'))
+        await self.think()
+        # После подтверждения бот сразу снова показывает выбор типа операции
+        await self.step('confirm', has_buttons('type:'), data='confirm:yes')
+        self.stats.entries += 1
+
+    async def run(self, deadline):
+        await asyncio.sleep(random.uniform(0, self.args.ramp_up))
+        started = False
+        while time.perf_counter() < deadline:
+            try:
+                if not started:
+                    await self.step('start', has_buttons('type:'), text='/start')
+                    started = True
+                await self.think()
+                await self.entry()
+            except StepError:
+                # /reboot сбрасывает диалог из любого состояния
+                await asyncio.sleep(self.args.think[1])
+                try:
+                    await self.step('reboot', has_buttons('type:'), text='/reboot')
+                except StepError:
+                    started = False
+            await self.think()
+
+
+def edited(method, message):
+    return method == 'editMessageText'
+
+
+def has_buttons(prefix):
+    return lambda method, message: any(data.startswith(prefix) for data in callback_data(message))
+
+
+def seed_database(get_db_conn, users):
+    """Одобренные пользователи для теста и хотя бы одна категория и объект"""
+    conn = get_db_conn()
+    c = conn.cursor()
+    for index in range(users):
+        c.execute("INSERT INTO users (user_id, name, phone, status, reg_date) VALUES (%s, %s, %s, 'approved', %s) "
+                  "ON CONFLICT (user_id) DO UPDATE SET status='approved'",
+                  (USER_ID_BASE + index, f'Loadtest {index}', '+998000000000', time.strftime('%Y-%m-%d %H:%M:%S')))
+    for table in ('categories', 'objects'):
+        c.execute(f"INSERT INTO {table} (name) SELECT 'Loadtest' WHERE NOT EXISTS (SELECT 1 FROM {table})")
+    conn.commit()
+    conn.close()
+
+
+def configure_environment(args):
+    """Настройки, которые data.config читает при импорте bot.py"""
+    os.environ.setdefault('BOT_TOKEN', '123456:loadtest')
+    os.environ['FSM_STORAGE'] = args.storage
+    os.environ['METRICS_PORT'] = '0'
+    os.environ['SCHEDULER_ENABLED'] = 'false'
+
+
+async def run(args):
+    configure_environment(args)
+    from aiogram.bot.api import TelegramAPIServer
+    import bot as app
+    from utils.db_api.postgres import get_db_conn
+    from utils.misc.logging import setup_logging
+    from utils.sheets import use_client
+
+    setup_logging(level='INFO' if args.verbose else 'WARNING', fmt='text')
+    app.setup_database()
+    seed_database(get_db_conn, args.users)
+    use_client(FakeSheetsClient(args.sheets_latency))
+
+    telegram = FakeTelegram(args.tg_latency)
+    runner = web.AppRunner(telegram.app())
+    await runner.setup()
+    site = web.TCPSite(runner, '127.0.0.1', 0)
+    await site.start()
+    port = runner.addresses[0][1]
+    app.bot.server = TelegramAPIServer.from_base(f'http://127.0.0.1:{port}')
+
+    await app.on_process_startup(app.dp, metrics_port=0)
+    # Диалоги, оставшиеся от прошлого запуска, иначе /start на них не ответит
+    for index in range(args.users):
+        await app.dp.storage.finish(chat=USER_ID_BASE + index, user=USER_ID_BASE + index)
+    polling = asyncio.create_task(app.dp.start_polling(timeout=1))
+
+    stats = Stats()
+    started = time.perf_counter()
+    deadline = started + args.duration
+    users = [VirtualUser(index, telegram, stats, args) for index in range(args.users)]
+    await asyncio.gather(*(user.run(deadline) for user in users))
+    elapsed = time.perf_counter() - started
+
+    app.dp.stop_polling()
+    await polling
+    await app.on_shutdown(app.dp)
+    await (await app.bot.get_session()).close()
+    await runner.cleanup()
+
+    result = stats.summary(elapsed)
+    result['bot_api_requests'] = telegram.requests
+    return result
+
+
+def print_report(args, result):
+    print(f"users={args.users} storage={args.storage} think={args.think[0]}-{args.think[1]}s "
+          f"tg_latency={args.tg_latency}s sheets_latency={args.sheets_latency}s")
+    print(f"{result['entries']} entries in {result['elapsed_s']}s: "
+          f"{result['entries_per_s']} entries/s, {result['updates_per_s']} updates/s")
+    print(f"{'step':10} {'count':>7} {'errors':>7} {'err %':>6} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} {'max ms':>8}")
+    for name, step in result['steps'].items():
+        cells = [step[key] if step[key] is not None else '-' for key in ('p50_ms', 'p95_ms', 'p99_ms', 'max_ms')]
+        print(f"{name:10} {step['count']:7} {step['errors']:7} {step['error_rate'] * 100:6.1f} "
+              + ' '.join(f'{cell:>8}' for cell in cells))
+        for kind, count in step['error_kinds'].items():
+            print(f"{'':10} {count:7} x {kind}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Нагрузочный тест мастера ввода записи')
+    parser.add_argument('--users', type=int, default=20, help='число виртуальных пользователей')
+    parser.add_argument('--duration', type=float, default=60, help='длительность теста, секунд')
+    parser.add_argument('--ramp-up', type=float, default=10, help='пользователи подключаются в течение N секунд')
+    parser.add_argument('--think', type=float, nargs=2, default=(1.0, 4.0), metavar=('MIN', 'MAX'),
+                        help='пауза пользователя между шагами, секунд')
+    parser.add_argument('--timeout', type=float, default=30, help='сколько ждать ответа бота на шаг')
+    parser.add_argument('--tg-latency', type=float, default=0.05, help='задержка поддельного Bot API, секунд')
+    parser.add_argument('--sheets-latency', type=float, default=0.4,
+                        help='средняя задержка операции с поддельной таблицей, секунд')
+    parser.add_argument('--storage', choices=('postgres', 'memory'), default='postgres', help='хранилище FSM')
+    parser.add_argument('--json', help='сохранить результат в файл для сравнения конфигураций')
+    parser.add_argument('--verbose', action='store_true', help='не приглушать логи бота')
+    args = parser.parse_args()
+
+    result = asyncio.run(run(args))
+    print_report(args, result)
+    if args.json:
+        result['config'] = {key: value for key, value in vars(args).items() if key not in ('json', 'verbose')}
+        with open(args.json, 'w', encoding='utf-8') as f:
+            json.dump(result, f, ensure_ascii=False, indent=2)
+
+
+if __name__ == '__main__':
+    main()
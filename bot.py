@@ -1,36 +1,81 @@
+import time
+# Отсчет времени запуска - до всех остальных импортов
+BOOT_STARTED = time.perf_counter()
+
 import logging
-from aiogram import Bot, Dispatcher, executor, types
+from aiogram import Dispatcher, executor, types
 from aiogram.types import InlineKeyboardMarkup, InlineKeyboardButton, ParseMode
 from aiogram.contrib.fsm_storage.memory import MemoryStorage
 from aiogram.dispatcher import FSMContext
 from aiogram.dispatcher.filters.state import State, StatesGroup
 from aiogram.dispatcher.filters import CommandStart
 from datetime import datetime
+import asyncio
 import os
-from environs import Env
-import gspread
-from google.oauth2.service_account import Credentials
 import platform
-import sqlite3
-import psycopg2
 from psycopg2 import sql, IntegrityError
-import re
-
-# Загрузка переменных окружения
-env = Env()
-env.read_env()
-API_TOKEN = env.str('BOT_TOKEN')
-
-logging.basicConfig(level=logging.INFO)
-
-bot = Bot(token=API_TOKEN, parse_mode=ParseMode.HTML)
-dp = Dispatcher(bot, storage=MemoryStorage())
 
-# --- Google Sheets настройки ---
-SCOPES = ['https://www.googleapis.com/auth/spreadsheets']
-SHEET_ID = '1luwtoyzIsnCTmpbY5L-POpTSh5hNWlX8zGMr1GPIlFY'
-SHEET_NAME = 'Кирим Чиким'
-CREDENTIALS_FILE = 'credentials.json'
+from data.config import (BOT_TOKEN, ADMINS, REBOOT_NOTIFY_WINDOW, ADMIN_NOTIFY_MODE,
+                         ADMIN_DIGEST_INTERVAL, ADMIN_DIGEST_MAX_ENTRIES, FSM_STORAGE, RUN_MODE,
+                         SHEET_NAME, SCHEDULER_ENABLED, SCHEDULER_JITTER, DAILY_SUMMARY_CRON,
+                         METRICS_HOST, METRICS_PORT, SHEET_QUEUE_SIZE)
+from utils.admin_notifier import AdminNotifier
+from utils.scheduler import Scheduler
+from utils.db_api.fsm_storage import PostgresStorage
+from utils.db_api.postgres import get_db_conn
+from utils.db_api.users import get_user, invalidate_user, get_lang, set_lang
+from keyboards.inline.support import (langMenu, support_keyboard, cancel_support, cancel_support_for,
+                                      get_support_manager, start_support_session, end_support_session)
+from keyboards.inline.entry import start_kb, skip_kb, confirm_kb, categories_kb, objects_kb
+from translation import _, LANGUAGES
+from utils.db_api.security_db import allow_group, deny_group
+from utils.db_api.invalidation import start_listener
+from utils.db_api import confirmations
+from utils.db_api.sheet_routes import target_for, get_routes, set_route, delete_route, DEFAULT_TARGET
+from utils.db_api.ledger import (record_entry, get_report, parse_period, iter_entries,
+                                 get_object_balances, rebuild_object_balances)
+from utils.misc.boot import boot
+from utils.misc.logging import setup_logging
+from utils.misc.cache import MISSING
+from utils.misc.amounts import parse_amount, running_balances, format_amount, amount_for_sheet
+from utils.misc.export import export_entries, FORMATS as EXPORT_FORMATS
+from utils.misc.support_registry import support_registry
+from utils.misc.callback_router import CallbackRouter, pack
+from utils.misc.formatting import clean_emoji, format_summary
+from utils.misc.metrics import Gauge, monitor_loop_lag
+from utils.misc.tracing import in_executor
+from utils.monitoring import MeteredBot, start_metrics_server
+from utils.sheets import open_spreadsheet, open_worksheet, sheets_op
+from utils.sheet_writer import SheetWriters
+import middlewares
+from middlewares.user_context import is_approved
+
+API_TOKEN = BOT_TOKEN
+
+
+bot = MeteredBot(token=API_TOKEN, parse_mode=ParseMode.HTML)
+# Состояния хранятся в PostgreSQL, чтобы незавершенные диалоги переживали перезапуск
+storage = PostgresStorage() if FSM_STORAGE == 'postgres' else MemoryStorage()
+dp = Dispatcher(bot, storage=storage)
+middlewares.setup(dp)
+# Все нажатия кнопок проходят через один хендлер с разбором по префиксу
+callbacks = CallbackRouter()
+callbacks.setup(dp)
+admin_notifier = AdminNotifier(bot, ADMINS, mode=ADMIN_NOTIFY_MODE,
+                               interval=ADMIN_DIGEST_INTERVAL * 60,
+                               max_entries=ADMIN_DIGEST_MAX_ENTRIES)
+scheduler = Scheduler()
+# Очередь и обработчик записи на каждый лист Google Sheets
+sheet_writers = SheetWriters(queue_size=SHEET_QUEUE_SIZE)
+
+
+def count_fsm_sessions():
+    if isinstance(storage, PostgresStorage):
+        return storage.sessions_count
+    return sum(1 for users in storage.data.values() for record in users.values() if record.get('state'))
+
+
+FSM_SESSIONS = Gauge('bot_fsm_sessions', 'Сессии FSM в памяти процесса', callback=count_fsm_sessions)
 
 # Состояния
 class Form(StatesGroup):
@@ -48,13 +93,6 @@ class CategoryRequest(StatesGroup):
 class ObjectRequest(StatesGroup):
     name = State()      # Название объекта
 
-# Кнопки выбора Kirim/Chiqim
-start_kb = InlineKeyboardMarkup(row_width=2)
-start_kb.add(
-    InlineKeyboardButton('🟢 Kirim', callback_data='type_kirim'),
-    InlineKeyboardButton('🔴 Chiqim', callback_data='type_chiqim')
-)
-
 # Категории
 categories = [
     ("🟥 Doimiy Xarajat", "cat_doimiy"),
@@ -66,60 +104,18 @@ categories = [
     ("🟦 Ish Xaqi", "cat_ishhaqi")
 ]
 
-# Словарь соответствий: категория -> эмодзи
-category_emojis = {
-    "Qurilish materiallari": "🟩",
-    "Doimiy Xarajat": "🟥",
-    "Qarz": "🟪",
-    "Divident": "🟩",
-    "Soliq": "🟪",
-    "Ish Xaqi": "🟦",
-    # Добавьте другие категории и эмодзи по мере необходимости
-}
-
-def get_category_with_emoji(category_name):
-    emoji = category_emojis.get(category_name, "")
-    return f"{emoji} {category_name}".strip()
-
 def get_categories_kb():
-    kb = InlineKeyboardMarkup(row_width=2)
-    for name in get_categories():
-        cb = f"cat_{name}"
-        # Показываем эмодзи в меню
-        btn_text = get_category_with_emoji(name)
-        kb.add(InlineKeyboardButton(btn_text, callback_data=cb))
-    return kb
-
-# Кнопка пропуска для Izoh
-skip_kb = InlineKeyboardMarkup().add(InlineKeyboardButton("Пропустить", callback_data="skip_comment"))
-
-# Кнопки подтверждения
-confirm_kb = InlineKeyboardMarkup(row_width=2)
-confirm_kb.add(
-    InlineKeyboardButton('✅ Ha', callback_data='confirm_yes'),
-    InlineKeyboardButton('❌ Yo\'q', callback_data='confirm_no')
-)
-
-def clean_emoji(text):
-    # Удаляет только эмодзи/спецсимволы в начале строки, остальной текст не трогает
-    return re.sub(r'^[^\w\s]*', '', text).strip()
-
+    return categories_kb(get_categories(with_ids=True))
 
 
-def add_to_google_sheet(data):
+async def add_to_google_sheet(data):
     try:
-        creds = Credentials.from_service_account_file(CREDENTIALS_FILE, scopes=SCOPES)
-        gc = gspread.authorize(creds)
-        sh = gc.open_by_key(SHEET_ID)
-        
-        # Пробуем получить лист по названию
+        # Лист выбирается по объекту (таблица sheet_routes), у каждого листа своя очередь записи
         try:
-            worksheet = sh.worksheet(SHEET_NAME)
+            target = await in_executor(None, target_for, data.get('loyiha', ''))
         except Exception as e:
-            # Если не можем найти лист, пробуем получить первый лист
-            logging.error(f"Не удалось найти лист '{SHEET_NAME}': {e}")
-            worksheet = sh.get_worksheet(0)  # Получаем первый лист
-            logging.info(f"Используем первый лист: {worksheet.title}")
+            logging.error(f"Не удалось получить маршрут листа, пишем в лист по умолчанию: {e}")
+            target = DEFAULT_TARGET
         
         # Получаем текущее время
         from datetime import datetime
@@ -129,8 +125,12 @@ def add_to_google_sheet(data):
         date_str = now.strftime('%d.%m.%Y')
         
         # Определяем значения для столбцов Кирим и Чиқим
-        kirim = data.get('amount', '') if data.get('type') == 'Kirim' else ''
-        chiqim = data.get('amount', '') if data.get('type') == 'Ciqim' else ''
+        # В таблицу пишется число, а не введенная строка
+        # (у диалогов, начатых до обновления, amount_minor еще нет)
+        amount_minor = data.get('amount_minor') or parse_amount(data.get('amount', ''))
+        amount = amount_for_sheet(amount_minor)
+        kirim = amount if data.get('type') == 'Kirim' else ''
+        chiqim = amount if data.get('type') == 'Ciqim' else ''
         
         # Формируем строку для записи в таблицу
         # A: Сана, B: Кирим, C: Чиқим, D: остатка, E: Котегория, F: Изох, G: Объект номи, H: User
@@ -145,16 +145,9 @@ def add_to_google_sheet(data):
             data.get('user_name', '')    # H: User (имя пользователя)
         ]
         
-        worksheet.append_row(row)
-        logging.info(f"Данные успешно добавлены в Google Sheets: {row}")
-        
-        # Читаем данные из ячейки D1 (первая строка)
-        try:
-            d1_value = worksheet.acell('D1').value
-            if not d1_value:
-                d1_value = "0"
-        except:
-            d1_value = "0"
+        d1_value = await sheet_writers.append(target, row)
+        # Строка целиком - только в отладочном логе (с выборкой), без имени и комментария в INFO
+        logging.debug("Данные добавлены в Google Sheets: %s", row)
         
         return d1_value
         
@@ -162,34 +155,7 @@ def add_to_google_sheet(data):
         logging.error(f"Ошибка при добавлении в Google Sheets: {e}")
         raise e
 
-def format_summary(data):
-    tur_emoji = '🟢' if data.get('type') == 'Kirim' else '🔴'
-    dt = data.get('dt', datetime.now().strftime('%Y-%m-%d %H:%M:%S'))
-    # Показываем категорию с эмодзи
-    category_with_emoji = get_category_with_emoji(data.get('category', '-'))
-    return (
-        f"<b>Natija:</b>\n"
-        f"<b>Tur:</b> {tur_emoji} {data.get('type', '-')}\n"
-        f"<b>Summa:</b> {data.get('amount', '-')}\n"
-        f"<b>Kotegoriya:</b> {category_with_emoji}\n"
-        f"<b>Izoh:</b> {data.get('comment', '-')}\n"
-        f"<b>Объект номи:</b> {data.get('loyiha', '-')}\n"
-        f"<b>Vaqt:</b> {dt}"
-    )
-
-# --- Админы ---
-ADMINS = [5657091547, 5048593195]  # Здесь можно добавить id других админов через запятую
-
 # --- Инициализация БД ---
-def get_db_conn():
-    print(os.getenv('POSTGRES_DB'), os.getenv('POSTGRES_USER'), os.getenv('POSTGRES_PASSWORD'), os.getenv('POSTGRES_HOST'), os.getenv('POSTGRES_PORT'))
-    return psycopg2.connect(
-        dbname=os.getenv('POSTGRES_DB'),
-        user=os.getenv('POSTGRES_USER'),
-        password=os.getenv('POSTGRES_PASSWORD'),
-        host=os.getenv('POSTGRES_HOST'),
-        port=os.getenv('POSTGRES_PORT')
-    )
 
 def init_db():
     """Простая инициализация базы данных (для обратной совместимости)"""
@@ -252,20 +218,16 @@ def run_migrations():
     except Exception as e:
         logging.error(f"Ошибка при выполнении миграций: {e}")
 
-# Инициализируем базу данных
-init_db()
-
-# Запускаем миграции для добавления данных
-run_migrations()
+def setup_database():
+    """Таблицы и миграции: выполняется один раз при запуске бота, а не при импорте модуля"""
+    with boot.phase('database'):
+        init_db()
+        run_migrations()
 
 # --- Проверка статуса пользователя ---
 def get_user_status(user_id):
-    conn = get_db_conn()
-    c = conn.cursor()
-    c.execute('SELECT status FROM users WHERE user_id=%s', (user_id,))
-    row = c.fetchone()
-    conn.close()
-    return row[0] if row else None
+    user = get_user(user_id)
+    return user['status'] if user else None
 
 def register_user(user_id, name, phone):
     conn = get_db_conn()
@@ -280,6 +242,7 @@ def register_user(user_id, name, phone):
         c.execute('UPDATE users SET name=%s, phone=%s WHERE user_id=%s', (name, phone, user_id))
         conn.commit()
         conn.close()
+        invalidate_user(user_id)
         return False  # Возвращаем False, если пользователь уже существовал
     else:
         # Новый пользователь, добавляем
@@ -287,6 +250,7 @@ def register_user(user_id, name, phone):
                   (user_id, name, phone, 'pending', datetime.now().strftime('%Y-%m-%d %H:%M:%S')))
         conn.commit()
         conn.close()
+        invalidate_user(user_id)
         return True  # Возвращаем True, если пользователь новый
 
 def update_user_status(user_id, status):
@@ -295,44 +259,46 @@ def update_user_status(user_id, status):
     c.execute('UPDATE users SET status=%s WHERE user_id=%s', (status, user_id))
     conn.commit()
     conn.close()
+    invalidate_user(user_id)
 
 def get_user_name(user_id):
+    user = get_user(user_id)
+    return user['name'] if user else None
+
+# --- Получение актуальных списков ---
+def get_categories(with_ids=False):
     conn = get_db_conn()
     c = conn.cursor()
-    c.execute('SELECT name FROM users WHERE user_id=%s', (user_id,))
-    row = c.fetchone()
+    c.execute('SELECT id, name FROM categories')
+    rows = c.fetchall()
     conn.close()
-    return row[0] if row else None
+    return rows if with_ids else [row[1] for row in rows]
 
-# --- Получение актуальных списков ---
-def get_categories():
+def get_objects(with_ids=False):
     conn = get_db_conn()
     c = conn.cursor()
-    c.execute('SELECT name FROM categories')
-    result = [row[0] for row in c.fetchall()]
+    c.execute('SELECT id, name FROM objects')
+    rows = c.fetchall()
     conn.close()
-    return result
+    return rows if with_ids else [row[1] for row in rows]
 
-def get_objects():
+def get_name_by_id(table, item_id):
+    """Название категории или объекта по id из callback_data"""
     conn = get_db_conn()
     c = conn.cursor()
-    c.execute('SELECT name FROM objects')
-    result = [row[0] for row in c.fetchall()]
+    c.execute(sql.SQL('SELECT name FROM {} WHERE id=%s').format(sql.Identifier(table)), (item_id,))
+    row = c.fetchone()
     conn.close()
-    return result
+    return row[0] if row else None
 
 def get_objects_kb():
-    kb = InlineKeyboardMarkup(row_width=2)
-    for name in get_objects():
-        cb = f"obj_{name}"
-        kb.add(InlineKeyboardButton(name, callback_data=cb))
-    return kb
+    return objects_kb(get_objects(with_ids=True))
 
 # --- Основные команды ---
 @dp.message_handler(commands=['reboot'], state='*')
-async def reboot_cmd(msg: types.Message, state: FSMContext):
-    # Проверяем статус пользователя
-    user_status = get_user_status(msg.from_user.id)
+async def reboot_cmd(msg: types.Message, state: FSMContext, db_user=None):
+    # Проверяем статус пользователя (запись загружена UserContextMiddleware)
+    user_status = db_user['status'] if db_user else None
     if user_status is None:
         await msg.answer('❌ Siz ro\'yxatdan o\'tmagansiz. Iltimos, /register buyrug\'ini ishlatib ro\'yxatdan o\'ting.')
         return
@@ -345,9 +311,9 @@ async def reboot_cmd(msg: types.Message, state: FSMContext):
     await Form.type.set()
 
 @dp.message_handler(commands=['start'])
-async def start(msg: types.Message, state: FSMContext):
-    # Проверяем статус пользователя
-    user_status = get_user_status(msg.from_user.id)
+async def start(msg: types.Message, state: FSMContext, db_user=None):
+    # Проверяем статус пользователя (запись загружена UserContextMiddleware)
+    user_status = db_user['status'] if db_user else None
     if user_status is None:
         await msg.answer('❌ Siz ro\'yxatdan o\'tmagansiz. Iltimos, /register buyrug\'ini ishlatib ro\'yxatdan o\'ting.')
         return
@@ -359,39 +325,50 @@ async def start(msg: types.Message, state: FSMContext):
     text = "<b>Qaysi turdagi operatsiya?</b>"
     kb = InlineKeyboardMarkup(row_width=2)
     kb.add(
-        InlineKeyboardButton('🟢 Kirim', callback_data='type_kirim'),
-        InlineKeyboardButton('🔴 Chiqim', callback_data='type_chiqim')
+        InlineKeyboardButton('🟢 Kirim', callback_data=pack('type', 'kirim')),
+        InlineKeyboardButton('🔴 Chiqim', callback_data=pack('type', 'chiqim'))
     )
     await msg.answer(text, reply_markup=kb)
     await Form.type.set()
 
 # Kirim/Ciqim выбор
-@dp.callback_query_handler(lambda c: c.data.startswith('type_'), state=Form.type)
-async def process_type(call: types.CallbackQuery, state: FSMContext):
-    t = 'Kirim' if call.data == 'type_kirim' else 'Ciqim'
-    await state.update_data(type=t)
+@callbacks.route('type', ('kind', str), state=Form.type)
+async def process_type(call: types.CallbackQuery, state: FSMContext, kind: str):
+    t = 'Kirim' if kind == 'kirim' else 'Ciqim'
+    # Ключ черновика: повторное подтверждение той же записи не запишет ее второй раз
+    await state.update_data(type=t, entry_key=confirmations.new_entry_key())
     await call.message.edit_text("<b>Summani kiriting:</b>")
     await Form.amount.set()
     await call.answer()
 
 # Сумма
-@dp.message_handler(lambda m: m.text.replace('.', '', 1).isdigit(), state=Form.amount)
+@dp.message_handler(state=Form.amount, content_types=types.ContentTypes.TEXT)
 async def process_amount(msg: types.Message, state: FSMContext):
-    await state.update_data(amount=msg.text)
+    # Сумма разбирается один раз: дальше используется целое число тийинов
+    try:
+        amount_minor = parse_amount(msg.text)
+    except ValueError:
+        await msg.answer("❗️ Summa noto'g'ri. Masalan: <code>1500000</code>, <code>1 500 000</code> "
+                         "yoki <code>1 500 000.50</code>")
+        return
+    await state.update_data(amount=format_amount(amount_minor), amount_minor=amount_minor)
     await msg.answer("<b>Kotegoriyani tanlang:</b>", reply_markup=get_categories_kb())
     await Form.category.set()
 
 # Категория
-@dp.callback_query_handler(lambda c: c.data.startswith('cat_'), state=Form.category)
-async def process_category(call: types.CallbackQuery, state: FSMContext):
-    cat = call.data[4:]
+@callbacks.route('cat', ('category_id', int), state=Form.category)
+async def process_category(call: types.CallbackQuery, state: FSMContext, category_id: int):
+    cat = get_name_by_id('categories', category_id)
+    if cat is None:
+        await call.answer('Kategoriya topilmadi', show_alert=True)
+        return
     await state.update_data(category=cat)
     await call.message.edit_text("<b>Izoh kiriting (yoki пропустите):</b>", reply_markup=skip_kb)
     await Form.comment.set()
     await call.answer()
 
 # Кнопка пропуска комментария
-@dp.callback_query_handler(lambda c: c.data == 'skip_comment', state=Form.comment)
+@callbacks.route('skip', state=Form.comment)
 async def skip_comment_btn(call: types.CallbackQuery, state: FSMContext):
     await state.update_data(comment='-')
     await call.message.edit_text("<b>Объект номини танланг:</b>", reply_markup=get_objects_kb())
@@ -406,9 +383,12 @@ async def process_comment(msg: types.Message, state: FSMContext):
     await Form.object.set()
 
 # Объект (выбор из кнопок)
-@dp.callback_query_handler(lambda c: c.data.startswith('obj_'), state=Form.object)
-async def process_object_selection(call: types.CallbackQuery, state: FSMContext):
-    object_name = call.data[4:]  # Убираем 'obj_' из начала
+@callbacks.route('obj', ('object_id', int), state=Form.object)
+async def process_object_selection(call: types.CallbackQuery, state: FSMContext, object_id: int):
+    object_name = get_name_by_id('objects', object_id)
+    if object_name is None:
+        await call.answer('Obyekt topilmadi', show_alert=True)
+        return
     await state.update_data(loyiha=object_name)
     data = await state.get_data()
     
@@ -429,53 +409,106 @@ async def process_object_manual(msg: types.Message, state: FSMContext):
     await msg.answer(text, reply_markup=confirm_kb)
     await state.set_state('confirm')
 
+def object_balance_line(object_name, object_balance):
+    if object_balance is None:
+        return ''
+    return f"\n🏗️ <b>Остаток ({object_name}):</b> {format_amount(object_balance)}"
+
+def saved_entry_text(d1_value, object_name, object_balance):
+    """Ответ пользователю о сохраненной записи (и на повторное подтверждение той же записи)"""
+    return (
+        f"✅ Данные успешно отправлены в Google Sheets!\n\n"
+        f"💰 <b>Остаток сум:</b> {d1_value}"
+        f"{object_balance_line(object_name, object_balance)}"
+    )
+
+async def save_entry(call: types.CallbackQuery, data: dict, entry_key, db_user=None):
+    """Запись в таблицу и журнал, ответ пользователю и уведомление админам"""
+    from datetime import datetime
+    dt = datetime.now()
+    import platform
+    if platform.system() == 'Windows':
+        date_str = dt.strftime('%m/%d/%Y')
+    else:
+        date_str = dt.strftime('%-m/%-d/%Y')
+    time_str = dt.strftime('%H:%M')
+    data['dt_for_sheet'] = date_str
+    data['vaqt'] = time_str
+    # Гарантируем, что user_id всегда есть
+    data['user_id'] = call.from_user.id
+    # Добавляем имя пользователя для столбца User
+    user_name = (db_user and db_user['name']) or call.from_user.full_name
+    data['user_name'] = user_name
+    object_name = data.get('loyiha', '-')
+    try:
+        # Добавляем данные в Google Sheets и получаем данные из D1
+        d1_value = await add_to_google_sheet(data)
+    except Exception as e:
+        await call.message.answer(f'⚠️ Ошибка при отправке в Google Sheets: {e}')
+        # Запись не сохранилась - ее можно подтвердить снова
+        try:
+            await in_executor(None, confirmations.release, entry_key)
+        except Exception as release_error:
+            logging.error(f"Не удалось освободить ключ записи {entry_key}: {release_error}")
+        return
+
+    # Журнал, итоги для /report и остаток объекта; таблица остается основным хранилищем
+    object_balance = None
+    try:
+        _entry_id, object_balance = await in_executor(None, record_entry, data)
+    except Exception as e:
+        logging.error(f"Не удалось записать в журнал: {e}")
+    try:
+        await in_executor(None, confirmations.complete, entry_key, str(d1_value), object_name, object_balance)
+    except Exception as e:
+        logging.error(f"Не удалось сохранить результат подтверждения {entry_key}: {e}")
+
+    # Уведомление для пользователя с остатком из D1 и остатком объекта
+    await call.message.answer(saved_entry_text(d1_value, object_name, object_balance))
+
+    # Уведомление для админов с остатком из D1
+    summary_text = format_summary(data)
+    admin_notification_text = (
+        f"Foydalanuvchi <b>{user_name}</b> tomonidan kiritilgan yangi ma'lumot:\n\n"
+        f"{summary_text}\n\n"
+        f"💰 <b>Остаток сум:</b> {d1_value}"
+        f"{object_balance_line(object_name, object_balance)}"
+    )
+    # Доставка админам идет в фоне (сразу или сводкой), пользователь ее не ждет
+    admin_notifier.notify_entry(admin_notification_text)
+
 # Обработка кнопок Да/Нет
-@dp.callback_query_handler(lambda c: c.data in ['confirm_yes', 'confirm_no'], state='confirm')
-async def process_confirm(call: types.CallbackQuery, state: FSMContext):
-    if call.data == 'confirm_yes':
+@callbacks.route('confirm', ('answer', str), state='confirm')
+async def process_confirm(call: types.CallbackQuery, state: FSMContext, answer: str, db_user=None):
+    if answer == 'yes':
         data = await state.get_data()
-        from datetime import datetime
-        dt = datetime.now()
-        import platform
-        if platform.system() == 'Windows':
-            date_str = dt.strftime('%m/%d/%Y')
-        else:
-            date_str = dt.strftime('%-m/%-d/%Y')
-        time_str = dt.strftime('%H:%M')
-        data['dt_for_sheet'] = date_str
-        data['vaqt'] = time_str
-        # Гарантируем, что user_id всегда есть
-        data['user_id'] = call.from_user.id
-        # Добавляем имя пользователя для столбца User
-        data['user_name'] = get_user_name(call.from_user.id) or call.from_user.full_name
+        # Ключ черновика выдается при выборе типа; у диалогов, начатых до обновления, его нет
+        entry_key = data.get('entry_key') or confirmations.new_entry_key()
+        if not confirmations.start(entry_key):
+            # Первое нажатие еще обрабатывается - повторное ничего не записывает
+            await call.answer('⏳')
+            return
         try:
-            # Добавляем данные в Google Sheets и получаем данные из D1
-            d1_value = add_to_google_sheet(data)
-            
-            # Уведомление для пользователя с остатком из D1
-            user_notification = (
-                f"✅ Данные успешно отправлены в Google Sheets!\n\n"
-                f"💰 <b>Остаток сум:</b> {d1_value}"
-            )
-            await call.message.answer(user_notification)
-
-            # Уведомление для админов с остатком из D1
-            user_name = get_user_name(call.from_user.id) or call.from_user.full_name
-            summary_text = format_summary(data)
-            admin_notification_text = (
-                f"Foydalanuvchi <b>{user_name}</b> tomonidan kiritilgan yangi ma'lumot:\n\n"
-                f"{summary_text}\n\n"
-                f"💰 <b>Остаток сум:</b> {d1_value}"
-            )
-            
-            for admin_id in ADMINS:
+            saved = confirmations.cached_result(entry_key)
+            if saved is MISSING:
                 try:
-                    await bot.send_message(admin_id, admin_notification_text)
+                    saved = await in_executor(None, confirmations.claim, entry_key, call.from_user.id)
                 except Exception as e:
-                    logging.error(f"Could not send notification to admin {admin_id}: {e}")
-
-        except Exception as e:
-            await call.message.answer(f'⚠️ Ошибка при отправке в Google Sheets: {e}')
+                    # Без базы запись все равно сохраняется в таблицу (от двойного нажатия защищает start)
+                    logging.error(f"Не удалось проверить ключ записи {entry_key}: {e}")
+                    saved = None
+            if saved is not None and saved['status'] != confirmations.DONE:
+                # Эту запись сейчас сохраняет другой процесс бота
+                await call.answer('⏳')
+                return
+            if saved is not None:
+                # Запись уже сохранена: повторяем ее результат без второй записи в таблицу и журнал
+                await call.message.answer(
+                    saved_entry_text(saved['d1_value'], saved['object_name'], saved['object_balance']))
+            else:
+                await save_entry(call, data, entry_key, db_user)
+        finally:
+            confirmations.finish(entry_key)
         await state.finish()
     else:
         await call.message.answer('❌ Операция отменена.')
@@ -484,8 +517,8 @@ async def process_confirm(call: types.CallbackQuery, state: FSMContext):
     text = "<b>Qaysi turdagi operatsiya?</b>"
     kb = InlineKeyboardMarkup(row_width=2)
     kb.add(
-        InlineKeyboardButton('🟢 Kirim', callback_data='type_kirim'),
-        InlineKeyboardButton('🔴 Chiqim', callback_data='type_chiqim')
+        InlineKeyboardButton('🟢 Kirim', callback_data=pack('type', 'kirim')),
+        InlineKeyboardButton('🔴 Chiqim', callback_data=pack('type', 'chiqim'))
     )
     await call.message.answer(text, reply_markup=kb)
     await Form.type.set()
@@ -493,9 +526,9 @@ async def process_confirm(call: types.CallbackQuery, state: FSMContext):
 
 # --- Команды для пользователей ---
 @dp.message_handler(commands=['request_category'], state='*')
-async def request_category_cmd(msg: types.Message, state: FSMContext):
-    # Проверяем статус пользователя
-    user_status = get_user_status(msg.from_user.id)
+async def request_category_cmd(msg: types.Message, state: FSMContext, db_user=None):
+    # Проверяем статус пользователя (запись загружена UserContextMiddleware)
+    user_status = db_user['status'] if db_user else None
     if user_status is None:
         await msg.answer('❌ Siz ro\'yxatdan o\'tmagansiz. Iltimos, /register buyrug\'ini ishlatib ro\'yxatdan o\'ting.')
         return
@@ -526,8 +559,9 @@ async def process_category_request_name(msg: types.Message, state: FSMContext):
         request_date TEXT
     )''')
     
-    c.execute('INSERT INTO category_requests (user_id, user_name, category_name, request_date) VALUES (%s, %s, %s, %s)',
+    c.execute('INSERT INTO category_requests (user_id, user_name, category_name, request_date) VALUES (%s, %s, %s, %s) RETURNING id',
               (user_id, user_name, category_name, datetime.now().strftime('%Y-%m-%d %H:%M:%S')))
+    request_id = c.fetchone()[0]
     conn.commit()
     conn.close()
     
@@ -541,8 +575,8 @@ async def process_category_request_name(msg: types.Message, state: FSMContext):
     
     kb = InlineKeyboardMarkup(row_width=2)
     kb.add(
-        InlineKeyboardButton('✅ Qo\'shish', callback_data=f'approve_cat_{user_id}_{category_name}'),
-        InlineKeyboardButton('❌ Rad etish', callback_data=f'deny_cat_{user_id}_{category_name}')
+        InlineKeyboardButton('✅ Qo\'shish', callback_data=pack('catreq', 'approve', request_id)),
+        InlineKeyboardButton('❌ Rad etish', callback_data=pack('catreq', 'deny', request_id))
     )
     
     for admin_id in ADMINS:
@@ -556,9 +590,9 @@ async def process_category_request_name(msg: types.Message, state: FSMContext):
 
 # --- Команда для запроса объекта ---
 @dp.message_handler(commands=['request_object'], state='*')
-async def request_object_cmd(msg: types.Message, state: FSMContext):
-    # Проверяем статус пользователя
-    user_status = get_user_status(msg.from_user.id)
+async def request_object_cmd(msg: types.Message, state: FSMContext, db_user=None):
+    # Проверяем статус пользователя (запись загружена UserContextMiddleware)
+    user_status = db_user['status'] if db_user else None
     if user_status is None:
         await msg.answer('❌ Siz ro\'yxatdan o\'tmagansiz. Iltimos, /register buyrug\'ini ishlatib ro\'yxatdan o\'ting.')
         return
@@ -620,12 +654,11 @@ async def test_sheets_cmd(msg: types.Message, state: FSMContext):
     
     await state.finish()
     try:
-        creds = Credentials.from_service_account_file(CREDENTIALS_FILE, scopes=SCOPES)
-        gc = gspread.authorize(creds)
-        sh = gc.open_by_key(SHEET_ID)
+        sh = open_spreadsheet()
         
         # Получаем список всех листов
-        worksheets = sh.worksheets()
+        with sheets_op('worksheets'):
+            worksheets = sh.worksheets()
         sheet_names = [ws.title for ws in worksheets]
         
         await msg.answer(f'✅ Google Sheets подключен успешно!\n\n'
@@ -650,20 +683,13 @@ async def read_d1_cmd(msg: types.Message, state: FSMContext):
         await msg.answer('📖 Читаю данные из ячейки D1...')
         
         # Подключаемся к Google Sheets
-        creds = Credentials.from_service_account_file(CREDENTIALS_FILE, scopes=SCOPES)
-        gc = gspread.authorize(creds)
-        sh = gc.open_by_key(SHEET_ID)
-        
-        # Пробуем получить лист по названию
-        try:
-            worksheet = sh.worksheet(SHEET_NAME)
-        except Exception as e:
-            # Если не можем найти лист, пробуем получить первый лист
-            worksheet = sh.get_worksheet(0)
+        # Лист по названию, если его нет - первый лист
+        worksheet = open_worksheet()
         
         # Читаем данные из ячейки D1
         try:
-            d1_value = worksheet.acell('D1').value
+            with sheets_op('acell'):
+                d1_value = worksheet.acell('D1').value
             if not d1_value:
                 d1_value = "Пусто"
         except:
@@ -742,21 +768,22 @@ async def del_category_cmd(msg: types.Message, state: FSMContext):
         return
     await state.finish()  # Сброс состояния
     kb = InlineKeyboardMarkup(row_width=1)
-    for name in get_categories():
-        kb.add(InlineKeyboardButton(f'❌ {name}', callback_data=f'del_category_{name}'))
+    for category_id, name in get_categories(with_ids=True):
+        kb.add(InlineKeyboardButton(f'❌ {name}', callback_data=pack('delcat', category_id)))
     await msg.answer('O\'chirish uchun kategoriyani tanlang:', reply_markup=kb)
 
-@dp.callback_query_handler(lambda c: c.data.startswith('del_category_'))
-async def del_category_cb(call: types.CallbackQuery):
+@callbacks.route('delcat', ('category_id', int))
+async def del_category_cb(call: types.CallbackQuery, category_id: int):
     if call.from_user.id not in ADMINS:
         await call.answer('Faqat admin uchun!', show_alert=True)
         return
-    name = call.data[len('del_category_'):]
     conn = get_db_conn()
     c = conn.cursor()
-    c.execute('DELETE FROM categories WHERE name=%s', (name,))
+    c.execute('DELETE FROM categories WHERE id=%s RETURNING name', (category_id,))
+    row = c.fetchone()
     conn.commit()
     conn.close()
+    name = row[0] if row else category_id
     await call.message.edit_text(f'❌ Kategoriya o\'chirildi: {name}')
     await call.answer()
 
@@ -767,16 +794,19 @@ async def edit_category_cmd(msg: types.Message, state: FSMContext):
         return
     await state.finish()  # Сброс состояния
     kb = InlineKeyboardMarkup(row_width=1)
-    for name in get_categories():
-        kb.add(InlineKeyboardButton(f'✏️ {name}', callback_data=f'edit_category_{name}'))
+    for category_id, name in get_categories(with_ids=True):
+        kb.add(InlineKeyboardButton(f'✏️ {name}', callback_data=pack('editcat', category_id)))
     await msg.answer('Tahrirlash uchun kategoriyani tanlang:', reply_markup=kb)
 
-@dp.callback_query_handler(lambda c: c.data.startswith('edit_category_'))
-async def edit_category_cb(call: types.CallbackQuery, state: FSMContext):
+@callbacks.route('editcat', ('category_id', int))
+async def edit_category_cb(call: types.CallbackQuery, state: FSMContext, category_id: int):
     if call.from_user.id not in ADMINS:
         await call.answer('Faqat admin uchun!', show_alert=True)
         return
-    old_name = call.data[len('edit_category_'):]
+    old_name = get_name_by_id('categories', category_id)
+    if old_name is None:
+        await call.answer('Kategoriya topilmadi', show_alert=True)
+        return
     await state.update_data(edit_category_old=old_name)
     await call.message.answer(f'Yangi nomini yuboring (eski: {old_name}):')
     await state.set_state('edit_category_new')
@@ -841,16 +871,15 @@ async def block_user_cmd(msg: types.Message, state: FSMContext):
     kb = InlineKeyboardMarkup(row_width=1)
     for user_id, name, status in users:
         status_text = '✅ Tasdiqlangan' if status == 'approved' else '⏳ Kutilmoqda'
-        kb.add(InlineKeyboardButton(f'{status_text} - {name}', callback_data=f'blockuser_{user_id}'))
+        kb.add(InlineKeyboardButton(f'{status_text} - {name}', callback_data=pack('blockuser', user_id)))
     
     await msg.answer('Bloklash uchun foydalanuvchini tanlang:', reply_markup=kb)
 
-@dp.callback_query_handler(lambda c: c.data.startswith('blockuser_'))
-async def block_user_cb(call: types.CallbackQuery):
+@callbacks.route('blockuser', ('user_id', int))
+async def block_user_cb(call: types.CallbackQuery, user_id: int):
     if call.from_user.id not in ADMINS:
         await call.answer('Faqat admin uchun!', show_alert=True)
         return
-    user_id = int(call.data[len('blockuser_'):])
     update_user_status(user_id, 'blocked')
     await call.message.edit_text(f'❌ Foydalanuvchi bloklandi (ID: {user_id})')
     await call.answer()
@@ -959,8 +988,8 @@ async def approve_user_cmd(msg: types.Message, state: FSMContext):
     kb = InlineKeyboardMarkup(row_width=2)
     for user_id, name, status in users:
         kb.add(
-            InlineKeyboardButton(f'✅ {name}', callback_data=f'approveuser_{user_id}'),
-            InlineKeyboardButton(f'❌ {name}', callback_data=f'denyuser_{user_id}')
+            InlineKeyboardButton(f'✅ {name}', callback_data=pack('user', 'approve', user_id)),
+            InlineKeyboardButton(f'❌ {name}', callback_data=pack('user', 'deny', user_id))
         )
     
     await msg.answer('Tasdiqlash uchun foydalanuvchini tanlang:', reply_markup=kb)
@@ -1013,8 +1042,8 @@ async def process_register_phone(msg: types.Message, state: FSMContext):
         # Создаем клавиатуру с кнопками одобрения/отклонения
         kb = InlineKeyboardMarkup(row_width=2)
         kb.add(
-            InlineKeyboardButton('✅ Tasdiqlash', callback_data=f'approveuser_{msg.from_user.id}'),
-            InlineKeyboardButton('❌ Rad etish', callback_data=f'denyuser_{msg.from_user.id}')
+            InlineKeyboardButton('✅ Tasdiqlash', callback_data=pack('user', 'approve', msg.from_user.id)),
+            InlineKeyboardButton('❌ Rad etish', callback_data=pack('user', 'deny', msg.from_user.id))
         )
         
         for admin_id in ADMINS:
@@ -1030,29 +1059,13 @@ async def process_register_phone(msg: types.Message, state: FSMContext):
     await state.finish()
 
 # --- Обработка одобрения/отклонения пользователей ---
-@dp.callback_query_handler(lambda c: c.data.startswith('approveuser_') or c.data.startswith('denyuser_'), state='*')
-async def process_admin_approve(call: types.CallbackQuery, state: FSMContext):
-    if call.from_user.id not in ADMINS:
-        await call.answer('Faqat admin uchun!', show_alert=True)
-        return
-    
-    user_id = int(call.data.split('_')[1])
-    action = call.data.split('_')[0]
-    
-    if action == 'approveuser':
-        update_user_status(user_id, 'approved')
-
-# --- Обработка одобрения/отклонения пользователей ---
-@dp.callback_query_handler(lambda c: c.data.startswith('approveuser_') or c.data.startswith('denyuser_'), state='*')
-async def process_admin_approve(call: types.CallbackQuery, state: FSMContext):
+@callbacks.route('user', ('action', str), ('user_id', int))
+async def process_admin_approve(call: types.CallbackQuery, action: str, user_id: int):
     if call.from_user.id not in ADMINS:
         await call.answer('Faqat admin uchun!', show_alert=True)
         return
     
-    user_id = int(call.data.split('_')[1])
-    action = call.data.split('_')[0]
-    
-    if action == 'approveuser':
+    if action == 'approve':
         update_user_status(user_id, 'approved')
         await call.message.edit_text(f'✅ Foydalanuvchi tasdiqlandi (ID: {user_id})')
         # Уведомляем пользователя
@@ -1067,19 +1080,21 @@ async def process_admin_approve(call: types.CallbackQuery, state: FSMContext):
     await call.answer()
 
 # --- Обработка одобрения/отклонения категорий ---
-@dp.callback_query_handler(lambda c: c.data.startswith('approve_cat_') or c.data.startswith('deny_cat_'), state='*')
-async def process_category_approval(call: types.CallbackQuery, state: FSMContext):
+@callbacks.route('catreq', ('action', str), ('request_id', int))
+async def process_category_approval(call: types.CallbackQuery, action: str, request_id: int):
     if call.from_user.id not in ADMINS:
         await call.answer('Faqat admin uchun!', show_alert=True)
         return
     
-    data = call.data.split('_')
-    action = data[0]  # approve или deny
-    user_id = int(data[2])
-    category_name = '_'.join(data[3:])  # Объединяем оставшиеся части как название категории
-    
     conn = get_db_conn()
     c = conn.cursor()
+    c.execute('SELECT user_id, category_name FROM category_requests WHERE id=%s', (request_id,))
+    row = c.fetchone()
+    if row is None:
+        conn.close()
+        await call.answer('So\'rov topilmadi', show_alert=True)
+        return
+    user_id, category_name = row
     
     if action == 'approve':
         # Добавляем категорию в список категорий
@@ -1129,19 +1144,21 @@ async def process_category_approval(call: types.CallbackQuery, state: FSMContext
     await call.answer()
 
 # --- Обработка одобрения/отклонения объектов ---
-@dp.callback_query_handler(lambda c: c.data.startswith('approve_obj_') or c.data.startswith('deny_obj_'), state='*')
-async def process_object_approval(call: types.CallbackQuery, state: FSMContext):
+@callbacks.route('objreq', ('action', str), ('request_id', int))
+async def process_object_approval(call: types.CallbackQuery, action: str, request_id: int):
     if call.from_user.id not in ADMINS:
         await call.answer('Faqat admin uchun!', show_alert=True)
         return
     
-    data = call.data.split('_')
-    action = data[0]  # approve или deny
-    user_id = int(data[2])
-    object_name = '_'.join(data[3:])  # Объединяем оставшиеся части как название объекта
-    
     conn = get_db_conn()
     c = conn.cursor()
+    c.execute('SELECT user_id, object_name FROM object_requests WHERE id=%s', (request_id,))
+    row = c.fetchone()
+    if row is None:
+        conn.close()
+        await call.answer('So\'rov topilmadi', show_alert=True)
+        return
+    user_id, object_name = row
     
     if action == 'approve':
         # Добавляем объект в список объектов
@@ -1190,13 +1207,134 @@ async def process_object_approval(call: types.CallbackQuery, state: FSMContext):
     conn.close()
     await call.answer()
 
+# --- Разрешенные группы ---
+@dp.message_handler(commands=['allow_group'], chat_type=[types.ChatType.GROUP, types.ChatType.SUPERGROUP], state='*')
+async def allow_group_cmd(msg: types.Message):
+    if msg.from_user.id not in ADMINS:
+        return
+    allow_group(msg.chat.id, msg.chat.title, msg.from_user.id)
+    await msg.answer(f'✅ Guruh ruxsat etilganlar ro\'yxatiga qo\'shildi (ID: {msg.chat.id})')
+
+@dp.message_handler(commands=['deny_group'], chat_type=[types.ChatType.GROUP, types.ChatType.SUPERGROUP], state='*')
+async def deny_group_cmd(msg: types.Message):
+    if msg.from_user.id not in ADMINS:
+        return
+    deny_group(msg.chat.id)
+    await msg.answer(f'❌ Guruh ruxsat etilganlar ro\'yxatidan o\'chirildi (ID: {msg.chat.id})')
+
 # --- Блокировка неодобренных пользователей ---
-@dp.message_handler(lambda msg: get_user_status(msg.from_user.id) != 'approved', state='*')
+@dp.message_handler(lambda msg: not is_approved(msg), state='*')
 async def block_unapproved(msg: types.Message, state: FSMContext):
     if msg.text == '/register':
         return  # Пропускаем команду регистрации
     await msg.answer('❌ Sizning ro\'yxatdan o\'tishingiz hali tasdiqlanmagan. Iltimos, kuting yoki /register buyrug\'ini ishlatib qaytadan ro\'yxatdan o\'ting.')
 
+# --- Выбор языка ---
+@dp.message_handler(commands=['lang'], state='*')
+async def lang_cmd(msg: types.Message):
+    await msg.answer(_('Tilni tanlang:', get_lang(msg.from_user.id)), reply_markup=langMenu)
+
+@callbacks.route('lang', ('lang', str))
+async def lang_cb(call: types.CallbackQuery, lang: str):
+    if lang not in LANGUAGES:
+        await call.answer()
+        return
+    # Запись в базе и сброс кэшированного языка во всех процессах
+    set_lang(call.from_user.id, lang)
+    await call.message.edit_text(_("Til o'zgartirildi", lang))
+    await call.answer()
+
+# --- Техподдержка ---
+@dp.message_handler(commands=['support'], state='*')
+async def support_cmd(msg: types.Message, state: FSMContext):
+    """Одно сообщение в техподдержку; оператор отвечает кнопкой под ним"""
+    await state.finish()
+    if support_registry.least_loaded(free_only=False) is None:
+        await msg.answer('❗️ Texnik yordam operatorlari yo\'q')
+        return
+    keyboard = await support_keyboard(msg, messages='one')
+    await msg.answer(_('Texnik yordamga ga xabar yozing', get_lang(msg.from_user.id)), reply_markup=keyboard)
+
+@dp.message_handler(commands=['support_call'], state='*')
+async def support_call_cmd(msg: types.Message, state: FSMContext):
+    """Диалог с оператором: после его согласия сообщения пересылает SupportMiddleware"""
+    await state.finish()
+    keyboard = await support_keyboard(msg, messages='many')
+    if not keyboard:
+        await msg.answer('⏳ Hozir barcha operatorlar band. Birozdan keyin urinib ko\'ring.')
+        return
+    await msg.answer('💬 Operator bilan bog\'lanish uchun tugmani bosing', reply_markup=keyboard)
+
+@callbacks.route('ask_support', ('messages', str), ('user_id', int), ('as_user', str))
+async def ask_support_cb(call: types.CallbackQuery, state: FSMContext, messages: str, user_id: int, as_user: str):
+    await call.answer()
+    if messages == 'one':
+        # Следующее сообщение уйдет собеседнику user_id (оператору или, в ответе, пользователю)
+        await state.set_state('wait_for_support_message')
+        await state.update_data(second_id=user_id)
+        await call.message.answer('✍️ Xabaringizni yuboring')
+        return
+
+    if as_user == 'yes':
+        # Пользователь просит диалог: выбранный оператор мог стать занятым, тогда ищем другого
+        operator_id = user_id if support_registry.is_free(user_id) else await get_support_manager()
+        if operator_id is None:
+            await call.message.edit_text('⏳ Hozir barcha operatorlar band. Birozdan keyin urinib ko\'ring.')
+            return
+        await state.set_state('wait_in_support')
+        await state.update_data(second_id=operator_id)
+        keyboard = await support_keyboard(call, messages='many', user_id=call.from_user.id)
+        await bot.send_message(operator_id, f'💬 {call.from_user.full_name} texnik yordam so\'ramoqda',
+                               reply_markup=keyboard)
+        await call.message.edit_text('⏳ Operator javobini kuting', reply_markup=cancel_support(call, operator_id))
+        return
+
+    # Оператор принимает запрос пользователя user_id
+    user_state = dp.current_state(chat=user_id, user=user_id)
+    if await user_state.get_state() != 'wait_in_support':
+        await call.message.edit_text('❌ Foydalanuvchi so\'rovni bekor qildi')
+        return
+    if not support_registry.is_free(call.from_user.id):
+        await call.answer('⏳ Avval joriy suhbatlardan birini yakunlang', show_alert=True)
+        return
+    await start_support_session(call.from_user.id, user_id)
+    await call.message.edit_text('✅ Foydalanuvchi bilan aloqadasiz. Yakunlash uchun tugmani bosing.',
+                                 reply_markup=cancel_support(call, user_id))
+    await bot.send_message(user_id, '✅ Operator aloqada! Savolingizni yozing.',
+                           reply_markup=cancel_support_for(user_id, call.from_user.id))
+
+@dp.message_handler(state='wait_for_support_message', content_types=types.ContentTypes.ANY)
+async def support_message(msg: types.Message, state: FSMContext):
+    data = await state.get_data()
+    second_id = data.get('second_id')
+    await state.finish()
+    if second_id is None:
+        return
+    # Под сообщением - кнопка ответа отправителю
+    keyboard = await support_keyboard(msg, messages='one', user_id=msg.from_user.id)
+    await bot.send_message(second_id, '📩 Sizga xabar! Javob berish uchun pastdagi tugmani bosing')
+    await msg.copy_to(second_id, reply_markup=keyboard)
+    await msg.answer('✅ Xabar yuborildi')
+
+@dp.message_handler(state='wait_in_support', content_types=types.ContentTypes.ANY)
+async def support_waiting(msg: types.Message, state: FSMContext):
+    data = await state.get_data()
+    await msg.answer('⏳ Operator javobini kuting yoki so\'rovni bekor qiling',
+                     reply_markup=cancel_support(msg, data.get('second_id') or 0))
+
+@callbacks.route('cancel_support', ('user_id', int))
+async def cancel_support_cb(call: types.CallbackQuery, state: FSMContext, user_id: int):
+    await call.answer()
+    # user_id - собеседник: оператор с несколькими диалогами закрывает именно этот
+    partner_id = await end_support_session(call.from_user.id, user_id)
+    if partner_id is None:
+        # Диалог еще не начался (ждали оператора) или уже закрыт
+        if await state.get_state() in ('in_support', 'wait_in_support', 'wait_for_support_message'):
+            await state.finish()
+    else:
+        await bot.send_message(partner_id, '🔚 Suhbat yakunlandi')
+    await call.message.edit_text('🔚 Suhbat yakunlandi')
+
 # --- Команда для обновления категорий и объектов ---
 @dp.message_handler(commands=['update_data'], state='*')
 async def update_data_cmd(msg: types.Message):
@@ -1258,19 +1396,12 @@ async def update_balances_cmd(msg: types.Message, state: FSMContext):
         await msg.answer('🔄 Обновляю остатки в Google Sheets...')
         
         # Подключаемся к Google Sheets
-        creds = Credentials.from_service_account_file(CREDENTIALS_FILE, scopes=SCOPES)
-        gc = gspread.authorize(creds)
-        sh = gc.open_by_key(SHEET_ID)
-        
-        # Пробуем получить лист по названию
-        try:
-            worksheet = sh.worksheet(SHEET_NAME)
-        except Exception as e:
-            # Если не можем найти лист, пробуем получить первый лист
-            worksheet = sh.get_worksheet(0)
+        # Лист по названию, если его нет - первый лист
+        worksheet = open_worksheet()
         
         # Получаем все данные
-        all_values = worksheet.get_all_values()
+        with sheets_op('get_all_values'):
+            all_values = worksheet.get_all_values()
         
         if len(all_values) <= 1:  # Только заголовки или пустая таблица
             await msg.answer('📝 Таблица пуста или содержит только заголовки.')
@@ -1279,33 +1410,17 @@ async def update_balances_cmd(msg: types.Message, state: FSMContext):
         # Определяем начальную строку данных
         start_row = 1 if all_values[0][0] in ['Сана', 'Дата', 'Date'] else 0
         
-        # Обновляем остатки для каждой строки
+        # Обновляем остатки для каждой строки (целые тийины, без float)
         running_balance = 0
         updated_rows = 0
         
-        for i, row in enumerate(all_values[start_row:], start=start_row + 1):
-            if len(row) >= 3:  # Проверяем, что есть столбцы A, B, C
-                # Столбец B (Кирим) - доходы
-                kirim_str = str(row[1]).replace(',', '').replace(' ', '') if len(row) > 1 else '0'
-                # Столбец C (Чиқим) - расходы
-                chiqim_str = str(row[2]).replace(',', '').replace(' ', '') if len(row) > 2 else '0'
-                
-                try:
-                    kirim = float(kirim_str) if kirim_str and kirim_str != '' else 0
-                    chiqim = float(chiqim_str) if chiqim_str and chiqim_str != '' else 0
-                    running_balance += kirim - chiqim
-                    
-                    # Обновляем столбец D (остаток)
-                    worksheet.update_cell(i, 4, str(running_balance))
-                    updated_rows += 1
-                    
-                except ValueError:
-                    # Если не удается преобразовать в число, пропускаем
-                    continue
+        for i, running_balance in running_balances(all_values[start_row:], first_row=start_row + 1):
+            # Обновляем столбец D (остаток)
+            with sheets_op('update_cell'):
+                worksheet.update_cell(i, 4, amount_for_sheet(running_balance))
+            updated_rows += 1
         
-        # Получаем финальный остаток
-        final_balance = calculate_balance(worksheet)
-        balance_formatted = f"{final_balance:,.2f}".replace(',', ' ')
+        balance_formatted = format_amount(running_balance)
         
         await msg.answer(
             f"✅ Остатки успешно обновлены!\n\n"
@@ -1320,6 +1435,224 @@ async def update_balances_cmd(msg: types.Message, state: FSMContext):
         await msg.answer(error_msg)
         logging.error(error_msg)
 
+def parse_report_args(args):
+    """Аргументы /report и /export: 'период; obj=объект; cat=категория; format=xlsx'"""
+    period, options = None, {}
+    for part in (args or '').split(';'):
+        part = part.strip()
+        key, sep, value = part.partition('=')
+        if sep and key.strip() in ('obj', 'cat', 'format'):
+            options[key.strip()] = value.strip()
+        elif part:
+            period = part
+    return period, options.get('obj'), options.get('cat'), options
+
+REPORT_USAGE = (
+    '❗️ Davr noto\'g\'ri. Misollar:\n'
+    '/report today\n/report week\n/report month; obj=Сам Сити\n/report 2024\n'
+    '/report 2024-11; cat=Питание\n/report 01.11.2024-30.11.2024'
+)
+
+def format_report(report, date_from, date_to, object_name=None, category=None):
+    lines = [f"📊 <b>Hisobot: {date_from.strftime('%d.%m.%Y')} — {date_to.strftime('%d.%m.%Y')}</b>"]
+    if object_name:
+        lines.append(f"🏗️ Obyekt: {object_name}")
+    if category:
+        lines.append(f"📝 Kategoriya: {category}")
+    lines.append('')
+    lines.append(f"🟢 Kirim: {format_amount(report['kirim'])}")
+    lines.append(f"🔴 Chiqim: {format_amount(report['chiqim'])}")
+    lines.append(f"💰 Saldo: {format_amount(report['kirim'] - report['chiqim'])}")
+    lines.append(f"🧾 Yozuvlar: {report['entries']}")
+    # Разбивка по тому измерению, которое не зафиксировано фильтром
+    sections = []
+    if not object_name:
+        sections.append(('🏗️ <b>Obyektlar bo\'yicha:</b>', report['by_object']))
+    if not category:
+        sections.append(('📝 <b>Kategoriyalar bo\'yicha:</b>', report['by_category']))
+    for title, rows in sections:
+        if not rows:
+            continue
+        lines.append('')
+        lines.append(title)
+        for name, kirim, chiqim, entries in rows:
+            lines.append(f"• {name or '-'}: +{format_amount(kirim)} / -{format_amount(chiqim)} ({entries})")
+    return '\n'.join(lines)
+
+@dp.message_handler(commands=['report'], state='*')
+async def report_cmd(msg: types.Message, state: FSMContext):
+    """Итоги за период из ledger_daily_totals: /report month; obj=Сам Сити; cat=Питание"""
+    if msg.from_user.id not in ADMINS:
+        await msg.answer('❌ Faqat admin uchun!')
+        return
+    
+    await state.finish()
+    
+    period, object_name, category, _options = parse_report_args(msg.get_args())
+    try:
+        date_from, date_to = parse_period(period)
+    except ValueError:
+        await msg.answer(REPORT_USAGE)
+        return
+    
+    try:
+        report = get_report(date_from, date_to, object_name, category)
+    except Exception as e:
+        await msg.answer(f'❌ Xatolik yuz berdi: {str(e)}')
+        logging.error(f"Error building report: {e}")
+        return
+    
+    await msg.answer(format_report(report, date_from, date_to, object_name, category))
+
+@dp.message_handler(commands=['balances'], state='*')
+async def balances_cmd(msg: types.Message, state: FSMContext):
+    """Остатки по объектам из object_balances"""
+    if msg.from_user.id not in ADMINS:
+        await msg.answer('❌ Faqat admin uchun!')
+        return
+    
+    await state.finish()
+    balances = await in_executor(None, get_object_balances)
+    if not balances:
+        await msg.answer('📝 Obyektlar bo\'yicha qoldiqlar hali yo\'q.')
+        return
+    
+    text = '🏗️ <b>Obyektlar bo\'yicha qoldiq:</b>\n\n'
+    text += '\n'.join(f"• {name or '-'}: {format_amount(balance)}" for name, balance in balances)
+    await msg.answer(text)
+
+@dp.message_handler(commands=['rebuild_balances'], state='*')
+async def rebuild_balances_cmd(msg: types.Message, state: FSMContext):
+    """Полный пересчет остатков объектов из журнала"""
+    if msg.from_user.id not in ADMINS:
+        await msg.answer('❌ Faqat admin uchun!')
+        return
+    
+    await state.finish()
+    try:
+        count = await in_executor(None, rebuild_object_balances)
+    except Exception as e:
+        await msg.answer(f'❌ Xatolik yuz berdi: {str(e)}')
+        logging.error(f"Error rebuilding balances: {e}")
+        return
+    await msg.answer(f'✅ Qoldiqlar qayta hisoblandi: {count} ta obyekt')
+
+@dp.message_handler(commands=['sheet_route'], state='*')
+async def sheet_route_cmd(msg: types.Message, state: FSMContext):
+    """
+    Маршруты записей объектов в листы Google Sheets.
+
+    /sheet_route                                   - список маршрутов
+    /sheet_route Объект1, Объект2; SHEET_ID; Лист  - писать объекты в лист (необязательно: ; запросов в минуту)
+    /sheet_route Объект1, Объект2; -               - вернуть объекты в лист по умолчанию
+    """
+    if msg.from_user.id not in ADMINS:
+        await msg.answer('❌ Faqat admin uchun!')
+        return
+    
+    await state.finish()
+    parts = [part.strip() for part in (msg.get_args() or '').split(';')]
+    try:
+        if not parts[0]:
+            routes = await in_executor(None, get_routes)
+            text = (f"📄 <b>Varaqlar:</b>\n\nAsosiy: <code>{DEFAULT_TARGET.sheet_id}</code> / "
+                    f"{DEFAULT_TARGET.sheet_name}\n")
+            text += '\n'.join(f"• {name}: <code>{target.sheet_id}</code> / {target.sheet_name} "
+                               f"({target.requests_per_minute}/daq)" for name, target in sorted(routes.items()))
+            await msg.answer(text)
+            return
+        objects = [name.strip() for name in parts[0].split(',') if name.strip()]
+        if len(parts) == 2 and parts[1] == '-':
+            deleted = await in_executor(None, delete_route, objects)
+            await msg.answer(f'✅ Yo\'nalishlar o\'chirildi: {deleted} ta')
+            return
+        if len(parts) not in (3, 4) or not parts[1] or not parts[2]:
+            await msg.answer('❗️ Format: <code>/sheet_route Obyekt1, Obyekt2; SHEET_ID; Varaq; 60</code>')
+            return
+        rate = int(parts[3]) if len(parts) == 4 and parts[3] else None
+        if rate is not None and rate < 2:
+            raise ValueError(rate)
+        # Лист должен существовать: записи не должны молча уйти в первую вкладку чужой таблицы
+        try:
+            await in_executor(None, open_worksheet, parts[1], parts[2], False)
+        except Exception as e:
+            await msg.answer(f'❗️ Varaq topilmadi: <code>{parts[1]}</code> / {parts[2]}')
+            logging.error(f"Sheet route target not found: {e}")
+            return
+        await in_executor(None, set_route, objects, parts[1], parts[2], rate)
+    except ValueError:
+        await msg.answer('❗️ So\'rovlar soni 2 dan kichik bo\'lmagan butun son bo\'lishi kerak')
+        return
+    except Exception as e:
+        await msg.answer(f'❌ Xatolik yuz berdi: {str(e)}')
+        logging.error(f"Error updating sheet routes: {e}")
+        return
+    await msg.answer(f'✅ {len(objects)} ta obyekt yozuvlari <code>{parts[1]}</code> / {parts[2]} ga yoziladi')
+
+@dp.message_handler(commands=['export'], state='*')
+async def export_cmd(msg: types.Message, state: FSMContext):
+    """Выгрузка журнала в CSV/XLSX: /export 2024; obj=Сам Сити; format=xlsx"""
+    if msg.from_user.id not in ADMINS:
+        await msg.answer('❌ Faqat admin uchun!')
+        return
+    
+    await state.finish()
+    
+    period, object_name, category, options = parse_report_args(msg.get_args())
+    fmt = options.get('format', 'csv').lower()
+    if fmt not in EXPORT_FORMATS:
+        await msg.answer(f'❗️ Format: {", ".join(EXPORT_FORMATS)}')
+        return
+    try:
+        date_from, date_to = parse_period(period)
+    except ValueError:
+        await msg.answer(REPORT_USAGE.replace('/report', '/export'))
+        return
+    
+    await msg.answer('🔄 Fayl tayyorlanmoqda...')
+    # Строки идут из серверного курсора прямо в файл, в отдельном потоке
+    try:
+        path, count = await in_executor(
+            None, lambda: export_entries(iter_entries(date_from, date_to, object_name, category), fmt))
+    except ImportError:
+        await msg.answer('❌ XLSX uchun openpyxl o\'rnatilmagan. format=csv dan foydalaning.')
+        return
+    except Exception as e:
+        await msg.answer(f'❌ Xatolik yuz berdi: {str(e)}')
+        logging.error(f"Error exporting ledger: {e}")
+        return
+    
+    filename = f"kirim_chiqim_{date_from.strftime('%Y%m%d')}_{date_to.strftime('%Y%m%d')}.{fmt}"
+    try:
+        await msg.answer_document(types.InputFile(path, filename=filename),
+                                  caption=f'🧾 Yozuvlar: {count}')
+    finally:
+        os.remove(path)
+
+# --- Фоновые задачи ---
+async def send_daily_summary():
+    """Итоги дня по объектам: только сегодняшние строки ledger_daily_totals"""
+    today = datetime.now().date()
+    report = await in_executor(None, get_report, today, today)
+    if not report['entries']:
+        return
+    text = format_report(report, today, today)
+    for admin_id in ADMINS:
+        try:
+            await bot.send_message(admin_id, text)
+        except Exception as e:
+            logging.error(f"Could not send daily summary to admin {admin_id}: {e}")
+        await asyncio.sleep(0.05)
+
+scheduler.add_job('daily_summary', DAILY_SUMMARY_CRON, send_daily_summary, jitter=SCHEDULER_JITTER)
+
+async def purge_entry_confirmations():
+    """Старые ключи подтверждений больше не нужны: повторное нажатие через неделю невозможно"""
+    deleted = await in_executor(None, confirmations.purge_old)
+    logging.info(f"Удалено ключей подтверждений: {deleted}")
+
+scheduler.add_job('purge_entry_confirmations', '30 3 * * *', purge_entry_confirmations, jitter=SCHEDULER_JITTER)
+
 # --- Настройка команд бота ---
 async def set_user_commands(dp):
     await dp.bot.set_my_commands([
@@ -1345,6 +1678,27 @@ async def notify_all_users(bot):
         except Exception as e:
             logging.error(f"Could not send notification to user {user[0]}: {e}")
 
+def claim_reboot_notification(window_seconds):
+    """Атомарно отмечает рассылку о перезапуске.
+
+    Возвращает True, только если с прошлой рассылки прошло больше window_seconds.
+    Несколько перезапусков (или реплик) внутри окна получают False.
+    """
+    conn = get_db_conn()
+    c = conn.cursor()
+    try:
+        c.execute('''INSERT INTO bot_settings (key, value, updated_at)
+                     VALUES (%s, %s, NOW())
+                     ON CONFLICT (key) DO UPDATE SET value = EXCLUDED.value, updated_at = NOW()
+                     WHERE bot_settings.updated_at < NOW() - %s * INTERVAL '1 second'
+                     RETURNING key''',
+                  ('last_reboot_notify', datetime.now().strftime('%Y-%m-%d %H:%M:%S'), window_seconds))
+        claimed = c.fetchone() is not None
+        conn.commit()
+        return claimed
+    finally:
+        conn.close()
+
 async def notify_reboot(bot):
     """Уведомляет всех пользователей о перезагрузке бота"""
     conn = get_db_conn()
@@ -1360,19 +1714,84 @@ async def notify_reboot(bot):
             await bot.send_message(user[0], message)
         except Exception as e:
             logging.error(f"Could not notify user {user[0]} about reboot: {e}")
+        # Не превышаем лимит Telegram на массовую рассылку (~30 сообщений в секунду)
+        await asyncio.sleep(0.05)
     
     logging.info(f"Reboot notification sent to {len(users)} users")
 
+async def notify_reboot_coalesced(bot):
+    """Фоновая рассылка о перезапуске: не чаще одного раза за REBOOT_NOTIFY_WINDOW"""
+    try:
+        claimed = await in_executor(None, claim_reboot_notification, REBOOT_NOTIFY_WINDOW)
+        if not claimed:
+            logging.info("Reboot notification skipped: already sent within the last "
+                         f"{REBOOT_NOTIFY_WINDOW} seconds")
+            return
+        await notify_reboot(bot)
+    except Exception as e:
+        logging.error(f"Error sending reboot notifications: {e}")
+
+# Ссылки на фоновые задачи, чтобы их не собрал сборщик мусора
+background_tasks = set()
+# Сервер /metrics этого процесса (None, если выключен)
+metrics_runner = None
+
+def run_in_background(coro):
+    task = asyncio.create_task(coro)
+    background_tasks.add(task)
+    task.add_done_callback(background_tasks.discard)
+    return task
+
+async def on_global_startup(dp):
+    """Действия, которые выполняются один раз на весь бот (а не в каждом процессе)"""
+    await set_user_commands(dp)
+    logging.info('Bot started!')
+    
+    # Уведомляем пользователей о перезагрузке в фоне, не задерживая обработку обновлений
+    run_in_background(notify_reboot_coalesced(dp.bot))
+
+async def on_process_startup(dp, metrics_port=METRICS_PORT):
+    """Фоновые задачи каждого процесса, обрабатывающего апдейты"""
+    global metrics_runner
+    with boot.phase('startup'):
+        if metrics_port:
+            metrics_runner = await start_metrics_server(METRICS_HOST, metrics_port)
+        run_in_background(monitor_loop_lag())
+        # Сбросы кэшей пользователей и групп из других процессов бота
+        start_listener()
+        run_in_background(admin_notifier.run())
+        if SCHEDULER_ENABLED:
+            scheduler.start()
+        # Открытые диалоги поддержки переживают перезапуск через состояния FSM
+        if isinstance(dp.storage, PostgresStorage):
+            try:
+                support_registry.restore(await dp.storage.find_state('in_support'))
+            except Exception as e:
+                logging.error(f"Не удалось восстановить диалоги поддержки: {e}")
+    boot.report()
+
+async def on_startup(dp):
+    await on_global_startup(dp)
+    await on_process_startup(dp)
+
+async def on_shutdown(dp):
+    await scheduler.stop()
+    # Дописываем записи, которые еще в очередях листов
+    await sheet_writers.close()
+    if metrics_runner is not None:
+        await metrics_runner.cleanup()
+    # Отправляем накопленную сводку админам перед остановкой
+    await admin_notifier.close()
+
+# Модуль импортирован: хендлеры зарегистрированы, к базе и таблице еще не обращались
+boot.imported(BOOT_STARTED)
+
 # --- Запуск бота ---
 if __name__ == '__main__':
-    async def on_startup(dp):
-        await set_user_commands(dp)
-        logging.info('Bot started!')
-        
-        # Уведомляем всех пользователей о перезагрузке бота
-        try:
-            await notify_reboot(dp.bot)
-        except Exception as e:
-            logging.error(f"Error sending reboot notifications: {e}")
-    
-    executor.start_polling(dp, on_startup=on_startup, skip_updates=True)
+    setup_logging()
+    setup_database()
+    if RUN_MODE == 'webhook':
+        from utils.webhook import run_webhook
+        run_webhook(dp, on_startup=on_startup, on_shutdown=on_shutdown)
+    else:
+        executor.start_polling(dp, on_startup=on_startup, on_shutdown=on_shutdown, skip_updates=True)
@@ -0,0 +1,97 @@
+from environs import Env
+
+# Загрузка переменных окружения
+env = Env()
+env.read_env()
+
+BOT_TOKEN = env.str('BOT_TOKEN')
+
+# --- PostgreSQL ---
+POSTGRES_DB = env.str('POSTGRES_DB', 'kapital')
+POSTGRES_USER = env.str('POSTGRES_USER', 'postgres')
+POSTGRES_PASSWORD = env.str('POSTGRES_PASSWORD', 'postgres')
+POSTGRES_HOST = env.str('POSTGRES_HOST', 'localhost')
+POSTGRES_PORT = env.str('POSTGRES_PORT', '5432')
+
+# --- Google Sheets ---
+SHEET_ID = env.str('SHEET_ID', '1luwtoyzIsnCTmpbY5L-POpTSh5hNWlX8zGMr1GPIlFY')
+SHEET_NAME = env.str('SHEET_NAME', 'Кирим Чиким')
+CREDENTIALS_FILE = env.str('CREDENTIALS_FILE', 'credentials.json')
+# Бюджет запросов к Sheets API в минуту на каждый лист (свой для листа задается через /sheet_route)
+SHEET_REQUESTS_PER_MINUTE = env.int('SHEET_REQUESTS_PER_MINUTE', 60)
+# Сколько записей может ждать в очереди одного листа
+SHEET_QUEUE_SIZE = env.int('SHEET_QUEUE_SIZE', 1000)
+
+# id админов через запятую: ADMINS=5657091547,5048593195
+ADMINS = env.list('ADMINS', [5657091547, 5048593195], subcast=int)
+
+# Окно (в секундах), в течение которого повторные перезапуски не рассылают
+# уведомление пользователям повторно
+REBOOT_NOTIFY_WINDOW = env.int('REBOOT_NOTIFY_WINDOW', 1800)
+
+# Уведомления админам о новых записях: instant - сразу, digest - сводкой
+ADMIN_NOTIFY_MODE = env.str('ADMIN_NOTIFY_MODE', 'instant')
+# Сводка отправляется раз в N минут или при накоплении N записей
+ADMIN_DIGEST_INTERVAL = env.int('ADMIN_DIGEST_INTERVAL', 10)
+ADMIN_DIGEST_MAX_ENTRIES = env.int('ADMIN_DIGEST_MAX_ENTRIES', 20)
+
+# Хранилище состояний FSM: postgres - переживает перезапуск и общее для процессов, memory - в памяти
+FSM_STORAGE = env.str('FSM_STORAGE', 'postgres')
+
+# Антифлуд: не больше THROTTLE_RATE апдейтов в секунду от пользователя (пачкой до THROTTLE_BURST)
+THROTTLE_RATE = env.float('THROTTLE_RATE', 2)
+THROTTLE_BURST = env.int('THROTTLE_BURST', 10)
+
+# id операторов поддержки через запятую и сколько диалогов оператор ведет одновременно
+support_ids = env.list('SUPPORT_IDS', [], subcast=int)
+SUPPORT_CAPACITY = env.int('SUPPORT_CAPACITY', 1)
+
+# Проверка доступа пользователей и групп (SecurityMiddleware)
+SECURITY_ENABLED = env.bool('SECURITY_ENABLED', True)
+# Покидать группы, которых нет в списке разрешенных
+AUTO_LEAVE_GROUPS = env.bool('AUTO_LEAVE_GROUPS', False)
+
+# --- Режим запуска: polling или webhook ---
+RUN_MODE = env.str('RUN_MODE', 'polling')
+# Публичный адрес, на который Telegram отправляет апдейты (https://bot.example.com)
+WEBHOOK_HOST = env.str('WEBHOOK_HOST', '')
+WEBHOOK_PATH = env.str('WEBHOOK_PATH', '/webhook')
+# Секрет из заголовка X-Telegram-Bot-Api-Secret-Token
+WEBHOOK_SECRET = env.str('WEBHOOK_SECRET', '')
+# Самоподписанный сертификат (если TLS завершается в самом боте, а не в reverse-proxy)
+WEBHOOK_SSL_CERT = env.str('WEBHOOK_SSL_CERT', '')
+WEBHOOK_SSL_PRIV = env.str('WEBHOOK_SSL_PRIV', '')
+WEBAPP_HOST = env.str('WEBAPP_HOST', '0.0.0.0')
+WEBAPP_PORT = env.int('WEBAPP_PORT', 8080)
+
+# --- Шардирование (python ingress.py) ---
+# Количество процессов-обработчиков; по умолчанию - по числу ядер
+SHARD_WORKERS = env.int('SHARD_WORKERS', 0)
+# Размер очереди каждого обработчика и буфера входного процесса на случай его зависания
+SHARD_QUEUE_SIZE = env.int('SHARD_QUEUE_SIZE', 1000)
+SHARD_BACKLOG_SIZE = env.int('SHARD_BACKLOG_SIZE', 10000)
+
+# --- Планировщик фоновых задач ---
+SCHEDULER_ENABLED = env.bool('SCHEDULER_ENABLED', True)
+# Случайная задержка запуска задач (секунды), чтобы реплики не стучались в базу одновременно
+SCHEDULER_JITTER = env.int('SCHEDULER_JITTER', 30)
+# Ежедневная сводка админам (cron: минута час день месяц день_недели)
+DAILY_SUMMARY_CRON = env.str('DAILY_SUMMARY_CRON', '0 21 * * *')
+
+# --- Метрики Prometheus (GET /metrics) ---
+# 0 - не поднимать сервер метрик; обработчики шардов слушают METRICS_PORT + 1 + номер шарда
+METRICS_PORT = env.int('METRICS_PORT', 9101)
+METRICS_HOST = env.str('METRICS_HOST', '127.0.0.1')
+
+# --- Журнал медленных апдейтов ---
+# Апдейты дольше порога (мс) пишутся в лог slow_updates с разбивкой по DB/Sheets/Bot API; 0 - выключить
+SLOW_UPDATE_MS = env.int('SLOW_UPDATE_MS', 1000)
+
+# --- Логирование ---
+LOG_LEVEL = env.str('LOG_LEVEL', 'INFO')
+# json - одна JSON-строка на запись, text - обычный текст
+LOG_FORMAT = env.str('LOG_FORMAT', 'json')
+# Записи сверх размера очереди отбрасываются (счетчик bot_log_dropped_total), а не тормозят хендлеры
+LOG_QUEUE_SIZE = env.int('LOG_QUEUE_SIZE', 10000)
+# Из одинаковых отладочных сообщений в лог попадает каждое N-е
+LOG_DEBUG_SAMPLE_EVERY = env.int('LOG_DEBUG_SAMPLE_EVERY', 100)
@@ -0,0 +1,17 @@
+#!/usr/bin/env python3
+"""
+Входной процесс Kapital Sheet Bot для работы на нескольких ядрах.
+
+Получает апдейты (polling или webhook, см. RUN_MODE) и распределяет их по
+SHARD_WORKERS процессам-обработчикам по хэшу from_user.id.
+"""
+
+import os
+
+from data.config import SHARD_WORKERS
+from utils.misc.logging import setup_logging
+from utils.sharding import run_ingress
+
+if __name__ == "__main__":
+    setup_logging()
+    run_ingress(SHARD_WORKERS or os.cpu_count() or 1)
@@ -1,22 +1,31 @@
+from functools import lru_cache
+
 from aiogram.types import ReplyKeyboardMarkup, KeyboardButton
 
 from translation import _
+from utils.db_api.users import get_lang
 
 
 def get_lang_for_button(message):
+    return _main_menu(get_lang(message.from_user.id))
+
+
+# Клавиатуры строятся один раз на язык и дальше переиспользуются
+@lru_cache(maxsize=None)
+def _main_menu(lang):
     button = ReplyKeyboardMarkup(
         keyboard=[
             [
-                KeyboardButton(text="Yangiliklarni soat nechida olishni hohlaysiz?")
+                KeyboardButton(text=_("Yangiliklarni soat nechida olishni hohlaysiz?", lang))
             ],
             [
-                KeyboardButton(text="FAQ ?")
+                KeyboardButton(text=_("FAQ ?", lang))
             ],
             [
-                KeyboardButton(text="Centris Towers bilan bog'lanish")
+                KeyboardButton(text=_("Centris Towers bilan bog'lanish", lang))
             ],
             [
-                KeyboardButton(text="Bino bilan tanishish")
+                KeyboardButton(text=_("Bino bilan tanishish", lang))
             ],
         ],
         resize_keyboard=True
@@ -24,13 +33,18 @@ def get_lang_for_button(message):
     return button
 
 
-def key():
+def key(lang=None):
+    return _contact_keyboard(lang)
+
+
+@lru_cache(maxsize=None)
+def _contact_keyboard(lang):
     keyboardcontakt = ReplyKeyboardMarkup(
         keyboard=[
             [
-                KeyboardButton(text="Kontakni yuborish", request_contact=True)
+                KeyboardButton(text=_("Kontakni yuborish", lang), request_contact=True)
             ],
         ],
         resize_keyboard=True
     )
-    return keyboardcontakt
\ No newline at end of file
+    return keyboardcontakt
@@ -0,0 +1,41 @@
+from aiogram.types import InlineKeyboardMarkup, InlineKeyboardButton
+
+from utils.misc.callback_router import pack
+from utils.misc.formatting import get_category_with_emoji
+
+# Кнопки выбора Kirim/Chiqim
+start_kb = InlineKeyboardMarkup(row_width=2)
+start_kb.add(
+    InlineKeyboardButton('🟢 Kirim', callback_data=pack('type', 'kirim')),
+    InlineKeyboardButton('🔴 Chiqim', callback_data=pack('type', 'chiqim'))
+)
+
+# Кнопка пропуска для Izoh
+skip_kb = InlineKeyboardMarkup().add(InlineKeyboardButton("Пропустить", callback_data=pack('skip')))
+
+# Кнопки подтверждения
+confirm_kb = InlineKeyboardMarkup(row_width=2)
+confirm_kb.add(
+    InlineKeyboardButton('✅ Ha', callback_data=pack('confirm', 'yes')),
+    InlineKeyboardButton('❌ Yo\'q', callback_data=pack('confirm', 'no'))
+)
+
+
+def categories_kb(rows):
+    """Клавиатура категорий из строк (id, name) таблицы categories"""
+    kb = InlineKeyboardMarkup(row_width=2)
+    for category_id, name in rows:
+        cb = pack('cat', category_id)
+        # Показываем эмодзи в меню
+        btn_text = get_category_with_emoji(name)
+        kb.add(InlineKeyboardButton(btn_text, callback_data=cb))
+    return kb
+
+
+def objects_kb(rows):
+    """Клавиатура объектов из строк (id, name) таблицы objects"""
+    kb = InlineKeyboardMarkup(row_width=2)
+    for object_id, name in rows:
+        cb = pack('obj', object_id)
+        kb.add(InlineKeyboardButton(name, callback_data=cb))
+    return kb
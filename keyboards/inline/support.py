@@ -1,43 +1,66 @@
-import random
+from functools import lru_cache
 
+from aiogram import Dispatcher
 from aiogram.types import InlineKeyboardMarkup, InlineKeyboardButton
 from aiogram.utils.callback_data import CallbackData
 
-from data.config import support_ids
-from db import db
-from loader import dp
 from translation import _
+from utils.db_api.users import get_lang
+from utils.misc.callback_router import pack
+from utils.misc.support_registry import support_registry, share_start, share_end
+from utils.misc.tracing import in_executor
 
 support_callback = CallbackData("ask_support", "messages", "user_id", "as_user")
 cancel_support_callback = CallbackData("cancel_support", "user_id")
 
 
 async def check_support_available(support_id):
-    state = dp.current_state(chat=support_id, user=support_id)
-    state_str = str(
-        await state.get_state()
-    )
-    if state_str == "in_support":
-        return
-    else:
+    # Занятость оператора берется из реестра, без чтения его состояния FSM
+    if support_registry.is_free(support_id):
         return support_id
 
 
 async def get_support_manager():
-    random.shuffle(support_ids)
-    for support_id in support_ids:
-        # Проверим если оператор в данное время не занят
-        support_id = await check_support_available(support_id)
-
-        # Если такого нашли, что выводим
-        if support_id:
-            return support_id
+    # Наименее загруженный свободный оператор
+    return support_registry.least_loaded()
+
+
+async def start_support_session(operator_id, user_id):
+    """Соединяет пользователя с оператором: оба переходят в in_support"""
+    dp = Dispatcher.get_current()
+    for first_id, second_id in ((user_id, operator_id), (operator_id, user_id)):
+        state = dp.current_state(chat=first_id, user=first_id)
+        await state.set_state("in_support")
+        await state.update_data(second_id=second_id)
+    # Реестр обновляется во всех процессах: оператор и пользователь могут быть в разных шардах
+    await in_executor(None, share_start, operator_id, user_id)
+
+
+async def end_support_session(participant_id, partner_id=None):
+    """
+    Завершает диалог поддержки для обоих участников; возвращает id собеседника или None.
+
+    Оператор с несколькими диалогами передает partner_id - пользователя, чей диалог
+    закрывается (без него закрывается последний подключенный).
+    """
+    dp = Dispatcher.get_current()
+    operator_id, user_id = support_registry.pair(participant_id, partner_id)
+    if operator_id is None:
+        return None
+    await in_executor(None, share_end, operator_id, user_id)
+    await dp.current_state(chat=user_id, user=user_id).reset_state()
+    operator_state = dp.current_state(chat=operator_id, user=operator_id)
+    remaining_id = support_registry.partner(operator_id)
+    if remaining_id is None:
+        await operator_state.reset_state()
     else:
-        return
+        # У оператора остались другие диалоги - его сообщения уходят последнему из них
+        await operator_state.update_data(second_id=remaining_id)
+    return user_id if participant_id == operator_id else operator_id
 
 
 async def support_keyboard(message,messages, user_id=None):
-    lang = db.get_lang(message.from_user.id)
+    lang = get_lang(message.from_user.id)
     keyboard = InlineKeyboardMarkup()
     if user_id:
         # Есле указан второй айдишник - значит эта кнопка для оператора
@@ -66,7 +89,21 @@ async def support_keyboard(message,messages, user_id=None):
             # Если не нашли свободного оператора - выходим и говорим, что его нет
             return False
         elif messages == "one" and contact_id is None:
-            contact_id = random.choice(support_ids)
+            contact_id = support_registry.least_loaded(free_only=False)
+
+        if messages == "many":
+            # Запрос диалога: оператор получит его вместе с кнопкой согласия
+            keyboard.add(
+                InlineKeyboardButton(
+                    text=_("Operator bilan bog'lanish",lang),
+                    callback_data=support_callback.new(
+                        messages=messages,
+                        user_id=contact_id,
+                        as_user=as_user
+                    )
+                )
+            )
+            return keyboard
 
         if messages == "one":
             text = _("Texnik yordamga ga xabar yozing",lang)
@@ -99,7 +136,17 @@ async def support_keyboard(message,messages, user_id=None):
 
 
 def cancel_support(messages,user_id):
-    lang = db.get_lang(messages.from_user.id)
+    return _cancel_support_keyboard(get_lang(messages.from_user.id), int(user_id))
+
+
+def cancel_support_for(chat_id, user_id):
+    """Клавиатура завершения диалога для chat_id (на его языке); user_id - собеседник"""
+    return _cancel_support_keyboard(get_lang(chat_id), int(user_id))
+
+
+# Клавиатуры строятся один раз на язык (и собеседника) и дальше переиспользуются
+@lru_cache(maxsize=1024)
+def _cancel_support_keyboard(lang, user_id):
     return InlineKeyboardMarkup(
         inline_keyboard=[
             [
@@ -116,13 +163,17 @@ def cancel_support(messages,user_id):
 
 langMenu=InlineKeyboardMarkup(row_width=2)
 
-langUZ=InlineKeyboardButton(text="O'zbek",callback_data='lang_uz')
-langRU=InlineKeyboardButton(text="Русский",callback_data='lang_ru')
+langUZ=InlineKeyboardButton(text="O'zbek",callback_data=pack('lang', 'uz'))
+langRU=InlineKeyboardButton(text="Русский",callback_data=pack('lang', 'ru'))
 
 langMenu.insert(langUZ)
 langMenu.insert(langRU)
 def yesno(message,user_id):
-    lang = db.get_lang(message.from_user.id)
+    return _yesno_keyboard(get_lang(message.from_user.id))
+
+
+@lru_cache(maxsize=None)
+def _yesno_keyboard(lang):
     ha=_("Ha",lang)
     yoq=_("Yo'q",lang)
     langokno=InlineKeyboardMarkup(row_width=2)
@@ -133,4 +184,3 @@ def yesno(message,user_id):
     langokno.insert(langok)
     langokno.insert(langno)
     return langokno
-
@@ -1,10 +1,19 @@
 from aiogram import Dispatcher
 
-from loader import dp
+from data.config import THROTTLE_RATE, THROTTLE_BURST, SLOW_UPDATE_MS
+from tgbotmuvofiqiyat.middlewares.security_middleware import SecurityMiddleware
+from .metrics import MetricsMiddleware
 from .throttling import ThrottlingMiddleware
+from .timing import TimingMiddleware
 from .support_middleware import SupportMiddleware
+from .user_context import UserContextMiddleware
 
 
-if __name__ == "middlewares":
-    dp.middleware.setup(ThrottlingMiddleware())
+def setup(dp: Dispatcher):
+    if SLOW_UPDATE_MS:
+        dp.middleware.setup(TimingMiddleware(threshold_ms=SLOW_UPDATE_MS))
+    dp.middleware.setup(MetricsMiddleware())
+    dp.middleware.setup(ThrottlingMiddleware(user_rate=THROTTLE_RATE, user_burst=THROTTLE_BURST))
+    dp.middleware.setup(UserContextMiddleware())
+    dp.middleware.setup(SecurityMiddleware())
     dp.middleware.setup(SupportMiddleware())
@@ -0,0 +1,63 @@
+import sys
+import time
+
+from aiogram import types
+from aiogram.dispatcher.handler import current_handler
+from aiogram.dispatcher.middlewares import BaseMiddleware
+
+from utils.misc.boot import boot
+from utils.misc.metrics import Counter, Histogram
+
+HANDLER_SECONDS = Histogram('bot_handler_seconds', 'Длительность обработки апдейта хендлером', ['handler'])
+HANDLER_ERRORS = Counter('bot_handler_errors_total', 'Исключения в хендлерах', ['handler', 'error'])
+
+
+def handler_name(data: dict):
+    """Имя хендлера текущего апдейта (для кнопок - хендлер маршрута, а не общий dispatch)"""
+    route = data.get('callback_route')
+    if route is not None:
+        return route.handler.__name__
+    handler = current_handler.get(None)
+    return getattr(handler, '__name__', 'unknown')
+
+
+class MetricsMiddleware(BaseMiddleware):
+    """
+    Гистограмма времени работы хендлеров и счетчик их ошибок.
+
+    Отсчет начинается, когда фильтры выбрали хендлер (process_*), и заканчивается
+    в post_process_*, который aiogram вызывает и после исключения в хендлере.
+    """
+
+    async def _start(self, data: dict):
+        data['metrics_handler'] = handler_name(data)
+        data['metrics_started'] = time.perf_counter()
+
+    async def _finish(self, data: dict):
+        started = data.get('metrics_started')
+        if started is None:
+            # Апдейт отменен раньше (троттлинг, поддержка) или ни один хендлер не подошел
+            return
+        name = data['metrics_handler']
+        HANDLER_SECONDS.observe(time.perf_counter() - started, handler=name)
+        # post_process вызывается из finally - исключение хендлера еще "в полете"
+        error = sys.exc_info()[0]
+        if error is not None:
+            HANDLER_ERRORS.inc(handler=name, error=error.__name__)
+
+    async def on_pre_process_update(self, update: types.Update, data: dict):
+        # Время от старта процесса до первого апдейта (один раз)
+        if not boot.first_update_seen:
+            boot.first_update()
+
+    async def on_process_message(self, message: types.Message, data: dict):
+        await self._start(data)
+
+    async def on_post_process_message(self, message: types.Message, results, data: dict):
+        await self._finish(data)
+
+    async def on_process_callback_query(self, call: types.CallbackQuery, data: dict):
+        await self._start(data)
+
+    async def on_post_process_callback_query(self, call: types.CallbackQuery, results, data: dict):
+        await self._finish(data)
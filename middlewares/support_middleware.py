@@ -4,7 +4,7 @@ from aiogram import types
 from aiogram.dispatcher.handler import CancelHandler
 from aiogram.dispatcher.middlewares import BaseMiddleware
 
-from loader import dp
+from utils.misc.support_registry import support_registry
 
 
 # Создадим миддлварь, в котором полностью будет  проходить обработка сообщений
@@ -13,18 +13,14 @@ from loader import dp
 class SupportMiddleware(BaseMiddleware):
 
     async def on_pre_process_message(self, message: types.Message, data: dict):
-        # Для начала достанем состояние текущего пользователя,
-        # так как state: FSMContext нам сюда не прилетит
-        state = dp.current_state(chat=message.from_user.id, user=message.from_user.id)
+        # Собеседник берется из реестра диалогов: для тех, кто не в поддержке,
+        # это один поиск в словаре без чтения состояния FSM
+        second_id = support_registry.partner(message.from_user.id)
+        if second_id is None:
+            return
 
-        # Получим строчное значение стейта и сравним его
-        state_str = str(await state.get_state())
-        if state_str == "in_support":
+        # Отправим сообщение второму участнику диалога
+        await message.copy_to(second_id)
 
-            # Заберем айди второго пользователя и отправим ему сообщение
-            data = await state.get_data()
-            second_id = data.get("second_id")
-            await message.copy_to(second_id)
-
-            # Не пропустим дальше обработку в хендлеры
-            raise CancelHandler()
+        # Не пропустим дальше обработку в хендлеры
+        raise CancelHandler()
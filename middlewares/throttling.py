@@ -1,44 +1,139 @@
-import asyncio
+import time
 
-from aiogram import types, Dispatcher
+from aiogram import types
 from aiogram.dispatcher import DEFAULT_RATE_LIMIT
 from aiogram.dispatcher.handler import CancelHandler, current_handler
 from aiogram.dispatcher.middlewares import BaseMiddleware
-from aiogram.utils.exceptions import Throttled
 
-from db import db
 from translation import _
+from utils.db_api.users import get_cached_lang
+from utils.misc.metrics import Counter
+
+THROTTLED_UPDATES = Counter('bot_throttled_updates_total', 'Отклоненные из-за флуда апдейты', ['kind'])
+
+
+class TokenBuckets:
+    """
+    Набор token bucket в компактном виде: ключ -> [токены, время последнего пополнения].
+
+    Ведро пополняется со скоростью rate токенов в секунду до burst.
+    Ключи, которые не использовались дольше idle_ttl, периодически удаляются.
+    """
+
+    __slots__ = ('rate', 'burst', 'idle_ttl', '_buckets', '_next_cleanup')
+
+    def __init__(self, rate, burst, idle_ttl=300):
+        self.rate = rate
+        self.burst = burst
+        self.idle_ttl = idle_ttl
+        self._buckets = {}
+        self._next_cleanup = time.monotonic() + idle_ttl
+
+    def consume(self, key, rate=None, burst=None) -> bool:
+        rate = rate or self.rate
+        burst = burst or self.burst
+        now = time.monotonic()
+        if now >= self._next_cleanup:
+            self._evict_idle(now)
+
+        bucket = self._buckets.get(key)
+        if bucket is None:
+            self._buckets[key] = [burst - 1, now]
+            return True
+
+        tokens = min(burst, bucket[0] + (now - bucket[1]) * rate)
+        bucket[1] = now
+        if tokens >= 1:
+            bucket[0] = tokens - 1
+            return True
+        bucket[0] = tokens
+        return False
+
+    def _evict_idle(self, now):
+        deadline = now - self.idle_ttl
+        for key in [key for key, bucket in self._buckets.items() if bucket[1] < deadline]:
+            del self._buckets[key]
+        self._next_cleanup = now + self.idle_ttl
+
+    def __len__(self):
+        return len(self._buckets)
 
 
 class ThrottlingMiddleware(BaseMiddleware):
     """
-    Simple middleware
+    Ограничение частоты запросов от одного пользователя.
+
+    Два уровня: общий бюджет пользователя (user_rate апдейтов в секунду, пачкой до user_burst)
+    и бюджет на конкретный хендлер - один вызов раз в limit секунд, limit задается
+    декоратором rate_limit (по умолчанию DEFAULT_RATE_LIMIT).
     """
 
-    def __init__(self, limit=DEFAULT_RATE_LIMIT, key_prefix='antiflood_'):
+    def __init__(self, limit=DEFAULT_RATE_LIMIT, key_prefix='antiflood_', user_rate=2, user_burst=10):
         self.rate_limit = limit
         self.prefix = key_prefix
+        self.user_buckets = TokenBuckets(rate=user_rate, burst=user_burst)
+        self.handler_buckets = TokenBuckets(rate=1 / limit if limit else 1, burst=1)
+        self._warned = {}
         super(ThrottlingMiddleware, self).__init__()
 
-    async def on_process_message(self, message: types.Message, data: dict):
-        handler = current_handler.get()
-        dispatcher = Dispatcher.get_current()
+    def _check_user(self, user_id, kind):
+        if self.user_buckets.consume(user_id):
+            return True
+        THROTTLED_UPDATES.inc(kind=kind)
+        return False
+
+    def _check_handler(self, user_id, kind, data=None):
+        # Нажатия кнопок приходят в общий CallbackRouter.dispatch - лимит берется
+        # с хендлера маршрута, который CallbackRouter.check положил в data
+        route = (data or {}).get('callback_route')
+        handler = route.handler if route is not None else current_handler.get()
         if handler:
             limit = getattr(handler, "throttling_rate_limit", self.rate_limit)
             key = getattr(handler, "throttling_key", f"{self.prefix}_{handler.__name__}")
         else:
             limit = self.rate_limit
-            key = f"{self.prefix}_message"
-        try:
-            await dispatcher.throttle(key, rate=limit)
-        except Throttled as t:
-            await self.message_throttled(message, t)
-            raise CancelHandler()
-
-    async def message_throttled(self, message: types.Message, throttled: Throttled):
-        if throttled.exceeded_count <= 2:
-            try:
-                lang = db.get_lang(message.from_user.id)
-                await message.reply(_("Juda ko'p so'rovlar!",lang))
-            except Exception as ex:
-                await message.reply("Juda ko'p so'rovlar!")
\ No newline at end of file
+            key = f"{self.prefix}_{kind}"
+        if limit and not self.handler_buckets.consume((user_id, key), rate=1 / limit, burst=1):
+            THROTTLED_UPDATES.inc(kind=kind)
+            return False
+        self._warned.pop(user_id, None)
+        return True
+
+    def _should_warn(self, user_id):
+        # Предупреждаем о флуде только первые пару раз подряд, дальше молча отбрасываем
+        count = self._warned.get(user_id, 0) + 1
+        self._warned[user_id] = count
+        if len(self._warned) > 10000:
+            self._warned.clear()
+        return count <= 2
+
+    # Общий бюджет пользователя проверяется до фильтров и остальных middleware,
+    # чтобы флуд не доходил даже до загрузки пользователя из базы
+    async def on_pre_process_message(self, message: types.Message, data: dict):
+        if not self._check_user(message.from_user.id, 'message'):
+            await self._reject_message(message)
+
+    async def on_process_message(self, message: types.Message, data: dict):
+        if not self._check_handler(message.from_user.id, 'message'):
+            await self._reject_message(message)
+
+    async def on_pre_process_callback_query(self, call: types.CallbackQuery, data: dict):
+        if not self._check_user(call.from_user.id, 'callback_query'):
+            await self._reject_callback(call)
+
+    async def on_process_callback_query(self, call: types.CallbackQuery, data: dict):
+        if not self._check_handler(call.from_user.id, 'callback_query', data):
+            await self._reject_callback(call)
+
+    async def _reject_message(self, message: types.Message):
+        if self._should_warn(message.from_user.id):
+            await self.message_throttled(message)
+        raise CancelHandler()
+
+    async def _reject_callback(self, call: types.CallbackQuery):
+        if self._should_warn(call.from_user.id):
+            await call.answer(_("Juda ko'p so'rovlar!", get_cached_lang(call.from_user.id)))
+        raise CancelHandler()
+
+    async def message_throttled(self, message: types.Message):
+        await message.reply(_("Juda ko'p so'rovlar!", get_cached_lang(message.from_user.id)))
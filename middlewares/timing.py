@@ -0,0 +1,73 @@
+import logging
+
+from aiogram import Dispatcher, types
+from aiogram.dispatcher.middlewares import BaseMiddleware
+
+from utils.misc.metrics import Counter
+from utils.misc.tracing import start_trace, finish_trace, current_trace
+from .metrics import handler_name
+
+SLOW_UPDATES = Counter('bot_slow_updates_total', 'Апдейты дольше SLOW_UPDATE_MS', ['handler'])
+
+slow_log = logging.getLogger('slow_updates')
+
+
+class TimingMiddleware(BaseMiddleware):
+    """
+    Время обработки апдейта целиком с разбивкой по DB, Sheets и Bot API.
+
+    Трасса (utils/misc/tracing.py) открывается до всех остальных middleware
+    и закрывается после хендлера. Апдейты дольше threshold_ms пишутся в лог
+    slow_updates одной JSON-строкой: хендлер, пользователь, состояние FSM,
+    итоги по видам работы и самые долгие шаги.
+    """
+
+    def __init__(self, threshold_ms):
+        super().__init__()
+        self.threshold = threshold_ms / 1000
+
+    async def on_pre_process_update(self, update: types.Update, data: dict):
+        data['trace_token'] = start_trace()
+
+    async def _describe(self, chat_id, user_id, data: dict):
+        trace = current_trace()
+        if trace is None:
+            return
+        trace.handler = handler_name(data)
+        try:
+            trace.state = await Dispatcher.get_current().current_state(chat=chat_id, user=user_id).get_state()
+        except Exception:
+            trace.state = None
+
+    async def on_process_message(self, message: types.Message, data: dict):
+        await self._describe(message.chat.id, message.from_user.id, data)
+
+    async def on_process_callback_query(self, call: types.CallbackQuery, data: dict):
+        chat_id = call.message.chat.id if call.message else call.from_user.id
+        await self._describe(chat_id, call.from_user.id, data)
+
+    async def on_post_process_update(self, update: types.Update, results, data: dict):
+        token = data.get('trace_token')
+        if token is None:
+            return
+        trace = finish_trace(token)
+        elapsed = trace.elapsed()
+        if elapsed < self.threshold:
+            return
+        handler = trace.handler or 'none'
+        SLOW_UPDATES.inc(handler=handler)
+        user = types.User.get_current()
+        spans = trace.breakdown()
+        accounted = sum(span['ms'] for span in spans.values())
+        # Поля уходят в extra=: в JSON их сериализует поток вывода логов, а не event loop
+        slow_log.warning('slow_update', extra={
+            'update_id': update.update_id,
+            'handler': handler,
+            'user_id': user.id if user else None,
+            'state': trace.state,
+            'total_ms': round(elapsed * 1000, 1),
+            'spans': spans,
+            # Время самого бота: Python-код, ожидание event loop, незамеренные вызовы
+            'other_ms': round(max(elapsed * 1000 - accounted, 0), 1),
+            'steps': trace.slowest_steps(),
+        })
@@ -0,0 +1,44 @@
+from aiogram import types
+from aiogram.dispatcher.handler import ctx_data
+from aiogram.dispatcher.middlewares import BaseMiddleware
+
+from utils.db_api.users import get_cached_user, fetch_user, cache_user, MISSING
+from utils.misc.metrics import Counter
+from utils.misc.tracing import in_executor
+
+# Отношение bot_user_lookups_total к этому счетчику - число обращений за пользователем на апдейт
+UPDATES_WITH_USER = Counter('bot_user_context_updates_total', 'Апдейты, для которых загружен пользователь')
+
+
+def current_user():
+    """Запись пользователя (dict из users или None) для текущего апдейта"""
+    data = ctx_data.get() or {}
+    return data.get('db_user')
+
+
+def is_approved(event) -> bool:
+    """Фильтр для хендлеров: пользователь одобрен админом"""
+    user = current_user()
+    return user is not None and user.get('status') == 'approved'
+
+
+class UserContextMiddleware(BaseMiddleware):
+    """
+    Загружает запись пользователя один раз на апдейт и кладет ее в data['db_user'].
+
+    Хендлеры получают ее аргументом db_user, фильтры - через current_user().
+    Запись берется из кэша, а при промахе - одним запросом в отдельном потоке.
+    """
+
+    async def _load(self, user_id, data: dict):
+        UPDATES_WITH_USER.inc()
+        user = get_cached_user(user_id)
+        if user is MISSING:
+            user = cache_user(user_id, await in_executor(None, fetch_user, user_id))
+        data['db_user'] = user
+
+    async def on_pre_process_message(self, message: types.Message, data: dict):
+        await self._load(message.from_user.id, data)
+
+    async def on_pre_process_callback_query(self, call: types.CallbackQuery, data: dict):
+        await self._load(call.from_user.id, data)
@@ -223,6 +223,358 @@ def migration_003_default_objects():
     finally:
         conn.close()
 
+def migration_004_bot_settings():
+    """Миграция 004: Таблица служебных настроек бота (ключ-значение)"""
+    migration_name = "004_bot_settings"
+    
+    if is_migration_applied(migration_name):
+        logger.info(f"Миграция {migration_name} уже применена")
+        return
+    
+    conn = get_db_conn()
+    c = conn.cursor()
+    
+    try:
+        # Хранит, например, время последней рассылки о перезапуске
+        c.execute('''CREATE TABLE IF NOT EXISTS bot_settings (
+            key TEXT PRIMARY KEY,
+            value TEXT,
+            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )''')
+        
+        conn.commit()
+        mark_migration_applied(migration_name)
+        logger.info(f"Миграция {migration_name} успешно применена")
+        
+    except Exception as e:
+        logger.error(f"Ошибка при применении миграции {migration_name}: {e}")
+        conn.rollback()
+    finally:
+        conn.close()
+
+def migration_005_fsm_states():
+    """Миграция 005: Таблица состояний FSM (незавершенные диалоги пользователей)"""
+    migration_name = "005_fsm_states"
+    
+    if is_migration_applied(migration_name):
+        logger.info(f"Миграция {migration_name} уже применена")
+        return
+    
+    conn = get_db_conn()
+    c = conn.cursor()
+    
+    try:
+        c.execute('''CREATE TABLE IF NOT EXISTS fsm_states (
+            chat_id BIGINT NOT NULL,
+            user_id BIGINT NOT NULL,
+            state TEXT,
+            data JSONB NOT NULL DEFAULT '{}',
+            bucket JSONB NOT NULL DEFAULT '{}',
+            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            PRIMARY KEY (chat_id, user_id)
+        )''')
+        
+        conn.commit()
+        mark_migration_applied(migration_name)
+        logger.info(f"Миграция {migration_name} успешно применена")
+        
+    except Exception as e:
+        logger.error(f"Ошибка при применении миграции {migration_name}: {e}")
+        conn.rollback()
+    finally:
+        conn.close()
+
+def migration_006_allowed_groups():
+    """Миграция 006: Список групп, в которых разрешена работа бота"""
+    migration_name = "006_allowed_groups"
+    
+    if is_migration_applied(migration_name):
+        logger.info(f"Миграция {migration_name} уже применена")
+        return
+    
+    conn = get_db_conn()
+    c = conn.cursor()
+    
+    try:
+        c.execute('''CREATE TABLE IF NOT EXISTS allowed_groups (
+            chat_id BIGINT PRIMARY KEY,
+            title TEXT,
+            added_by BIGINT,
+            added_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )''')
+        
+        conn.commit()
+        mark_migration_applied(migration_name)
+        logger.info(f"Миграция {migration_name} успешно применена")
+        
+    except Exception as e:
+        logger.error(f"Ошибка при применении миграции {migration_name}: {e}")
+        conn.rollback()
+    finally:
+        conn.close()
+
+def migration_007_users_lang():
+    """Миграция 007: Язык интерфейса пользователя"""
+    migration_name = "007_users_lang"
+    
+    if is_migration_applied(migration_name):
+        logger.info(f"Миграция {migration_name} уже применена")
+        return
+    
+    conn = get_db_conn()
+    c = conn.cursor()
+    
+    try:
+        c.execute("ALTER TABLE users ADD COLUMN IF NOT EXISTS lang TEXT NOT NULL DEFAULT 'uz'")
+        
+        conn.commit()
+        mark_migration_applied(migration_name)
+        logger.info(f"Миграция {migration_name} успешно применена")
+        
+    except Exception as e:
+        logger.error(f"Ошибка при применении миграции {migration_name}: {e}")
+        conn.rollback()
+    finally:
+        conn.close()
+
+def migration_008_ledger():
+    """Миграция 008: Журнал записей и дневные итоги по объектам и категориям"""
+    migration_name = "008_ledger"
+    
+    if is_migration_applied(migration_name):
+        logger.info(f"Миграция {migration_name} уже применена")
+        return
+    
+    conn = get_db_conn()
+    c = conn.cursor()
+    
+    try:
+        # Суммы хранятся в тийинах (1/100 сума) целым числом
+        c.execute('''CREATE TABLE IF NOT EXISTS ledger_entries (
+            id BIGSERIAL PRIMARY KEY,
+            entry_date DATE NOT NULL,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            type TEXT NOT NULL,
+            amount_minor BIGINT NOT NULL,
+            category TEXT NOT NULL DEFAULT '',
+            comment TEXT,
+            object_name TEXT NOT NULL DEFAULT '',
+            user_id BIGINT,
+            user_name TEXT
+        )''')
+        c.execute('CREATE INDEX IF NOT EXISTS ledger_entries_date_idx ON ledger_entries (entry_date)')
+        
+        # Итоги обновляются в той же транзакции, что и запись в журнал
+        c.execute('''CREATE TABLE IF NOT EXISTS ledger_daily_totals (
+            day DATE NOT NULL,
+            object_name TEXT NOT NULL,
+            category TEXT NOT NULL,
+            kirim_minor BIGINT NOT NULL DEFAULT 0,
+            chiqim_minor BIGINT NOT NULL DEFAULT 0,
+            entries INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (day, object_name, category)
+        )''')
+        
+        conn.commit()
+        mark_migration_applied(migration_name)
+        logger.info(f"Миграция {migration_name} успешно применена")
+        
+    except Exception as e:
+        logger.error(f"Ошибка при применении миграции {migration_name}: {e}")
+        conn.rollback()
+    finally:
+        conn.close()
+
+def migration_009_ledger_sheet_row():
+    """Миграция 009: Номер строки таблицы для записей, загруженных из Google Sheets"""
+    migration_name = "009_ledger_sheet_row"
+    
+    if is_migration_applied(migration_name):
+        logger.info(f"Миграция {migration_name} уже применена")
+        return
+    
+    conn = get_db_conn()
+    c = conn.cursor()
+    
+    try:
+        c.execute('ALTER TABLE ledger_entries ADD COLUMN IF NOT EXISTS sheet_row INTEGER')
+        # Повторная загрузка той же строки таблицы не создает дубликат
+        c.execute('''CREATE UNIQUE INDEX IF NOT EXISTS ledger_entries_sheet_row_idx
+                     ON ledger_entries (sheet_row) WHERE sheet_row IS NOT NULL''')
+        
+        conn.commit()
+        mark_migration_applied(migration_name)
+        logger.info(f"Миграция {migration_name} успешно применена")
+        
+    except Exception as e:
+        logger.error(f"Ошибка при применении миграции {migration_name}: {e}")
+        conn.rollback()
+    finally:
+        conn.close()
+
+def migration_010_object_balances():
+    """Миграция 010: Текущий остаток по каждому объекту"""
+    migration_name = "010_object_balances"
+    
+    if is_migration_applied(migration_name):
+        logger.info(f"Миграция {migration_name} уже применена")
+        return
+    
+    conn = get_db_conn()
+    c = conn.cursor()
+    
+    try:
+        c.execute('''CREATE TABLE IF NOT EXISTS object_balances (
+            object_name TEXT PRIMARY KEY,
+            balance_minor BIGINT NOT NULL DEFAULT 0,
+            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )''')
+        # Начальные остатки из уже накопленных дневных итогов
+        c.execute('''INSERT INTO object_balances (object_name, balance_minor)
+                     SELECT object_name, SUM(kirim_minor) - SUM(chiqim_minor)
+                     FROM ledger_daily_totals GROUP BY object_name
+                     ON CONFLICT (object_name) DO NOTHING''')
+        
+        conn.commit()
+        mark_migration_applied(migration_name)
+        logger.info(f"Миграция {migration_name} успешно применена")
+        
+    except Exception as e:
+        logger.error(f"Ошибка при применении миграции {migration_name}: {e}")
+        conn.rollback()
+    finally:
+        conn.close()
+
+def migration_011_job_runs():
+    """Миграция 011: Журнал запусков фоновых задач планировщика"""
+    migration_name = "011_job_runs"
+    
+    if is_migration_applied(migration_name):
+        logger.info(f"Миграция {migration_name} уже применена")
+        return
+    
+    conn = get_db_conn()
+    c = conn.cursor()
+    
+    try:
+        # Первичный ключ не дает двум репликам выполнить один и тот же запуск
+        c.execute('''CREATE TABLE IF NOT EXISTS job_runs (
+            job TEXT NOT NULL,
+            scheduled_at TIMESTAMP NOT NULL,
+            started_at TIMESTAMP,
+            finished_at TIMESTAMP,
+            status TEXT,
+            duration_ms INTEGER,
+            error TEXT,
+            PRIMARY KEY (job, scheduled_at)
+        )''')
+        
+        conn.commit()
+        mark_migration_applied(migration_name)
+        logger.info(f"Миграция {migration_name} успешно применена")
+        
+    except Exception as e:
+        logger.error(f"Ошибка при применении миграции {migration_name}: {e}")
+        conn.rollback()
+    finally:
+        conn.close()
+
+def migration_012_entry_confirmations():
+    """Миграция 012: Ключи подтвержденных записей (защита от повторного подтверждения)"""
+    migration_name = "012_entry_confirmations"
+    
+    if is_migration_applied(migration_name):
+        logger.info(f"Миграция {migration_name} уже применена")
+        return
+    
+    conn = get_db_conn()
+    c = conn.cursor()
+    
+    try:
+        # Первичный ключ не дает записать одну и ту же запись дважды, даже из разных процессов
+        c.execute('''CREATE TABLE IF NOT EXISTS entry_confirmations (
+            entry_key TEXT PRIMARY KEY,
+            user_id BIGINT,
+            status TEXT NOT NULL DEFAULT 'pending',
+            d1_value TEXT,
+            object_name TEXT,
+            object_balance_minor BIGINT,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )''')
+        c.execute('CREATE INDEX IF NOT EXISTS entry_confirmations_created_idx ON entry_confirmations (created_at)')
+        
+        conn.commit()
+        mark_migration_applied(migration_name)
+        logger.info(f"Миграция {migration_name} успешно применена")
+        
+    except Exception as e:
+        logger.error(f"Ошибка при применении миграции {migration_name}: {e}")
+        conn.rollback()
+    finally:
+        conn.close()
+
+def migration_013_sheet_routes():
+    """Миграция 013: Маршруты записей объектов в листы Google Sheets"""
+    migration_name = "013_sheet_routes"
+    
+    if is_migration_applied(migration_name):
+        logger.info(f"Миграция {migration_name} уже применена")
+        return
+    
+    conn = get_db_conn()
+    c = conn.cursor()
+    
+    try:
+        # Лист (таблица + лист) со своим бюджетом запросов к Sheets API
+        c.execute('''CREATE TABLE IF NOT EXISTS sheet_targets (
+            id SERIAL PRIMARY KEY,
+            sheet_id TEXT NOT NULL,
+            sheet_name TEXT NOT NULL,
+            requests_per_minute INTEGER NOT NULL DEFAULT 60,
+            UNIQUE (sheet_id, sheet_name)
+        )''')
+        # Объект -> лист; объекты без маршрута пишутся в SHEET_ID/SHEET_NAME
+        c.execute('''CREATE TABLE IF NOT EXISTS sheet_routes (
+            object_name TEXT PRIMARY KEY,
+            target_id INTEGER NOT NULL REFERENCES sheet_targets (id) ON DELETE CASCADE
+        )''')
+        
+        conn.commit()
+        mark_migration_applied(migration_name)
+        logger.info(f"Миграция {migration_name} успешно применена")
+        
+    except Exception as e:
+        logger.error(f"Ошибка при применении миграции {migration_name}: {e}")
+        conn.rollback()
+    finally:
+        conn.close()
+
+def migration_014_entry_confirmations_claimed_at():
+    """Миграция 014: Время захвата ключа записи (перехват брошенных подтверждений)"""
+    migration_name = "014_entry_confirmations_claimed_at"
+    
+    if is_migration_applied(migration_name):
+        logger.info(f"Миграция {migration_name} уже применена")
+        return
+    
+    conn = get_db_conn()
+    c = conn.cursor()
+    
+    try:
+        c.execute('''ALTER TABLE entry_confirmations
+                     ADD COLUMN IF NOT EXISTS claimed_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP''')
+        c.execute('UPDATE entry_confirmations SET claimed_at = created_at WHERE claimed_at IS NULL')
+        
+        conn.commit()
+        mark_migration_applied(migration_name)
+        logger.info(f"Миграция {migration_name} успешно применена")
+        
+    except Exception as e:
+        logger.error(f"Ошибка при применении миграции {migration_name}: {e}")
+        conn.rollback()
+    finally:
+        conn.close()
+
 def run_all_migrations():
     """Запуск всех миграций"""
     logger.info("Начинаем выполнение миграций...")
@@ -234,7 +586,18 @@ def run_all_migrations():
     migrations = [
         migration_001_initial_schema,
         migration_002_default_categories,
-        migration_003_default_objects
+        migration_003_default_objects,
+        migration_004_bot_settings,
+        migration_005_fsm_states,
+        migration_006_allowed_groups,
+        migration_007_users_lang,
+        migration_008_ledger,
+        migration_009_ledger_sheet_row,
+        migration_010_object_balances,
+        migration_011_job_runs,
+        migration_012_entry_confirmations,
+        migration_013_sheet_routes,
+        migration_014_entry_confirmations_claimed_at
     ]
     
     for migration in migrations:
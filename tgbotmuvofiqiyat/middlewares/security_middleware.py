@@ -5,6 +5,9 @@ from utils.db_api.security_db import check_user_access, check_group_access, is_a
 from utils.logger import log_security_event, log_group_event
 from data.config import SECURITY_ENABLED, AUTO_LEAVE_GROUPS
 
+# Команды, доступные до регистрации и одобрения
+PUBLIC_COMMANDS = ('/start', '/register')
+
 class SecurityMiddleware(BaseMiddleware):
     """
     Middleware для проверки безопасности пользователей и групп
@@ -28,27 +31,29 @@ class SecurityMiddleware(BaseMiddleware):
         
         # Проверка в приватных чатах
         if chat_type == 'private':
-            await self._check_private_chat(message)
+            await self._check_private_chat(message, data)
         
         # Проверка в группах
         elif chat_type in ['group', 'supergroup']:
             await self._check_group_chat(message)
     
-    async def _check_private_chat(self, message: types.Message):
+    async def _check_private_chat(self, message: types.Message, data: dict):
         """Проверка доступа в приватном чате"""
         user_id = message.from_user.id
         
-        # Разрешаем команду /start для незарегистрированных
-        if message.text and message.text.startswith('/start'):
+        # Разрешаем /start, /register и шаги регистрации для незарегистрированных
+        if message.text and message.text.startswith(PUBLIC_COMMANDS):
+            return
+        if str(data.get('raw_state', '')).startswith('Register:'):
             return
         
-        if not await check_user_access(user_id):
+        if not check_user_access(data.get('db_user')):
             log_security_event("ACCESS_DENIED", user_id, "Попытка использования бота без регистрации")
             
             await message.answer(
                 "❌ <b>Доступ запрещён</b>\n\n"
                 "🔐 Для использования бота необходима регистрация и одобрение администратором.\n\n"
-                "📝 Напишите /start для начала процесса регистрации.",
+                "📝 Напишите /register для начала процесса регистрации.",
                 parse_mode='HTML'
             )
             raise CancelHandler()
@@ -91,11 +96,11 @@ class SecurityMiddleware(BaseMiddleware):
         
         # Проверка только в приватных чатах
         if callback_query.message.chat.type == 'private':
-            if not await check_user_access(user_id):
+            if not check_user_access(data.get('db_user')):
                 log_security_event("CALLBACK_ACCESS_DENIED", user_id, f"Data: {callback_query.data}")
                 
                 await callback_query.answer(
-                    "❌ Доступ запрещён! Пройдите регистрацию через /start",
+                    "❌ Доступ запрещён! Пройдите регистрацию через /register",
                     show_alert=True
                 )
                 raise CancelHandler() 
\ No newline at end of file
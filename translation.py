@@ -0,0 +1,44 @@
+import json
+import logging
+import os
+import sys
+
+# Исходные тексты в коде написаны на узбекском - это и есть идентификаторы сообщений
+DEFAULT_LANG = 'uz'
+LOCALES_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'locales')
+
+
+def load_catalogs(path=LOCALES_DIR):
+    """
+    Загружает все каталоги переводов (locales/<язык>.json) один раз.
+
+    Ключи интернируются: тексты из исходников - тоже интернированные строки,
+    поэтому поиск в словаре сводится к сравнению указателей.
+    """
+    catalogs = {DEFAULT_LANG: {}}
+    if not os.path.isdir(path):
+        return catalogs
+    for filename in sorted(os.listdir(path)):
+        lang, ext = os.path.splitext(filename)
+        if ext != '.json':
+            continue
+        try:
+            with open(os.path.join(path, filename), encoding='utf-8') as f:
+                messages = json.load(f)
+        except (OSError, ValueError) as e:
+            logging.error(f"Не удалось загрузить перевод {filename}: {e}")
+            continue
+        catalogs[lang] = {sys.intern(key): value for key, value in messages.items()}
+    return catalogs
+
+
+CATALOGS = load_catalogs()
+LANGUAGES = tuple(CATALOGS)
+
+
+def _(text, lang=None):
+    """Перевод текста на язык lang; неизвестный язык или текст возвращается как есть"""
+    catalog = CATALOGS.get(lang)
+    if not catalog:
+        return text
+    return catalog.get(text, text)
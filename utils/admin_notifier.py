@@ -0,0 +1,91 @@
+import asyncio
+import logging
+
+# Ограничение Telegram на длину одного сообщения
+MESSAGE_LIMIT = 4096
+
+
+class AdminNotifier:
+    """
+    Доставка уведомлений о новых записях админам.
+
+    instant - каждое уведомление отправляется сразу (в фоне),
+    digest  - уведомления копятся по каждому админу и уходят одним сообщением
+              раз в interval секунд или при накоплении max_entries записей.
+    Вызывающий хендлер никогда не ждет доставки.
+    """
+
+    def __init__(self, bot, admins, mode='instant', interval=600, max_entries=20):
+        self.bot = bot
+        self.admins = list(admins)
+        self.mode = mode
+        self.interval = interval
+        self.max_entries = max_entries
+        self._buffers = {admin_id: [] for admin_id in self.admins}
+        self._tasks = set()
+
+    def notify_entry(self, text):
+        if self.mode != 'digest':
+            for admin_id in self.admins:
+                self._spawn(self._send(admin_id, text))
+            return
+
+        for admin_id in self.admins:
+            buffer = self._buffers.setdefault(admin_id, [])
+            buffer.append(text)
+            if len(buffer) >= self.max_entries:
+                self._spawn(self.flush(admin_id))
+
+    async def flush(self, admin_id=None):
+        admin_ids = [admin_id] if admin_id is not None else list(self._buffers)
+        for admin_id in admin_ids:
+            entries = self._buffers.get(admin_id)
+            if not entries:
+                continue
+            self._buffers[admin_id] = []
+            for chunk in self._format_digest(entries):
+                await self._send(admin_id, chunk)
+
+    async def run(self):
+        """Периодический сброс буферов (только для режима digest)"""
+        if self.mode != 'digest':
+            return
+        while True:
+            await asyncio.sleep(self.interval)
+            try:
+                await self.flush()
+            except Exception as e:
+                logging.error(f"Error flushing admin digest: {e}")
+
+    async def close(self):
+        """Отправляет все накопленное и дожидается фоновых отправок"""
+        await self.flush()
+        if self._tasks:
+            await asyncio.gather(*self._tasks, return_exceptions=True)
+
+    def _format_digest(self, entries):
+        header = f"📋 <b>Yangi ma'lumotlar: {len(entries)} ta</b>\n\n"
+        separator = "\n\n➖➖➖➖➖\n\n"
+        chunks = []
+        current = header
+        for entry in entries:
+            piece = entry if current == header else separator + entry
+            if len(current) + len(piece) > MESSAGE_LIMIT and current != header:
+                chunks.append(current)
+                current = entry
+            else:
+                current += piece
+        chunks.append(current)
+        return chunks
+
+    async def _send(self, admin_id, text):
+        try:
+            await self.bot.send_message(admin_id, text)
+        except Exception as e:
+            logging.error(f"Could not send notification to admin {admin_id}: {e}")
+
+    def _spawn(self, coro):
+        task = asyncio.create_task(coro)
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+        return task
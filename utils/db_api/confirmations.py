@@ -0,0 +1,125 @@
+import logging
+import uuid
+
+from utils.misc.cache import TTLCache, MISSING
+from utils.misc.metrics import Counter
+from .postgres import get_db_conn
+
+CONFIRM_DUPLICATES = Counter('bot_confirm_duplicates_total', 'Повторные подтверждения одной записи', ['source'])
+
+# Сколько дней хранить ключи подтвержденных записей в базе
+KEEP_DAYS = 7
+# Через сколько секунд незавершенный захват считается брошенным (процесс упал или перезапустился
+# между claim и complete) и ключ можно захватить снова; с запасом на очередь записи в таблицу
+CLAIM_LEASE_SECONDS = 300
+
+# Результаты недавних подтверждений: повторное нажатие обслуживается без обращения к базе
+_results = TTLCache(maxsize=10000, ttl=3600)
+# Ключи, которые этот процесс подтверждает прямо сейчас
+_in_flight = set()
+
+PENDING = 'pending'
+DONE = 'done'
+
+
+def new_entry_key():
+    """Ключ черновика записи; выдается при выборе типа операции"""
+    return uuid.uuid4().hex
+
+
+def start(key) -> bool:
+    """Отмечает, что подтверждение key выполняется; False, если оно уже идет в этом процессе"""
+    if key in _in_flight:
+        CONFIRM_DUPLICATES.inc(source='in_flight')
+        return False
+    _in_flight.add(key)
+    return True
+
+
+def finish(key):
+    _in_flight.discard(key)
+
+
+def cached_result(key):
+    """Результат уже подтвержденной записи из кэша процесса; MISSING, если его там нет"""
+    result = _results.get(key)
+    if result is not MISSING:
+        CONFIRM_DUPLICATES.inc(source='cache')
+    return result
+
+
+def claim(key, user_id, lease=CLAIM_LEASE_SECONDS):
+    """
+    Захватывает ключ перед записью в таблицу (первичный ключ entry_confirmations).
+
+    None - ключ захвачен, запись нужно сохранить. Иначе запись уже подтверждалась
+    (в том числе другим процессом или до перезапуска): dict со статусом и результатом.
+    Захват, не завершенный за lease секунд, перехватывается, иначе запись после
+    падения процесса навсегда осталась бы в статусе pending.
+    """
+    conn = get_db_conn()
+    c = conn.cursor()
+    try:
+        c.execute('''INSERT INTO entry_confirmations AS e (entry_key, user_id, status, claimed_at)
+                     VALUES (%s, %s, %s, NOW())
+                     ON CONFLICT (entry_key) DO UPDATE SET claimed_at = NOW(), user_id = EXCLUDED.user_id
+                     WHERE e.status = %s AND e.claimed_at < NOW() - %s * INTERVAL '1 second'
+                     RETURNING (xmax = 0) AS inserted''', (key, user_id, PENDING, PENDING, lease))
+        claimed = c.fetchone()
+        if claimed is not None:
+            conn.commit()
+            if not claimed[0]:
+                CONFIRM_DUPLICATES.inc(source='stale_claim')
+                logging.warning(f"Захват записи {key} не был завершен за {lease} с, подтверждаем заново")
+            return None
+        c.execute('''SELECT status, d1_value, object_name, object_balance_minor
+                     FROM entry_confirmations WHERE entry_key=%s''', (key,))
+        row = c.fetchone()
+        conn.commit()
+    finally:
+        conn.close()
+    CONFIRM_DUPLICATES.inc(source='db')
+    result = {'status': row[0], 'd1_value': row[1], 'object_name': row[2], 'object_balance': row[3]}
+    if result['status'] == DONE:
+        _results.set(key, result)
+    return result
+
+
+def complete(key, d1_value, object_name, object_balance):
+    """Сохраняет результат подтверждения: повторные нажатия получат его же"""
+    result = {'status': DONE, 'd1_value': d1_value, 'object_name': object_name, 'object_balance': object_balance}
+    _results.set(key, result)
+    conn = get_db_conn()
+    c = conn.cursor()
+    try:
+        c.execute('''UPDATE entry_confirmations
+                     SET status=%s, d1_value=%s, object_name=%s, object_balance_minor=%s
+                     WHERE entry_key=%s''', (DONE, d1_value, object_name, object_balance, key))
+        conn.commit()
+    finally:
+        conn.close()
+    return result
+
+
+def release(key):
+    """Запись не сохранилась - ключ освобождается, чтобы ее можно было подтвердить снова"""
+    conn = get_db_conn()
+    c = conn.cursor()
+    try:
+        c.execute('DELETE FROM entry_confirmations WHERE entry_key=%s AND status=%s', (key, PENDING))
+        conn.commit()
+    finally:
+        conn.close()
+
+
+def purge_old(days=KEEP_DAYS):
+    """Удаляет ключи старше days дней; возвращает их число"""
+    conn = get_db_conn()
+    c = conn.cursor()
+    try:
+        c.execute("DELETE FROM entry_confirmations WHERE created_at < NOW() - %s * INTERVAL '1 day'", (days,))
+        deleted = c.rowcount
+        conn.commit()
+    finally:
+        conn.close()
+    return deleted
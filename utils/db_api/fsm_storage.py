@@ -0,0 +1,315 @@
+import asyncio
+import copy
+import json
+import logging
+import time
+import typing
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+import psycopg2
+from psycopg2.extras import execute_values
+from aiogram.dispatcher.storage import BaseStorage
+
+from utils.misc.tracing import in_executor
+from . import invalidation
+from .postgres import get_db_conn
+
+
+class _Record:
+    __slots__ = ('state', 'data', 'bucket', 'loaded_at', 'dirty')
+
+    def __init__(self, state=None, data=None, bucket=None):
+        self.state = state
+        self.data = data or {}
+        self.bucket = bucket or {}
+        self.loaded_at = time.monotonic()
+        self.dirty = False
+
+    def is_empty(self):
+        return self.state is None and not self.data and not self.bucket
+
+
+class PostgresStorage(BaseStorage):
+    """
+    Хранилище FSM в таблице fsm_states (PostgreSQL, JSONB).
+
+    Чтения обслуживаются из небольшого горячего кэша (LRU + TTL), записи
+    попадают в кэш сразу, а в базу уходят пачкой раз в flush_interval секунд
+    или при накоплении batch_size изменений. Пустые записи удаляются из таблицы.
+    Все обращения к базе идут через один поток и одно соединение.
+
+    Вместе с каждой пачкой изменений остальным процессам бота (ingress.py, webhook)
+    рассылается сброс этих записей (invalidation 'fsm'), поэтому они не отдают
+    из своего кэша устаревшее состояние до истечения cache_ttl.
+    """
+
+    def __init__(self, cache_size=10000, cache_ttl=30, flush_interval=0.5, batch_size=200):
+        self.cache_size = cache_size
+        self.cache_ttl = cache_ttl
+        self.flush_interval = flush_interval
+        self.batch_size = batch_size
+
+        self._cache: typing.Dict[typing.Tuple[int, int], _Record] = OrderedDict()
+        self._dirty = set()
+        self._conn = None
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='fsm-storage')
+        self._flush_task = None
+        self._flush_event = None
+        self._closed = False
+        self._loop = None
+        invalidation.subscribe('fsm', self._on_invalidate)
+
+    # --- Работа с базой (выполняется в отдельном потоке) ---
+
+    def _get_conn(self):
+        if self._conn is None or self._conn.closed:
+            self._conn = get_db_conn()
+        return self._conn
+
+    def _run_db(self, func, *args):
+        try:
+            return func(self._get_conn(), *args)
+        except (psycopg2.OperationalError, psycopg2.InterfaceError):
+            # Соединение оборвалось - переподключаемся один раз
+            if self._conn is not None and not self._conn.closed:
+                self._conn.close()
+            self._conn = None
+            return func(self._get_conn(), *args)
+
+    @staticmethod
+    def _select(conn, chat, user):
+        c = conn.cursor()
+        try:
+            c.execute('SELECT state, data, bucket FROM fsm_states WHERE chat_id=%s AND user_id=%s',
+                      (chat, user))
+            row = c.fetchone()
+            conn.commit()
+            return row
+        except Exception:
+            conn.rollback()
+            raise
+
+    @staticmethod
+    def _write(conn, upserts, deletes):
+        c = conn.cursor()
+        try:
+            if upserts:
+                execute_values(c, '''INSERT INTO fsm_states (chat_id, user_id, state, data, bucket, updated_at)
+                    VALUES %s
+                    ON CONFLICT (chat_id, user_id) DO UPDATE SET
+                        state = EXCLUDED.state, data = EXCLUDED.data,
+                        bucket = EXCLUDED.bucket, updated_at = EXCLUDED.updated_at''',
+                               upserts, template='(%s, %s, %s, %s::jsonb, %s::jsonb, NOW())')
+            if deletes:
+                execute_values(c, '''DELETE FROM fsm_states f USING (VALUES %s) AS d(chat_id, user_id)
+                    WHERE f.chat_id = d.chat_id AND f.user_id = d.user_id''', deletes)
+            # Уведомления уходят вместе с commit: другие процессы перечитают уже записанное
+            invalidation.publish_in(c, 'fsm', [f'{chat}/{user}' for chat, user, *_rest in upserts + deletes])
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+
+    @staticmethod
+    def _select_state(conn, state):
+        c = conn.cursor()
+        try:
+            c.execute('SELECT user_id, data FROM fsm_states WHERE state=%s', (state,))
+            rows = c.fetchall()
+            conn.commit()
+            return rows
+        except Exception:
+            conn.rollback()
+            raise
+
+    async def _db(self, func, *args):
+        return await in_executor(self._executor, self._run_db, func, *args)
+
+    # --- Кэш и отложенная запись ---
+
+    def _address(self, chat, user):
+        chat, user = self.check_address(chat=chat, user=user)
+        return int(chat), int(user)
+
+    async def _get_record(self, chat, user) -> _Record:
+        if self._loop is None:
+            self._loop = asyncio.get_running_loop()
+        key = (chat, user)
+        record = self._cache.get(key)
+        if record is not None and (record.dirty or time.monotonic() - record.loaded_at < self.cache_ttl):
+            self._cache.move_to_end(key)
+            return record
+
+        row = await self._db(self._select, chat, user)
+        # Пока ждали базу, запись могла измениться локально - локальная версия новее
+        record = self._cache.get(key)
+        if record is not None and record.dirty:
+            return record
+        record = _Record(*row) if row else _Record()
+        self._cache[key] = record
+        self._evict()
+        return record
+
+    def _on_invalidate(self, key):
+        # Вызывается из потока слушателя invalidation - кэш меняем только в event loop
+        if self._loop is not None and not self._loop.is_closed():
+            chat, user = map(int, key.split('/'))
+            self._loop.call_soon_threadsafe(self._drop, (chat, user))
+
+    def _drop(self, key):
+        record = self._cache.get(key)
+        # Локальные несохраненные изменения новее - их не трогаем
+        if record is not None and not record.dirty:
+            del self._cache[key]
+
+    def _evict(self):
+        # Вытесняем самые старые чистые записи; грязные дожидаются сброса в базу
+        overflow = len(self._cache) - self.cache_size
+        if overflow <= 0:
+            return
+        for key in list(self._cache)[:overflow * 2]:
+            if overflow <= 0:
+                break
+            if not self._cache[key].dirty:
+                del self._cache[key]
+                overflow -= 1
+
+    def _mark_dirty(self, chat, user, record):
+        record.dirty = True
+        record.loaded_at = time.monotonic()
+        self._dirty.add((chat, user))
+        self._ensure_flusher()
+        if len(self._dirty) >= self.batch_size:
+            self._flush_event.set()
+
+    def _ensure_flusher(self):
+        if self._flush_task is None or self._flush_task.done():
+            self._flush_event = asyncio.Event()
+            self._flush_task = asyncio.create_task(self._flush_loop())
+
+    async def _flush_loop(self):
+        while not self._closed:
+            try:
+                await asyncio.wait_for(self._flush_event.wait(), timeout=self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._flush_event.clear()
+            try:
+                await self.flush()
+            except Exception as e:
+                logging.error(f"Ошибка при сохранении состояний FSM: {e}")
+
+    async def flush(self):
+        """Сбрасывает накопленные изменения в базу одной транзакцией"""
+        if not self._dirty:
+            return
+        keys, self._dirty = self._dirty, set()
+        upserts, deletes = [], []
+        for key in keys:
+            record = self._cache.get(key)
+            if record is None:
+                continue
+            record.dirty = False
+            chat, user = key
+            if record.is_empty():
+                deletes.append((chat, user))
+            else:
+                upserts.append((chat, user, record.state,
+                                json.dumps(record.data, ensure_ascii=False),
+                                json.dumps(record.bucket, ensure_ascii=False)))
+        try:
+            await self._db(self._write, upserts, deletes)
+        except Exception:
+            # Возвращаем ключи в очередь, чтобы повторить при следующем сбросе
+            for key in keys:
+                record = self._cache.get(key)
+                if record is not None:
+                    record.dirty = True
+                    self._dirty.add(key)
+            raise
+
+    @property
+    def sessions_count(self):
+        """Количество пользователей с активным состоянием в кэше"""
+        return sum(1 for record in self._cache.values() if record.state is not None)
+
+    async def find_state(self, state):
+        """Все пользователи в состоянии state: список (user_id, data) из базы"""
+        await self.flush()
+        return await self._db(self._select_state, state)
+
+    # --- Интерфейс BaseStorage ---
+
+    async def close(self):
+        self._closed = True
+        if self._flush_event is not None:
+            self._flush_event.set()
+        if self._flush_task is not None:
+            await asyncio.gather(self._flush_task, return_exceptions=True)
+        await self.flush()
+
+    async def wait_closed(self):
+        if self._conn is not None and not self._conn.closed:
+            self._conn.close()
+        self._executor.shutdown(wait=True)
+
+    async def get_state(self, *, chat=None, user=None, default=None) -> typing.Optional[str]:
+        chat, user = self._address(chat, user)
+        record = await self._get_record(chat, user)
+        return record.state if record.state is not None else self.resolve_state(default)
+
+    async def get_data(self, *, chat=None, user=None, default=None) -> typing.Dict:
+        chat, user = self._address(chat, user)
+        record = await self._get_record(chat, user)
+        return copy.deepcopy(record.data) if record.data else copy.deepcopy(default or {})
+
+    async def set_state(self, *, chat=None, user=None, state=None):
+        chat, user = self._address(chat, user)
+        record = await self._get_record(chat, user)
+        record.state = self.resolve_state(state)
+        self._mark_dirty(chat, user, record)
+
+    async def set_data(self, *, chat=None, user=None, data: typing.Dict = None):
+        chat, user = self._address(chat, user)
+        record = await self._get_record(chat, user)
+        record.data = copy.deepcopy(data or {})
+        self._mark_dirty(chat, user, record)
+
+    async def update_data(self, *, chat=None, user=None, data: typing.Dict = None, **kwargs):
+        if data is None:
+            data = {}
+        chat, user = self._address(chat, user)
+        record = await self._get_record(chat, user)
+        record.data.update(copy.deepcopy(data), **kwargs)
+        self._mark_dirty(chat, user, record)
+
+    async def reset_state(self, *, chat=None, user=None, with_data=True):
+        chat, user = self._address(chat, user)
+        record = await self._get_record(chat, user)
+        record.state = None
+        if with_data:
+            record.data = {}
+        self._mark_dirty(chat, user, record)
+
+    def has_bucket(self):
+        return True
+
+    async def get_bucket(self, *, chat=None, user=None, default=None) -> typing.Dict:
+        chat, user = self._address(chat, user)
+        record = await self._get_record(chat, user)
+        return copy.deepcopy(record.bucket) if record.bucket else copy.deepcopy(default or {})
+
+    async def set_bucket(self, *, chat=None, user=None, bucket: typing.Dict = None):
+        chat, user = self._address(chat, user)
+        record = await self._get_record(chat, user)
+        record.bucket = copy.deepcopy(bucket or {})
+        self._mark_dirty(chat, user, record)
+
+    async def update_bucket(self, *, chat=None, user=None, bucket: typing.Dict = None, **kwargs):
+        if bucket is None:
+            bucket = {}
+        chat, user = self._address(chat, user)
+        record = await self._get_record(chat, user)
+        record.bucket.update(copy.deepcopy(bucket), **kwargs)
+        self._mark_dirty(chat, user, record)
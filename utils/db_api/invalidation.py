@@ -0,0 +1,93 @@
+import logging
+import select
+import threading
+import time
+import uuid
+from collections import defaultdict
+
+from psycopg2.extensions import ISOLATION_LEVEL_AUTOCOMMIT
+from psycopg2.extras import execute_values
+
+from .postgres import get_db_conn
+
+# Канал PostgreSQL, через который процессы бота сообщают друг другу о сбросе кэшей
+CHANNEL = 'bot_cache_invalidate'
+
+# Метка процесса в уведомлениях: pid не годится - в контейнерах каждая реплика бота работает с pid 1
+PROCESS_ID = uuid.uuid4().hex
+
+_subscribers = defaultdict(list)
+_listener = None
+
+
+def subscribe(kind, callback):
+    """callback(key) вызывается при сбросе записи kind (например, 'user') в любом процессе"""
+    _subscribers[kind].append(callback)
+
+
+def _apply(kind, key):
+    for callback in _subscribers.get(kind, ()):
+        try:
+            callback(key)
+        except Exception as e:
+            logging.error(f"Ошибка при сбросе кэша {kind}:{key}: {e}")
+
+
+def publish(kind, key):
+    """Сбрасывает запись в кэшах этого процесса и рассылает сброс остальным процессам"""
+    _apply(kind, key)
+    try:
+        conn = get_db_conn()
+        try:
+            conn.set_isolation_level(ISOLATION_LEVEL_AUTOCOMMIT)
+            c = conn.cursor()
+            c.execute('SELECT pg_notify(%s, %s)', (CHANNEL, f'{PROCESS_ID}:{kind}:{key}'))
+        finally:
+            conn.close()
+    except Exception as e:
+        logging.error(f"Не удалось разослать сброс кэша {kind}:{key}: {e}")
+
+
+def publish_in(cursor, kind, keys):
+    """
+    Рассылает сброс ключей keys остальным процессам в транзакции cursor.
+
+    Уведомления уходят при commit и только если транзакция удалась; в этом
+    процессе кэши не сбрасываются (вызывающий сам только что записал данные).
+    """
+    if keys:
+        execute_values(cursor, f"SELECT pg_notify('{CHANNEL}', p) FROM (VALUES %s) AS v(p)",
+                       [(f'{PROCESS_ID}:{kind}:{key}',) for key in keys])
+
+
+def _parse_key(key):
+    return int(key) if key.lstrip('-').isdigit() else key
+
+
+def _listen():
+    while True:
+        try:
+            conn = get_db_conn()
+            conn.set_isolation_level(ISOLATION_LEVEL_AUTOCOMMIT)
+            c = conn.cursor()
+            c.execute(f'LISTEN {CHANNEL}')
+            while True:
+                if select.select([conn], [], [], 60) == ([], [], []):
+                    continue
+                conn.poll()
+                while conn.notifies:
+                    notify = conn.notifies.pop(0)
+                    sender, kind, key = notify.payload.split(':', 2)
+                    if sender != PROCESS_ID:
+                        _apply(kind, _parse_key(key))
+        except Exception as e:
+            logging.error(f"Ошибка в слушателе сброса кэшей: {e}")
+            time.sleep(5)
+
+
+def start_listener():
+    """Запускает фоновый поток, принимающий сбросы кэшей от других процессов"""
+    global _listener
+    if _listener is None:
+        _listener = threading.Thread(target=_listen, name='cache-invalidation', daemon=True)
+        _listener.start()
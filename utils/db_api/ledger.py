@@ -0,0 +1,254 @@
+import datetime
+from collections import defaultdict
+
+from psycopg2.extras import execute_values
+
+from utils.misc.amounts import parse_amount
+from .postgres import get_db_conn
+
+# Сколько строк разбивки показывать в отчете
+REPORT_TOP = 25
+# Сколько строк журнала выгрузка получает с сервера за один раз
+EXPORT_CHUNK_SIZE = 2000
+
+
+def _add_object_balances(c, deltas):
+    """Прибавляет изменения к остаткам объектов: deltas - пары (объект, изменение в тийинах)"""
+    if not deltas:
+        return []
+    return execute_values(c, '''INSERT INTO object_balances AS b (object_name, balance_minor, updated_at)
+                                VALUES %s
+                                ON CONFLICT (object_name) DO UPDATE SET
+                                    balance_minor = b.balance_minor + EXCLUDED.balance_minor,
+                                    updated_at = EXCLUDED.updated_at
+                                RETURNING object_name, balance_minor''',
+                          deltas, template='(%s, %s, NOW())', fetch=True)
+
+
+def record_entry(data, entry_date=None):
+    """
+    Записывает подтвержденную запись в журнал и обновляет итоги.
+
+    Дневные итоги по (день, объект, категория) и остаток объекта меняются
+    в той же транзакции, поэтому отчетам не нужно читать журнал целиком.
+    Возвращает (id записи, остаток объекта в тийинах).
+    """
+    entry_date = entry_date or datetime.date.today()
+    amount_minor = data.get('amount_minor')
+    if amount_minor is None:
+        amount_minor = parse_amount(data.get('amount', ''))
+    is_kirim = data.get('type') == 'Kirim'
+    object_name = data.get('loyiha') or ''
+    category = data.get('category') or ''
+
+    conn = get_db_conn()
+    c = conn.cursor()
+    try:
+        c.execute('''INSERT INTO ledger_entries
+                         (entry_date, type, amount_minor, category, comment, object_name, user_id, user_name)
+                     VALUES (%s, %s, %s, %s, %s, %s, %s, %s) RETURNING id''',
+                  (entry_date, data.get('type'), amount_minor, category, data.get('comment'),
+                   object_name, data.get('user_id'), data.get('user_name')))
+        entry_id = c.fetchone()[0]
+        c.execute('''INSERT INTO ledger_daily_totals AS t (day, object_name, category, kirim_minor, chiqim_minor, entries)
+                     VALUES (%s, %s, %s, %s, %s, 1)
+                     ON CONFLICT (day, object_name, category) DO UPDATE SET
+                         kirim_minor = t.kirim_minor + EXCLUDED.kirim_minor,
+                         chiqim_minor = t.chiqim_minor + EXCLUDED.chiqim_minor,
+                         entries = t.entries + 1''',
+                  (entry_date, object_name, category,
+                   amount_minor if is_kirim else 0, 0 if is_kirim else amount_minor))
+        [(_object_name, object_balance)] = _add_object_balances(
+            c, [(object_name, amount_minor if is_kirim else -amount_minor)])
+        conn.commit()
+        return entry_id, object_balance
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        conn.close()
+
+
+def add_daily_totals(c, entries):
+    """
+    Добавляет записи к дневным итогам и остаткам объектов (в транзакции вызывающего).
+
+    entries - кортежи (дата, тип, сумма в тийинах, объект, категория).
+    """
+    totals = defaultdict(lambda: [0, 0, 0])
+    balances = defaultdict(int)
+    for entry_date, entry_type, amount_minor, object_name, category in entries:
+        total = totals[(entry_date, object_name, category)]
+        total[0 if entry_type == 'Kirim' else 1] += amount_minor
+        total[2] += 1
+        balances[object_name] += amount_minor if entry_type == 'Kirim' else -amount_minor
+    if not totals:
+        return
+    _add_object_balances(c, list(balances.items()))
+    execute_values(c, '''INSERT INTO ledger_daily_totals AS t (day, object_name, category, kirim_minor, chiqim_minor, entries)
+                         VALUES %s
+                         ON CONFLICT (day, object_name, category) DO UPDATE SET
+                             kirim_minor = t.kirim_minor + EXCLUDED.kirim_minor,
+                             chiqim_minor = t.chiqim_minor + EXCLUDED.chiqim_minor,
+                             entries = t.entries + EXCLUDED.entries''',
+                   [(day, object_name, category, kirim, chiqim, count)
+                    for (day, object_name, category), (kirim, chiqim, count) in totals.items()])
+
+
+def insert_sheet_entries(c, rows):
+    """
+    Загружает строки листа в журнал многострочным INSERT и обновляет итоги.
+
+    rows - кортежи (строка листа, дата, тип, сумма в тийинах, категория, комментарий, объект, пользователь).
+    Уже загруженные строки (по sheet_row) пропускаются. Возвращает число добавленных записей.
+    """
+    if not rows:
+        return 0
+    inserted = execute_values(c, '''INSERT INTO ledger_entries
+                                      (sheet_row, entry_date, type, amount_minor, category, comment, object_name, user_name)
+                                  VALUES %s
+                                  ON CONFLICT (sheet_row) WHERE sheet_row IS NOT NULL DO NOTHING
+                                  RETURNING entry_date, type, amount_minor, object_name, category''',
+                              rows, page_size=len(rows), fetch=True)
+    add_daily_totals(c, inserted)
+    return len(inserted)
+
+
+def get_object_balances():
+    """Все остатки объектов: список (объект, остаток в тийинах) по убыванию остатка"""
+    conn = get_db_conn()
+    c = conn.cursor()
+    try:
+        c.execute('SELECT object_name, balance_minor FROM object_balances ORDER BY balance_minor DESC')
+        return c.fetchall()
+    finally:
+        conn.close()
+
+
+def rebuild_object_balances():
+    """
+    Полный пересчет остатков объектов из журнала одним set-based запросом.
+
+    Нужен после ручных правок журнала; в обычной работе остатки
+    поддерживаются инкрементально в record_entry. Возвращает число объектов.
+    """
+    conn = get_db_conn()
+    c = conn.cursor()
+    try:
+        # Блокировка не дает параллельному record_entry потерять свое изменение между DELETE и INSERT
+        c.execute('LOCK TABLE object_balances IN EXCLUSIVE MODE')
+        c.execute('DELETE FROM object_balances')
+        c.execute('''INSERT INTO object_balances (object_name, balance_minor, updated_at)
+                     SELECT object_name,
+                            SUM(CASE WHEN type = 'Kirim' THEN amount_minor ELSE -amount_minor END),
+                            NOW()
+                     FROM ledger_entries GROUP BY object_name''')
+        count = c.rowcount
+        conn.commit()
+        return count
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        conn.close()
+
+
+def _filters(date_column, date_from, date_to, object_name=None, category=None):
+    conditions = [f'{date_column} BETWEEN %s AND %s']
+    params = [date_from, date_to]
+    if object_name:
+        conditions.append('object_name = %s')
+        params.append(object_name)
+    if category:
+        conditions.append('category = %s')
+        params.append(category)
+    return ' AND '.join(conditions), params
+
+
+def iter_entries(date_from, date_to, object_name=None, category=None, chunk_size=EXPORT_CHUNK_SIZE):
+    """
+    Строки журнала за период в порядке записи.
+
+    Читаются через серверный (именованный) курсор пачками по chunk_size,
+    поэтому в памяти одновременно находится не больше одной пачки.
+    Кортежи: (дата, время записи, тип, сумма в тийинах, категория, комментарий, объект, пользователь)
+    """
+    where, params = _filters('entry_date', date_from, date_to, object_name, category)
+    conn = get_db_conn()
+    try:
+        c = conn.cursor(name='ledger_export')
+        c.itersize = chunk_size
+        c.execute(f'''SELECT entry_date, created_at, type, amount_minor, category, comment, object_name, user_name
+                      FROM ledger_entries WHERE {where} ORDER BY id''', params)
+        for row in c:
+            yield row
+        c.close()
+    finally:
+        conn.close()
+
+
+def get_report(date_from, date_to, object_name=None, category=None):
+    """
+    Итоги за период [date_from, date_to] из ledger_daily_totals.
+
+    Возвращает {'kirim', 'chiqim', 'entries', 'by_object', 'by_category'}, где
+    разбивки - списки (название, приход, расход, записей), по убыванию оборота.
+    """
+    where, params = _filters('day', date_from, date_to, object_name, category)
+
+    conn = get_db_conn()
+    c = conn.cursor()
+    try:
+        c.execute(f'''SELECT COALESCE(SUM(kirim_minor), 0), COALESCE(SUM(chiqim_minor), 0),
+                             COALESCE(SUM(entries), 0)
+                      FROM ledger_daily_totals WHERE {where}''', params)
+        kirim, chiqim, entries = c.fetchone()
+        breakdowns = {}
+        for column in ('object_name', 'category'):
+            c.execute(f'''SELECT {column}, SUM(kirim_minor), SUM(chiqim_minor), SUM(entries)
+                          FROM ledger_daily_totals WHERE {where}
+                          GROUP BY {column}
+                          ORDER BY SUM(kirim_minor) + SUM(chiqim_minor) DESC
+                          LIMIT %s''', params + [REPORT_TOP])
+            breakdowns[column] = c.fetchall()
+    finally:
+        conn.close()
+
+    return {
+        'kirim': int(kirim),
+        'chiqim': int(chiqim),
+        'entries': int(entries),
+        'by_object': breakdowns['object_name'],
+        'by_category': breakdowns['category'],
+    }
+
+
+def parse_period(text, today=None):
+    """
+    Период отчета: today, week, month, year, ГГГГ, ГГГГ-ММ, ДД.ММ.ГГГГ или ДД.ММ.ГГГГ-ДД.ММ.ГГГГ.
+
+    Возвращает (date_from, date_to); ValueError для нераспознанного периода.
+    """
+    today = today or datetime.date.today()
+    text = (text or 'month').strip().lower()
+    if text in ('today', 'bugun'):
+        return today, today
+    if text in ('week', 'hafta'):
+        return today - datetime.timedelta(days=today.weekday()), today
+    if text in ('month', 'oy'):
+        return today.replace(day=1), today
+    if text in ('year', 'yil'):
+        return today.replace(month=1, day=1), today
+    if len(text) == 4 and text.isdigit():
+        year = int(text)
+        return datetime.date(year, 1, 1), datetime.date(year, 12, 31)
+    if len(text) == 7 and text[4] == '-':
+        start = datetime.datetime.strptime(text, '%Y-%m').date()
+        next_month = (start.replace(day=28) + datetime.timedelta(days=4)).replace(day=1)
+        return start, next_month - datetime.timedelta(days=1)
+    if '-' in text:
+        first, last = text.split('-', 1)
+        return (datetime.datetime.strptime(first.strip(), '%d.%m.%Y').date(),
+                datetime.datetime.strptime(last.strip(), '%d.%m.%Y').date())
+    day = datetime.datetime.strptime(text, '%d.%m.%Y').date()
+    return day, day
@@ -0,0 +1,76 @@
+import re
+import time
+from functools import lru_cache
+
+import psycopg2
+import psycopg2.extensions
+
+from data.config import POSTGRES_DB, POSTGRES_USER, POSTGRES_PASSWORD, POSTGRES_HOST, POSTGRES_PORT
+from utils.misc.metrics import Counter, Histogram
+from utils.misc.tracing import add_span
+
+DB_CONNECTIONS = Counter('bot_db_connections_total', 'Открытые соединения с PostgreSQL')
+DB_ERRORS = Counter('bot_db_errors_total', 'Ошибки SQL-запросов', ['query'])
+DB_QUERY_SECONDS = Histogram('bot_db_query_seconds', 'Длительность SQL-запросов', ['query'])
+
+_TABLE_RE = re.compile(r'\b(?:FROM|INTO|UPDATE|TABLE)\s+([A-Za-z_][A-Za-z0-9_]*)', re.IGNORECASE)
+
+
+@lru_cache(maxsize=512)
+def query_label(query):
+    """Метка запроса для метрик: 'SELECT users', 'INSERT ledger_entries' (без параметров)"""
+    verb = query.split(None, 1)[0].upper() if query.strip() else ''
+    match = _TABLE_RE.search(query)
+    return f"{verb} {match.group(1).lower()}" if match else verb
+
+
+def _label(cursor, query):
+    if isinstance(query, bytes):
+        # execute_values подставляет значения прямо в текст запроса - для метки хватает начала
+        query = query[:200].decode('utf-8', 'replace')
+    elif not isinstance(query, str):
+        query = query.as_string(cursor)
+    return query_label(query)
+
+
+class MeteredCursor(psycopg2.extensions.cursor):
+    """Курсор, который замеряет время каждого запроса (execute_values тоже идет через execute)"""
+
+    def execute(self, query, vars=None):
+        label = _label(self, query)
+        started = time.perf_counter()
+        try:
+            return super().execute(query, vars)
+        except Exception:
+            DB_ERRORS.inc(query=label)
+            raise
+        finally:
+            elapsed = time.perf_counter() - started
+            DB_QUERY_SECONDS.observe(elapsed, query=label)
+            add_span('db', label, elapsed)
+
+    def executemany(self, query, vars_list):
+        label = _label(self, query)
+        started = time.perf_counter()
+        try:
+            return super().executemany(query, vars_list)
+        except Exception:
+            DB_ERRORS.inc(query=label)
+            raise
+        finally:
+            elapsed = time.perf_counter() - started
+            DB_QUERY_SECONDS.observe(elapsed, query=label)
+            add_span('db', label, elapsed)
+
+
+def get_db_conn():
+    """Получение соединения с базой данных"""
+    DB_CONNECTIONS.inc()
+    return psycopg2.connect(
+        dbname=POSTGRES_DB,
+        user=POSTGRES_USER,
+        password=POSTGRES_PASSWORD,
+        host=POSTGRES_HOST,
+        port=POSTGRES_PORT,
+        cursor_factory=MeteredCursor
+    )
@@ -0,0 +1,82 @@
+from data.config import ADMINS
+from utils.misc.cache import TTLCache, MISSING
+from utils.misc.metrics import Counter
+from utils.misc.tracing import in_executor
+from . import invalidation
+from .postgres import get_db_conn
+
+ACCESS_CHECKS = Counter('bot_access_checks_total', 'Проверки доступа', ['kind', 'source'])
+
+_admins = frozenset(ADMINS)
+
+# Решения о доступе групп: положительные живут дольше, неизвестные группы - меньше.
+# При /allow_group и /deny_group запись сбрасывается сразу (invalidation 'group')
+_group_access = TTLCache(maxsize=1000, ttl=300, negative_ttl=60)
+
+
+def _fetch_group_access(chat_id):
+    conn = get_db_conn()
+    c = conn.cursor()
+    try:
+        c.execute('SELECT 1 FROM allowed_groups WHERE chat_id=%s', (chat_id,))
+        row = c.fetchone()
+    finally:
+        conn.close()
+    return True if row else None
+
+
+async def _cached(cache, kind, key, fetch):
+    decision = cache.get(key)
+    if decision is not MISSING:
+        ACCESS_CHECKS.inc(kind=kind, source='cache')
+        return bool(decision)
+    ACCESS_CHECKS.inc(kind=kind, source='db')
+    decision = cache.set(key, await in_executor(None, fetch, key))
+    return bool(decision)
+
+
+async def is_admin(user_id) -> bool:
+    return user_id in _admins
+
+
+def check_user_access(db_user) -> bool:
+    """
+    Пользователь зарегистрирован и одобрен админом.
+
+    db_user - запись, которую UserContextMiddleware уже загрузила для апдейта
+    (data['db_user']), поэтому отдельного запроса к users нет.
+    """
+    ACCESS_CHECKS.inc(kind='user', source='context')
+    return db_user is not None and db_user.get('status') == 'approved'
+
+
+async def check_group_access(chat_id) -> bool:
+    """Группа есть в списке разрешенных (allowed_groups)"""
+    return await _cached(_group_access, 'group', chat_id, _fetch_group_access)
+
+
+def allow_group(chat_id, title, added_by):
+    conn = get_db_conn()
+    c = conn.cursor()
+    try:
+        c.execute('''INSERT INTO allowed_groups (chat_id, title, added_by) VALUES (%s, %s, %s)
+                     ON CONFLICT (chat_id) DO UPDATE SET title = EXCLUDED.title''',
+                  (chat_id, title, added_by))
+        conn.commit()
+    finally:
+        conn.close()
+    invalidation.publish('group', chat_id)
+
+
+def deny_group(chat_id):
+    conn = get_db_conn()
+    c = conn.cursor()
+    try:
+        c.execute('DELETE FROM allowed_groups WHERE chat_id=%s', (chat_id,))
+        conn.commit()
+    finally:
+        conn.close()
+    invalidation.publish('group', chat_id)
+
+
+invalidation.subscribe('group', _group_access.pop)
@@ -0,0 +1,76 @@
+import collections
+
+from data.config import SHEET_ID, SHEET_NAME, SHEET_REQUESTS_PER_MINUTE
+from utils.misc.cache import TTLCache, MISSING
+from . import invalidation
+from .postgres import get_db_conn
+
+# Лист, в который пишет бот; requests_per_minute - бюджет запросов к Sheets API для этого листа
+SheetTarget = collections.namedtuple('SheetTarget', 'sheet_id sheet_name requests_per_minute')
+
+DEFAULT_TARGET = SheetTarget(SHEET_ID, SHEET_NAME, SHEET_REQUESTS_PER_MINUTE)
+
+# Вся таблица маршрутов целиком: она маленькая, а нужна на каждой записи
+_routes = TTLCache(maxsize=1, ttl=300)
+invalidation.subscribe('sheet_routes', lambda key: _routes.clear())
+
+
+def load_routes():
+    """Маршруты из базы: объект -> SheetTarget"""
+    conn = get_db_conn()
+    c = conn.cursor()
+    try:
+        c.execute('''SELECT r.object_name, t.sheet_id, t.sheet_name, t.requests_per_minute
+                     FROM sheet_routes r JOIN sheet_targets t ON t.id = r.target_id''')
+        rows = c.fetchall()
+    finally:
+        conn.close()
+    return {object_name: SheetTarget(sheet_id, sheet_name, rate) for object_name, sheet_id, sheet_name, rate in rows}
+
+
+def get_routes():
+    routes = _routes.get('all')
+    if routes is MISSING:
+        routes = _routes.set('all', load_routes())
+    return routes
+
+
+def target_for(object_name):
+    """Лист для записи объекта; объекты без маршрута пишутся в SHEET_ID/SHEET_NAME"""
+    return get_routes().get(object_name, DEFAULT_TARGET)
+
+
+def set_route(object_names, sheet_id, sheet_name, requests_per_minute=None):
+    """Направляет записи объектов (одного или группы) в лист sheet_name таблицы sheet_id"""
+    conn = get_db_conn()
+    c = conn.cursor()
+    try:
+        c.execute('''INSERT INTO sheet_targets AS t (sheet_id, sheet_name, requests_per_minute)
+                     VALUES (%s, %s, COALESCE(%s, %s))
+                     ON CONFLICT (sheet_id, sheet_name) DO UPDATE SET
+                         requests_per_minute = COALESCE(%s, t.requests_per_minute)
+                     RETURNING id''',
+                  (sheet_id, sheet_name, requests_per_minute, SHEET_REQUESTS_PER_MINUTE, requests_per_minute))
+        target_id = c.fetchone()[0]
+        for object_name in object_names:
+            c.execute('''INSERT INTO sheet_routes (object_name, target_id) VALUES (%s, %s)
+                         ON CONFLICT (object_name) DO UPDATE SET target_id = EXCLUDED.target_id''',
+                      (object_name, target_id))
+        conn.commit()
+    finally:
+        conn.close()
+    invalidation.publish('sheet_routes', 'all')
+
+
+def delete_route(object_names):
+    """Возвращает объекты в лист по умолчанию; возвращает число удаленных маршрутов"""
+    conn = get_db_conn()
+    c = conn.cursor()
+    try:
+        c.execute('DELETE FROM sheet_routes WHERE object_name = ANY(%s)', (list(object_names),))
+        deleted = c.rowcount
+        conn.commit()
+    finally:
+        conn.close()
+    invalidation.publish('sheet_routes', 'all')
+    return deleted
@@ -0,0 +1,75 @@
+from translation import DEFAULT_LANG
+from utils.misc.cache import TTLCache, MISSING
+from utils.misc.metrics import Counter
+from . import invalidation
+from .postgres import get_db_conn
+
+USER_LOOKUPS = Counter('bot_user_lookups_total', 'Обращения за записью пользователя', ['source'])
+
+# Запись пользователя кэшируется ненадолго; при смене статуса кэш сбрасывается явно
+_cache = TTLCache(maxsize=10000, ttl=30)
+
+
+def fetch_user(user_id):
+    """Запись пользователя из таблицы users одним запросом (dict или None)"""
+    USER_LOOKUPS.inc(source='db')
+    conn = get_db_conn()
+    c = conn.cursor()
+    try:
+        c.execute('SELECT user_id, name, phone, status, lang FROM users WHERE user_id=%s', (user_id,))
+        row = c.fetchone()
+    finally:
+        conn.close()
+    if row is None:
+        return None
+    return {'user_id': row[0], 'name': row[1], 'phone': row[2], 'status': row[3], 'lang': row[4]}
+
+
+def get_cached_user(user_id):
+    """Запись из кэша; MISSING, если ее нужно загрузить из базы"""
+    record = _cache.get(user_id)
+    if record is not MISSING:
+        USER_LOOKUPS.inc(source='cache')
+    return record
+
+
+def cache_user(user_id, record):
+    return _cache.set(user_id, record)
+
+
+def get_user(user_id):
+    record = get_cached_user(user_id)
+    if record is MISSING:
+        record = cache_user(user_id, fetch_user(user_id))
+    return record
+
+
+def invalidate_user(user_id):
+    """Сбрасывает запись пользователя во всех процессах бота (после регистрации или смены статуса)"""
+    invalidation.publish('user', user_id)
+
+
+def get_lang(user_id):
+    """Язык пользователя из той же кэшированной записи; незарегистрированным - язык по умолчанию"""
+    record = get_user(user_id)
+    return (record and record.get('lang')) or DEFAULT_LANG
+
+
+def get_cached_lang(user_id):
+    """Язык только из кэша, без обращения к базе (для горячих путей вроде антифлуда)"""
+    record = _cache.get(user_id)
+    return (record and record is not MISSING and record.get('lang')) or DEFAULT_LANG
+
+
+def set_lang(user_id, lang):
+    conn = get_db_conn()
+    c = conn.cursor()
+    try:
+        c.execute('UPDATE users SET lang=%s WHERE user_id=%s', (lang, user_id))
+        conn.commit()
+    finally:
+        conn.close()
+    invalidate_user(user_id)
+
+
+invalidation.subscribe('user', _cache.pop)
@@ -0,0 +1,11 @@
+import logging
+
+security_logger = logging.getLogger('security')
+
+
+def log_security_event(event, user_id, details=''):
+    security_logger.warning(f"[{event}] user_id={user_id} {details}")
+
+
+def log_group_event(event, chat_id, details=''):
+    security_logger.warning(f"[{event}] chat_id={chat_id} {details}")
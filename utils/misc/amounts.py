@@ -0,0 +1,89 @@
+import re
+
+# Суммы хранятся целым числом минимальных единиц: 1 сум = 100 тийин
+MINOR_UNITS = 100
+# Верхняя граница, чтобы сумма гарантированно помещалась в BIGINT
+MAX_AMOUNT_MINOR = 10 ** 15
+
+# Целая часть (с разделителями тысяч пробелом, запятой или точкой) и до двух знаков дробной части
+_AMOUNT_RE = re.compile(r'(\d{1,3}(?:([ ,.])\d{3})?(?:\2\d{3})*|\d+)(?:[.,](\d{1,2}))?')
+_SPACES_RE = re.compile(r'[\s  ]+')
+
+
+def _to_minor(text):
+    """Неотрицательная сумма в тийинах из строки без знака; ValueError для неверного формата"""
+    match = _AMOUNT_RE.fullmatch(text)
+    if match is None:
+        raise ValueError(f"Noto'g'ri summa: {text!r}")
+    integer, separator, fraction = match.groups()
+    if separator:
+        integer = integer.replace(separator, '')
+    minor = int(integer) * MINOR_UNITS + int((fraction or '0').ljust(2, '0'))
+    if minor >= MAX_AMOUNT_MINOR:
+        raise ValueError(f"Noto'g'ri summa: {text!r}")
+    return minor
+
+
+def parse_amount(text) -> int:
+    """
+    Сумма в тийинах из строки, введенной пользователем.
+
+    Понимает '1500000', '1 500 000', '1,500,000.50', '1.500.000,50', '1500,5'.
+    Для неверного ввода (буквы, минус, больше двух знаков после запятой,
+    ноль) - ValueError.
+    """
+    text = _SPACES_RE.sub(' ', str(text)).strip()
+    minor = _to_minor(text)
+    if minor == 0:
+        raise ValueError(f"Noto'g'ri summa: {text!r}")
+    return minor
+
+
+def parse_cell(text) -> int:
+    """
+    Сумма из ячейки таблицы в тийинах, со знаком.
+
+    В отличие от parse_amount принимает ноль в любой записи ('0', '0.00', '0,0')
+    и минус перед суммой ('-500'); пустая ячейка и '-' - 0.
+    """
+    text = _SPACES_RE.sub(' ', str(text)).strip()
+    if text in ('', '-'):
+        return 0
+    sign = 1
+    if text[0] in '-−':
+        sign, text = -1, text[1:].lstrip()
+    return sign * _to_minor(text)
+
+
+def format_amount(minor) -> str:
+    """'1 500 000' или '1 500 000.50' - для сообщений и подтверждения"""
+    sign = '-' if minor < 0 else ''
+    units, cents = divmod(abs(int(minor)), MINOR_UNITS)
+    text = f"{units:,}".replace(',', ' ')
+    if cents:
+        text += f".{cents:02d}"
+    return sign + text
+
+
+def amount_for_sheet(minor):
+    """Число для ячейки таблицы: целое, если нет тийинов"""
+    units, cents = divmod(int(minor), MINOR_UNITS)
+    return units if not cents else int(minor) / MINOR_UNITS
+
+
+def running_balances(rows, first_row=1):
+    """
+    Остаток после каждой строки листа: пары (номер строки, остаток в тийинах).
+
+    Столбец B (Кирим) прибавляется, C (Чиқим) вычитается; строки короче трех
+    столбцов и строки с неверной суммой пропускаются.
+    """
+    balance = 0
+    for number, row in enumerate(rows, start=first_row):
+        if len(row) < 3:
+            continue
+        try:
+            balance += parse_cell(row[1]) - parse_cell(row[2])
+        except ValueError:
+            continue
+        yield number, balance
@@ -0,0 +1,51 @@
+import contextlib
+import logging
+import time
+
+from utils.misc.metrics import Gauge
+
+BOOT_SECONDS = Gauge('bot_boot_seconds', 'Длительность фаз запуска процесса', ['phase'])
+
+
+class BootTimer:
+    """
+    Фазы запуска процесса: импорт модулей, подготовка базы, старт и время до первого апдейта.
+
+    Отсчет идет от момента, который bot.py фиксирует до своих импортов.
+    """
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.phases = {}
+        self.first_update_seen = False
+
+    def mark(self, phase, seconds):
+        self.phases[phase] = seconds
+        BOOT_SECONDS.set(round(seconds, 4), phase=phase)
+
+    @contextlib.contextmanager
+    def phase(self, name):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.mark(name, time.perf_counter() - started)
+
+    def imported(self, started):
+        """Импорт закончен: хендлеры зарегистрированы, ни базы, ни таблиц еще не касались"""
+        self.started = started
+        self.mark('import', time.perf_counter() - started)
+
+    def first_update(self):
+        if self.first_update_seen:
+            return
+        self.first_update_seen = True
+        self.mark('first_update', time.perf_counter() - self.started)
+        self.report()
+
+    def report(self):
+        logging.info('Boot: ' + ', '.join(f'{phase} {seconds:.3f}s' for phase, seconds in self.phases.items()),
+                     extra={'boot_seconds': {phase: round(seconds, 4) for phase, seconds in self.phases.items()}})
+
+
+boot = BootTimer()
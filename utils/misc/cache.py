@@ -0,0 +1,53 @@
+import threading
+import time
+from collections import OrderedDict
+
+# Признак промаха кэша (None - допустимое закэшированное значение)
+MISSING = object()
+
+
+class TTLCache:
+    """
+    LRU-кэш с ограничением по времени жизни записей.
+
+    Отрицательные результаты (None) можно хранить с отдельным, обычно меньшим, TTL.
+    Потокобезопасен: инвалидация может прийти из фонового потока.
+    """
+
+    def __init__(self, maxsize=10000, ttl=60, negative_ttl=None):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.negative_ttl = ttl if negative_ttl is None else negative_ttl
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                return MISSING
+            if entry[0] < time.monotonic():
+                del self._data[key]
+                return MISSING
+            self._data.move_to_end(key)
+            return entry[1]
+
+    def set(self, key, value):
+        ttl = self.negative_ttl if value is None else self.ttl
+        with self._lock:
+            self._data[key] = (time.monotonic() + ttl, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+        return value
+
+    def pop(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def __len__(self):
+        return len(self._data)
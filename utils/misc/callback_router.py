@@ -0,0 +1,120 @@
+import inspect
+
+from aiogram import Dispatcher, types
+from aiogram.dispatcher import FSMContext
+from aiogram.dispatcher.filters.state import State, StatesGroup
+
+SEPARATOR = ':'
+# Ограничение Telegram на длину callback_data (в байтах)
+MAX_LENGTH = 64
+
+
+def pack(prefix, *values) -> str:
+    """Компактные данные кнопки: префикс и значения полей через двоеточие"""
+    data = SEPARATOR.join((prefix, *map(str, values)))
+    if len(data.encode()) > MAX_LENGTH:
+        raise ValueError(f"callback_data длиннее {MAX_LENGTH} байт: {data!r}")
+    return data
+
+
+def _resolve_states(state):
+    if state is None:
+        return None
+    if not isinstance(state, (list, set, tuple, frozenset)):
+        state = [state]
+    states = set()
+    for item in state:
+        if isinstance(item, State):
+            states.add(item.state)
+        elif inspect.isclass(item) and issubclass(item, StatesGroup):
+            states.update(item.all_states_names)
+        else:
+            states.add(item)
+    return frozenset(states)
+
+
+class Route:
+    __slots__ = ('handler', 'fields', 'states', 'params')
+
+    def __init__(self, handler, fields, states):
+        self.handler = handler
+        self.fields = fields
+        self.states = states
+        spec = inspect.signature(handler).parameters.values()
+        # None - хендлер принимает **kwargs и получает все данные апдейта
+        self.params = None if any(p.kind is p.VAR_KEYWORD for p in spec) else {p.name for p in spec}
+
+    def parse(self, rest):
+        """Значения полей из строки после префикса; None, если данные не подходят под схему"""
+        if not self.fields:
+            return {} if not rest else None
+        # Последнее поле забирает остаток строки целиком
+        values = rest.split(SEPARATOR, len(self.fields) - 1)
+        if len(values) != len(self.fields):
+            return None
+        try:
+            return {name: cast(value) for (name, cast), value in zip(self.fields, values)}
+        except ValueError:
+            return None
+
+
+class CallbackRouter:
+    """
+    Маршрутизация нажатий кнопок по префиксу callback_data.
+
+    Вместо цепочки фильтров startswith(...) в dp регистрируется один хендлер:
+    префикс ищется в словаре, поля разбираются один раз в типизированные
+    аргументы хендлера, состояние FSM читается только для маршрутов, у которых
+    оно указано.
+    """
+
+    def __init__(self):
+        self._routes = {}
+
+    def route(self, prefix, *fields, state=None):
+        """
+        Регистрирует хендлер для префикса.
+
+        fields - пары (имя, тип) в порядке следования в callback_data,
+        state - состояние (State, StatesGroup, строка или их список); None - любое.
+        """
+        if SEPARATOR in prefix:
+            raise ValueError(f"Префикс не может содержать {SEPARATOR!r}: {prefix!r}")
+
+        def decorator(handler):
+            if prefix in self._routes:
+                raise ValueError(f"Префикс {prefix!r} уже занят хендлером {self._routes[prefix].handler.__name__}")
+            self._routes[prefix] = Route(handler, fields, _resolve_states(state))
+            return handler
+
+        return decorator
+
+    def match(self, data):
+        """(маршрут, аргументы) для callback_data; (None, None) для чужого префикса"""
+        prefix, _, rest = (data or '').partition(SEPARATOR)
+        route = self._routes.get(prefix)
+        if route is None:
+            return None, None
+        return route, route.parse(rest)
+
+    def check(self, call: types.CallbackQuery):
+        route, args = self.match(call.data)
+        if route is None:
+            return False
+        return {'callback_route': route, 'callback_args': args}
+
+    async def dispatch(self, call: types.CallbackQuery, state: FSMContext, callback_route: Route,
+                       callback_args, **kwargs):
+        # Устаревшая кнопка или кнопка не из текущего шага - просто гасим "часики"
+        if callback_args is None or (
+                callback_route.states is not None and await state.get_state() not in callback_route.states):
+            await call.answer()
+            return
+        kwargs['state'] = state
+        kwargs.update(callback_args)
+        if callback_route.params is not None:
+            kwargs = {name: value for name, value in kwargs.items() if name in callback_route.params}
+        return await callback_route.handler(call, **kwargs)
+
+    def setup(self, dp: Dispatcher):
+        dp.register_callback_query_handler(self.dispatch, self.check, state='*')
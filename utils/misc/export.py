@@ -0,0 +1,65 @@
+import csv
+import os
+import tempfile
+from decimal import Decimal
+
+# Колонки выгрузки повторяют таблицу "Кирим Чиким"
+HEADER = ['Сана', 'Кирим', 'Чиқим', 'Котегория', 'Изох', 'Объект номи', 'User', 'Вақт']
+FORMATS = ('csv', 'xlsx')
+
+
+def _to_sheet_row(entry):
+    entry_date, created_at, entry_type, amount_minor, category, comment, object_name, user_name = entry
+    amount = Decimal(amount_minor).scaleb(-2)
+    return [
+        entry_date.strftime('%d.%m.%Y'),
+        amount if entry_type == 'Kirim' else None,
+        amount if entry_type != 'Kirim' else None,
+        category,
+        comment,
+        object_name,
+        user_name,
+        created_at.strftime('%H:%M') if created_at else None,
+    ]
+
+
+def write_csv(entries, path):
+    # utf-8-sig - чтобы Excel сразу открыл кириллицу без мастера импорта
+    count = 0
+    with open(path, 'w', newline='', encoding='utf-8-sig') as f:
+        writer = csv.writer(f)
+        writer.writerow(HEADER)
+        for entry in entries:
+            writer.writerow(_to_sheet_row(entry))
+            count += 1
+    return count
+
+
+def write_xlsx(entries, path):
+    # openpyxl нужен только для этого формата
+    from openpyxl import Workbook
+
+    # write_only: строки сразу уходят в файл, в памяти книга не собирается
+    workbook = Workbook(write_only=True)
+    sheet = workbook.create_sheet('Кирим Чиким')
+    sheet.append(HEADER)
+    count = 0
+    for entry in entries:
+        sheet.append(_to_sheet_row(entry))
+        count += 1
+    workbook.save(path)
+    return count
+
+
+def export_entries(entries, fmt='csv'):
+    """Пишет записи во временный файл; возвращает (путь, количество строк). Файл удаляет вызывающий"""
+    if fmt not in FORMATS:
+        raise ValueError(f"Noma'lum format: {fmt}")
+    fd, path = tempfile.mkstemp(prefix='ledger_', suffix=f'.{fmt}')
+    os.close(fd)
+    try:
+        count = write_xlsx(entries, path) if fmt == 'xlsx' else write_csv(entries, path)
+    except Exception:
+        os.remove(path)
+        raise
+    return path, count
@@ -0,0 +1,39 @@
+import re
+from datetime import datetime
+
+# Словарь соответствий: категория -> эмодзи
+category_emojis = {
+    "Qurilish materiallari": "🟩",
+    "Doimiy Xarajat": "🟥",
+    "Qarz": "🟪",
+    "Divident": "🟩",
+    "Soliq": "🟪",
+    "Ish Xaqi": "🟦",
+    # Добавьте другие категории и эмодзи по мере необходимости
+}
+
+
+def get_category_with_emoji(category_name):
+    emoji = category_emojis.get(category_name, "")
+    return f"{emoji} {category_name}".strip()
+
+
+def clean_emoji(text):
+    # Удаляет только эмодзи/спецсимволы в начале строки, остальной текст не трогает
+    return re.sub(r'^[^\w\s]*', '', text).strip()
+
+
+def format_summary(data):
+    tur_emoji = '🟢' if data.get('type') == 'Kirim' else '🔴'
+    dt = data.get('dt', datetime.now().strftime('%Y-%m-%d %H:%M:%S'))
+    # Показываем категорию с эмодзи
+    category_with_emoji = get_category_with_emoji(data.get('category', '-'))
+    return (
+        f"<b>Natija:</b>\n"
+        f"<b>Tur:</b> {tur_emoji} {data.get('type', '-')}\n"
+        f"<b>Summa:</b> {data.get('amount', '-')}\n"
+        f"<b>Kotegoriya:</b> {category_with_emoji}\n"
+        f"<b>Izoh:</b> {data.get('comment', '-')}\n"
+        f"<b>Объект номи:</b> {data.get('loyiha', '-')}\n"
+        f"<b>Vaqt:</b> {dt}"
+    )
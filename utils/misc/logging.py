@@ -1,6 +1,178 @@
+import atexit
+import copy
+import json
 import logging
+import logging.handlers
+import queue
+import re
+import sys
+import threading
+import time
+from collections import OrderedDict
 
-logging.basicConfig(format=u'%(filename)s [LINE:%(lineno)d] #%(levelname)-8s [%(asctime)s]  %(message)s',
-                    level=logging.INFO,
-                    # level=logging.DEBUG,  # Можно заменить на другой уровень логгирования.
-                    )
+from data.config import (BOT_TOKEN, POSTGRES_PASSWORD, LOG_LEVEL, LOG_FORMAT, LOG_QUEUE_SIZE,
+                         LOG_DEBUG_SAMPLE_EVERY)
+from utils.misc.metrics import Counter
+
+LOG_DROPPED = Counter('bot_log_dropped_total', 'Записи лога, отброшенные из-за переполненной очереди')
+LOG_SAMPLED_OUT = Counter('bot_log_sampled_out_total', 'Отладочные записи лога, пропущенные выборкой')
+
+# Атрибуты LogRecord, которые не относятся к полям, переданным через extra=
+_RECORD_ATTRS = set(vars(logging.LogRecord('', 0, '', 0, '', (), None))) | {'message', 'asctime'}
+# Токен бота в URL Bot API и пароли в строках подключения
+_SECRET_PATTERNS = [
+    re.compile(r'\b\d{6,}:[A-Za-z0-9_-]{30,}\b'),
+    re.compile(r'(password\s*[=:]\s*)[^\s,;&]+', re.IGNORECASE),
+]
+REDACTED = '***'
+
+_listener = None
+_exception_formatter = logging.Formatter()
+
+
+def redact(text, secrets=(BOT_TOKEN, POSTGRES_PASSWORD)):
+    """Убирает из строки токен бота, пароль базы и похожие на них значения"""
+    for secret in secrets:
+        if secret and len(secret) > 3 and secret in text:
+            text = text.replace(secret, REDACTED)
+    for pattern in _SECRET_PATTERNS:
+        text = pattern.sub(lambda m: (m.group(1) if m.groups() else '') + REDACTED, text)
+    return text
+
+
+def _extra(record):
+    """Поля, переданные через extra="""
+    return {key: value for key, value in vars(record).items()
+            if key not in _RECORD_ATTRS and not key.startswith('_')}
+
+
+class JsonFormatter(logging.Formatter):
+    """Одна JSON-строка на запись: время, уровень, логгер, сообщение и поля из extra="""
+
+    def format(self, record):
+        entry = {
+            'ts': time.strftime('%Y-%m-%dT%H:%M:%S', time.localtime(record.created)) + f'.{int(record.msecs):03d}',
+            'level': record.levelname,
+            'logger': record.name,
+            'message': record.getMessage(),
+        }
+        entry.update(_extra(record))
+        if record.exc_text:
+            entry['exc'] = record.exc_text
+        return redact(json.dumps(entry, ensure_ascii=False, default=str))
+
+
+class TextFormatter(logging.Formatter):
+    """Обычный текст; поля из extra= дописываются в конец строки как JSON"""
+
+    def format(self, record):
+        text = super().format(record)
+        extra = _extra(record)
+        if extra:
+            text += ' ' + json.dumps(extra, ensure_ascii=False, default=str)
+        return redact(text)
+
+
+class DebugSampler(logging.Filter):
+    """
+    Пропускает каждую every-ю отладочную запись с одним и тем же шаблоном сообщения.
+
+    Записи INFO и выше проходят всегда; счет ведется по (логгер, шаблон), поэтому
+    редкие отладочные сообщения не теряются из-за частых. Шаблон - это строка до
+    подстановки аргументов, поэтому частые отладочные сообщения нужно писать
+    в %-стиле (logging.debug("... %s", value)): у f-строки каждое сообщение - свой
+    шаблон. Счетчики хранятся для max_keys последних шаблонов (LRU).
+    """
+
+    def __init__(self, every, max_keys=1000):
+        super().__init__()
+        self.every = every
+        self.max_keys = max_keys
+        self._counts = OrderedDict()
+        self._lock = threading.Lock()
+
+    def filter(self, record):
+        if record.levelno > logging.DEBUG or self.every <= 1:
+            return True
+        key = (record.name, record.msg if isinstance(record.msg, str) else type(record.msg))
+        with self._lock:
+            count = self._counts.pop(key, 0)
+            self._counts[key] = count + 1
+            if len(self._counts) > self.max_keys:
+                self._counts.popitem(last=False)
+        if count % self.every:
+            LOG_SAMPLED_OUT.inc()
+            return False
+        return True
+
+
+class NonBlockingQueueHandler(logging.handlers.QueueHandler):
+    """
+    QueueHandler, который не ждет никогда: при переполненной очереди запись отбрасывается.
+
+    В вызывающем потоке только подставляются аргументы сообщения и трейсбек,
+    форматирование в JSON и запись в поток вывода делает QueueListener.
+    """
+
+    def prepare(self, record):
+        # Аргументы и трейсбек нужно превратить в строки здесь: объекты могут измениться,
+        # пока запись в очереди. Поля из extra= доезжают до слушателя как есть
+        record = copy.copy(record)
+        record.msg = record.message = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = _exception_formatter.formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            LOG_DROPPED.inc()
+
+
+class _Listener(logging.handlers.QueueListener):
+    def enqueue_sentinel(self):
+        # Очередь может быть полной; при остановке можно подождать, пока поток вывода ее разберет
+        self.queue.put(self._sentinel)
+
+
+def setup_logging(level=LOG_LEVEL, fmt=LOG_FORMAT, queue_size=LOG_QUEUE_SIZE,
+                  debug_sample_every=LOG_DEBUG_SAMPLE_EVERY, stream=None):
+    """
+    Корневой логгер пишет через очередь: хендлеры и корутины только кладут запись в очередь,
+    вывод идет в отдельном потоке QueueListener. Повторный вызов перенастраивает логирование.
+    """
+    global _listener
+    stop_logging()
+
+    output = logging.StreamHandler(stream or sys.stderr)
+    if fmt == 'json':
+        output.setFormatter(JsonFormatter())
+    else:
+        output.setFormatter(TextFormatter('%(asctime)s %(levelname)-8s %(name)s: %(message)s'))
+
+    handler = NonBlockingQueueHandler(queue.Queue(maxsize=queue_size))
+    handler.addFilter(DebugSampler(debug_sample_every))
+
+    root = logging.getLogger()
+    for old in root.handlers[:]:
+        root.removeHandler(old)
+    root.addHandler(handler)
+    root.setLevel(level)
+
+    _listener = _Listener(handler.queue, output, respect_handler_level=True)
+    _listener.start()
+    return _listener
+
+
+def stop_logging():
+    """Дописывает оставшиеся в очереди записи и останавливает поток вывода"""
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
+
+
+atexit.register(stop_logging)
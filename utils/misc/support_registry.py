@@ -0,0 +1,143 @@
+from collections import defaultdict
+
+from data.config import support_ids, SUPPORT_CAPACITY
+from utils.db_api import invalidation
+
+
+class SupportRegistry:
+    """
+    Реестр операторов поддержки в памяти.
+
+    Хранит нагрузку каждого оператора (число открытых диалогов) и пары
+    "оператор - пользователь" для всех, кто сейчас в состоянии in_support.
+    Проверка "в диалоге ли пользователь" - один поиск в словаре, выбор
+    наименее загруженного оператора не требует чтения состояний FSM.
+
+    Реестр есть в каждом процессе бота; открытие и закрытие диалога
+    рассылается остальным процессам через invalidation (см. share_start/share_end),
+    поэтому оператор и пользователь могут обрабатываться в разных шардах.
+    """
+
+    def __init__(self, operators=(), capacity=1):
+        # capacity - сколько диалогов оператор ведет одновременно (1 - как раньше: занят/свободен)
+        self.capacity = capacity
+        self._load = {}
+        self._by_load = defaultdict(set)
+        # Оператор -> его пользователи в порядке подключения (dict как упорядоченное множество)
+        self._users = defaultdict(dict)
+        # Пользователь -> оператор
+        self._operator_of = {}
+        for operator_id in operators:
+            self.add_operator(operator_id)
+
+    def add_operator(self, operator_id):
+        if operator_id not in self._load:
+            self._load[operator_id] = 0
+            self._by_load[0].add(operator_id)
+
+    def _set_load(self, operator_id, load):
+        old = self._load[operator_id]
+        self._by_load[old].discard(operator_id)
+        if not self._by_load[old]:
+            del self._by_load[old]
+        self._load[operator_id] = load
+        self._by_load[load].add(operator_id)
+
+    def is_free(self, operator_id) -> bool:
+        return self._load.get(operator_id, self.capacity) < self.capacity
+
+    def least_loaded(self, free_only=True):
+        """Наименее загруженный оператор; None, если свободных нет (при free_only)"""
+        for load in sorted(self._by_load):
+            if free_only and load >= self.capacity:
+                return None
+            for operator_id in self._by_load[load]:
+                return operator_id
+        return None
+
+    def partner(self, participant_id):
+        """
+        Собеседник пользователя или оператора в открытом диалоге (None - диалога нет).
+
+        Сообщения оператора уходят последнему подключенному к нему пользователю.
+        """
+        users = self._users.get(participant_id)
+        if users:
+            return next(reversed(users))
+        return self._operator_of.get(participant_id)
+
+    def pair(self, participant_id, partner_id=None):
+        """
+        Диалог участника: (оператор, пользователь) или (None, None).
+
+        Для оператора с несколькими диалогами partner_id выбирает нужный,
+        без него - последний подключенный.
+        """
+        users = self._users.get(participant_id)
+        if users:
+            if partner_id in users:
+                return participant_id, partner_id
+            return participant_id, next(reversed(users))
+        operator_id = self._operator_of.get(participant_id)
+        if operator_id is None:
+            return None, None
+        return operator_id, participant_id
+
+    def start_session(self, operator_id, user_id):
+        if self._operator_of.get(user_id) == operator_id:
+            return
+        if user_id in self._operator_of:
+            self.end_session(self._operator_of[user_id], user_id)
+        self.add_operator(operator_id)
+        self._users[operator_id][user_id] = None
+        self._operator_of[user_id] = operator_id
+        self._set_load(operator_id, len(self._users[operator_id]))
+
+    def end_session(self, operator_id, user_id):
+        """Закрывает диалог оператора с пользователем; False, если такого диалога нет"""
+        if self._operator_of.get(user_id) != operator_id:
+            return False
+        del self._operator_of[user_id]
+        users = self._users[operator_id]
+        users.pop(user_id, None)
+        if not users:
+            del self._users[operator_id]
+        self._set_load(operator_id, len(users))
+        return True
+
+    def apply(self, event):
+        """Событие из share_start/share_end: 'start:оператор:пользователь' или 'end:...'"""
+        action, operator_id, user_id = event.split(':')
+        if action == 'start':
+            self.start_session(int(operator_id), int(user_id))
+        elif action == 'end':
+            self.end_session(int(operator_id), int(user_id))
+
+    def restore(self, states):
+        """Восстанавливает открытые диалоги из состояний in_support: [(участник, data), ...]"""
+        for participant_id, data in states:
+            partner_id = (data or {}).get('second_id')
+            if partner_id is None:
+                continue
+            if participant_id in self._load:
+                self.start_session(participant_id, int(partner_id))
+            elif int(partner_id) in self._load:
+                self.start_session(int(partner_id), participant_id)
+
+    @property
+    def sessions_count(self):
+        return sum(self._load.values())
+
+
+support_registry = SupportRegistry(support_ids, capacity=SUPPORT_CAPACITY)
+invalidation.subscribe('support', support_registry.apply)
+
+
+def share_start(operator_id, user_id):
+    """Открывает диалог в реестре этого и остальных процессов бота (блокирующий вызов)"""
+    invalidation.publish('support', f'start:{operator_id}:{user_id}')
+
+
+def share_end(operator_id, user_id):
+    """Закрывает диалог в реестре этого и остальных процессов бота (блокирующий вызов)"""
+    invalidation.publish('support', f'end:{operator_id}:{user_id}')
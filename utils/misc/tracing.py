@@ -0,0 +1,88 @@
+import asyncio
+import contextlib
+import contextvars
+import threading
+import time
+
+# Сколько отдельных шагов хранить на один апдейт (итоги по видам считаются по всем)
+MAX_STEPS = 50
+
+_current = contextvars.ContextVar('trace', default=None)
+
+
+class Trace:
+    """
+    Разбивка времени одного апдейта по видам работы: db, sheets, bot_api.
+
+    Хранится в contextvar, поэтому замеры из курсора PostgreSQL, операций
+    Google Sheets и запросов к Bot API попадают в трассу того апдейта,
+    внутри которого они выполнены (в том числе из потоков, запущенных через in_executor).
+    """
+
+    __slots__ = ('started', 'totals', 'steps', 'handler', 'state', '_lock')
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.totals = {}
+        self.steps = []
+        self.handler = None
+        self.state = None
+        self._lock = threading.Lock()
+
+    def add(self, kind, name, seconds):
+        with self._lock:
+            total = self.totals.get(kind)
+            if total is None:
+                total = self.totals[kind] = [0.0, 0]
+            total[0] += seconds
+            total[1] += 1
+            if len(self.steps) < MAX_STEPS:
+                self.steps.append((kind, name, seconds))
+
+    def elapsed(self):
+        return time.perf_counter() - self.started
+
+    def breakdown(self):
+        """{'db': {'ms': 12.3, 'count': 4}, ...}"""
+        return {kind: {'ms': round(seconds * 1000, 1), 'count': count}
+                for kind, (seconds, count) in self.totals.items()}
+
+    def slowest_steps(self, limit=10):
+        steps = sorted(self.steps, key=lambda step: step[2], reverse=True)[:limit]
+        return [{'kind': kind, 'name': name, 'ms': round(seconds * 1000, 1)} for kind, name, seconds in steps]
+
+
+def start_trace():
+    """Начинает трассу текущего апдейта; возвращает токен для finish_trace"""
+    return _current.set(Trace())
+
+
+def finish_trace(token):
+    trace = _current.get()
+    _current.reset(token)
+    return trace
+
+
+def current_trace():
+    return _current.get()
+
+
+def add_span(kind, name, seconds):
+    trace = _current.get()
+    if trace is not None:
+        trace.add(kind, name, seconds)
+
+
+@contextlib.contextmanager
+def span(kind, name):
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        add_span(kind, name, time.perf_counter() - started)
+
+
+def in_executor(executor, func, *args):
+    """loop.run_in_executor, но функция видит contextvars вызывающего (и его трассу)"""
+    loop = asyncio.get_running_loop()
+    return loop.run_in_executor(executor, contextvars.copy_context().run, func, *args)
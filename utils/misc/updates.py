@@ -0,0 +1,21 @@
+# Поля апдейта, в которых Telegram передает отправителя
+UPDATE_USER_FIELDS = (
+    'message', 'edited_message', 'callback_query', 'inline_query', 'chosen_inline_result',
+    'shipping_query', 'pre_checkout_query', 'poll_answer', 'my_chat_member', 'chat_member',
+    'chat_join_request',
+)
+
+
+def update_user_id(payload: dict):
+    """Возвращает id пользователя из "сырого" апдейта Telegram (dict) или None"""
+    for field in UPDATE_USER_FIELDS:
+        event = payload.get(field)
+        if not event:
+            continue
+        user = event.get('from') or event.get('user')
+        if user:
+            return user.get('id')
+        chat = event.get('chat')
+        if chat:
+            return chat.get('id')
+    return None
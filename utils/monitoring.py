@@ -0,0 +1,61 @@
+import logging
+import time
+
+from aiohttp import web
+from aiogram import Bot
+from aiogram.utils.exceptions import RetryAfter, TelegramAPIError
+
+from utils.misc.metrics import Counter, Histogram, render
+from utils.misc.tracing import add_span
+
+BOT_API_SECONDS = Histogram('bot_telegram_request_seconds', 'Длительность запросов к Telegram Bot API', ['method'])
+BOT_API_ERRORS = Counter('bot_telegram_errors_total', 'Ошибки запросов к Telegram Bot API', ['method'])
+FLOOD_WAITS = Counter('bot_telegram_flood_waits_total', 'Ответы Telegram "Flood control exceeded"', ['method'])
+FLOOD_WAIT_SECONDS = Counter('bot_telegram_flood_wait_seconds_total', 'Сколько секунд Telegram просил подождать', ['method'])
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+
+class MeteredBot(Bot):
+    """Bot, который замеряет каждый запрос к Bot API и считает ошибки и flood wait"""
+
+    async def request(self, method, data=None, files=None, **kwargs):
+        started = time.perf_counter()
+        try:
+            return await super().request(method, data, files, **kwargs)
+        except RetryAfter as e:
+            FLOOD_WAITS.inc(method=method)
+            FLOOD_WAIT_SECONDS.inc(e.timeout, method=method)
+            raise
+        except TelegramAPIError:
+            BOT_API_ERRORS.inc(method=method)
+            raise
+        finally:
+            elapsed = time.perf_counter() - started
+            BOT_API_SECONDS.observe(elapsed, method=method)
+            add_span('bot_api', method, elapsed)
+
+
+async def metrics_handler(request: web.Request):
+    return web.Response(body=render().encode(), headers={'Content-Type': CONTENT_TYPE})
+
+
+async def start_metrics_server(host, port):
+    """
+    Отдельный aiohttp-сервер с /metrics в event loop бота.
+
+    Возвращает AppRunner (его нужно закрыть через cleanup при остановке)
+    или None, если порт занят - бот продолжает работать без метрик.
+    """
+    app = web.Application()
+    app.router.add_get('/metrics', metrics_handler)
+    runner = web.AppRunner(app, access_log=None)
+    await runner.setup()
+    try:
+        await web.TCPSite(runner, host, port).start()
+    except OSError as e:
+        logging.error(f"Не удалось запустить /metrics на {host}:{port}: {e}")
+        await runner.cleanup()
+        return None
+    logging.info(f"Метрики доступны на http://{host}:{port}/metrics")
+    return runner
@@ -0,0 +1,176 @@
+import asyncio
+import datetime
+import logging
+import random
+import time
+
+from utils.db_api.postgres import get_db_conn
+from utils.misc.metrics import Counter
+
+JOB_RUNS = Counter('bot_job_runs_total', 'Запуски фоновых задач', ['job', 'status'])
+
+# Поля cron: минута, час, день месяца, месяц, день недели (0 или 7 - воскресенье)
+_FIELDS = ((0, 59), (0, 23), (1, 31), (1, 12), (0, 7))
+
+
+def _parse_field(text, low, high):
+    values = set()
+    for part in text.split(','):
+        step = 1
+        if '/' in part:
+            part, step = part.split('/', 1)
+            step = int(step)
+        if part == '*':
+            start, end = low, high
+        elif '-' in part:
+            start, end = map(int, part.split('-', 1))
+        else:
+            start = end = int(part)
+            if step != 1:
+                end = high
+        if not low <= start <= end <= high or step < 1:
+            raise ValueError(f"Неверное поле cron: {text!r}")
+        values.update(range(start, end + 1, step))
+    return frozenset(values)
+
+
+class CronTrigger:
+    """Расписание в формате cron из пяти полей: '0 21 * * *' - каждый день в 21:00"""
+
+    def __init__(self, expression):
+        fields = expression.split()
+        if len(fields) != 5:
+            raise ValueError(f"Ожидается 5 полей cron: {expression!r}")
+        self.expression = expression
+        self.minutes, self.hours, self.days, self.months, weekdays = (
+            _parse_field(field, low, high) for field, (low, high) in zip(fields, _FIELDS))
+        self.weekdays = frozenset(day % 7 for day in weekdays)
+        self._any_day = fields[2] == '*'
+        self._any_weekday = fields[4] == '*'
+
+    def _day_matches(self, day):
+        in_month = day.day in self.days
+        in_week = (day.isoweekday() % 7) in self.weekdays
+        # Как в cron: если заданы оба поля дня, достаточно совпадения одного
+        if self._any_day or self._any_weekday:
+            return in_month and in_week
+        return in_month or in_week
+
+    def next_after(self, moment: datetime.datetime) -> datetime.datetime:
+        """Ближайшее время срабатывания строго после moment"""
+        moment = moment.replace(second=0, microsecond=0) + datetime.timedelta(minutes=1)
+        day = moment.date()
+        for _ in range(366 * 5):
+            if day.month in self.months and self._day_matches(day):
+                for hour in sorted(self.hours):
+                    for minute in sorted(self.minutes):
+                        candidate = datetime.datetime.combine(day, datetime.time(hour, minute))
+                        if candidate >= moment:
+                            return candidate
+            day += datetime.timedelta(days=1)
+            moment = datetime.datetime.combine(day, datetime.time())
+        raise ValueError(f"Расписание {self.expression!r} никогда не срабатывает")
+
+
+class Job:
+    __slots__ = ('name', 'trigger', 'func', 'jitter', 'last_duration', 'last_run')
+
+    def __init__(self, name, trigger, func, jitter=0):
+        self.name = name
+        self.trigger = trigger
+        self.func = func
+        self.jitter = jitter
+        self.last_duration = None
+        self.last_run = None
+
+
+class Scheduler:
+    """
+    Планировщик периодических задач в event loop бота.
+
+    Каждая задача ждет следующего срабатывания по cron (плюс случайная задержка
+    до jitter секунд), затем "занимает" свой слот строкой в job_runs. Слот может
+    занять только одна реплика или процесс, поэтому задача выполняется один раз,
+    сколько бы копий бота ни было запущено. Длительность и результат пишутся в job_runs.
+    """
+
+    def __init__(self):
+        self.jobs = {}
+        self._tasks = set()
+
+    def add_job(self, name, cron, func, jitter=0):
+        if name in self.jobs:
+            raise ValueError(f"Задача {name!r} уже добавлена")
+        self.jobs[name] = Job(name, CronTrigger(cron), func, jitter)
+
+    def start(self):
+        for job in self.jobs.values():
+            task = asyncio.create_task(self._loop(job))
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+
+    async def stop(self):
+        for task in list(self._tasks):
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+
+    async def _loop(self, job):
+        while True:
+            slot = job.trigger.next_after(datetime.datetime.now())
+            delay = (slot - datetime.datetime.now()).total_seconds() + random.uniform(0, job.jitter)
+            await asyncio.sleep(max(delay, 0))
+            await self.run_job(job, slot)
+
+    async def run_job(self, job, slot):
+        loop = asyncio.get_running_loop()
+        try:
+            claimed = await loop.run_in_executor(None, _claim_run, job.name, slot)
+        except Exception as e:
+            logging.error(f"Задача {job.name}: не удалось занять слот {slot}: {e}")
+            return
+        if not claimed:
+            JOB_RUNS.inc(job=job.name, status='skipped')
+            return
+
+        started = time.perf_counter()
+        status, error = 'ok', None
+        try:
+            await job.func()
+        except Exception as e:
+            status, error = 'error', str(e)
+            logging.error(f"Задача {job.name} завершилась с ошибкой: {e}")
+        duration = time.perf_counter() - started
+        job.last_run, job.last_duration = slot, duration
+        JOB_RUNS.inc(job=job.name, status=status)
+        logging.info(f"Задача {job.name} ({slot:%Y-%m-%d %H:%M}): {status}, {duration * 1000:.0f} мс")
+        try:
+            await loop.run_in_executor(None, _finish_run, job.name, slot, status, duration, error)
+        except Exception as e:
+            logging.error(f"Задача {job.name}: не удалось сохранить результат: {e}")
+
+
+def _claim_run(name, slot):
+    conn = get_db_conn()
+    c = conn.cursor()
+    try:
+        c.execute('''INSERT INTO job_runs (job, scheduled_at, started_at, status)
+                     VALUES (%s, %s, NOW(), 'running')
+                     ON CONFLICT (job, scheduled_at) DO NOTHING
+                     RETURNING job''', (name, slot))
+        claimed = c.fetchone() is not None
+        conn.commit()
+        return claimed
+    finally:
+        conn.close()
+
+
+def _finish_run(name, slot, status, duration, error):
+    conn = get_db_conn()
+    c = conn.cursor()
+    try:
+        c.execute('''UPDATE job_runs SET finished_at = NOW(), status = %s, duration_ms = %s, error = %s
+                     WHERE job = %s AND scheduled_at = %s''',
+                  (status, int(duration * 1000), error, name, slot))
+        conn.commit()
+    finally:
+        conn.close()
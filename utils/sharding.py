@@ -0,0 +1,236 @@
+import asyncio
+import collections
+import logging
+import multiprocessing
+import queue
+import signal
+import time
+
+from aiohttp import web
+from aiogram import Bot, Dispatcher
+
+from data.config import (RUN_MODE, WEBAPP_HOST, WEBAPP_PORT, SHARD_QUEUE_SIZE, SHARD_BACKLOG_SIZE,
+                         METRICS_PORT)
+from utils.misc.logging import setup_logging
+from utils.misc.updates import update_user_id
+
+# Процессы-обработчики запускаются через spawn: так они не наследуют
+# открытые соединения и event loop входного процесса
+mp = multiprocessing.get_context('spawn')
+
+
+def shard_for(payload: dict, shards: int) -> int:
+    """Номер процесса-обработчика для апдейта: все апдейты одного пользователя попадают в один шард"""
+    user_id = update_user_id(payload)
+    return (user_id or 0) % shards
+
+
+# --- Процесс-обработчик ---
+
+def worker_main(index, updates, workers=1):
+    # Остановкой управляет входной процесс (через None в очереди), Ctrl+C игнорируем
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    setup_logging()
+    try:
+        asyncio.run(_worker_loop(index, updates, workers))
+    except KeyboardInterrupt:
+        pass
+
+
+async def _worker_loop(index, updates, workers=1):
+    # Импорт регистрирует хендлеры; состояние FSM общее через PostgreSQL (FSM_STORAGE=postgres)
+    import bot as app
+    from utils.webhook import UpdateProcessor
+
+    dp = app.dp
+    # Бюджет запросов каждого листа Google Sheets делится между всеми обработчиками
+    app.sheet_writers.processes = workers
+    Bot.set_current(dp.bot)
+    Dispatcher.set_current(dp)
+    # У каждого обработчика свой порт /metrics
+    await app.on_process_startup(dp, metrics_port=METRICS_PORT and METRICS_PORT + 1 + index)
+    logging.info(f"Shard worker {index} started")
+
+    processor = UpdateProcessor(dp)
+    loop = asyncio.get_running_loop()
+    while True:
+        payload = await loop.run_in_executor(None, updates.get)
+        if payload is None:
+            break
+        processor.submit(payload)
+
+    await processor.wait_closed()
+    await app.on_shutdown(dp)
+    await dp.storage.close()
+    await dp.storage.wait_closed()
+    session = await dp.bot.get_session()
+    await session.close()
+    logging.info(f"Shard worker {index} stopped")
+
+
+# --- Входной процесс ---
+
+class ShardRouter:
+    """
+    Распределяет апдейты по процессам-обработчикам по хэшу from_user.id.
+
+    У каждого шарда своя ограниченная очередь. Если обработчик завис и его
+    очередь заполнена, апдейты копятся в локальном буфере только этого шарда,
+    остальные шарды продолжают работать. Когда переполнен и буфер, апдейт не
+    принимается (route возвращает False): входной процесс не подтверждает его
+    Telegram, и тот доставит апдейт повторно. Упавший процесс перезапускается.
+    """
+
+    def __init__(self, workers):
+        self.workers = workers
+        self.queues = [mp.Queue(maxsize=SHARD_QUEUE_SIZE) for _ in range(workers)]
+        self.backlogs = [collections.deque() for _ in range(workers)]
+        self.processes = [None] * workers
+        self.refused = [0] * workers
+
+    def start(self):
+        for index in range(self.workers):
+            self._spawn(index)
+
+    def _spawn(self, index):
+        process = mp.Process(target=worker_main, args=(index, self.queues[index], self.workers),
+                             name=f'shard-{index}', daemon=True)
+        process.start()
+        self.processes[index] = process
+
+    def route(self, payload: dict) -> bool:
+        """Передает апдейт шарду; False - шард перегружен, апдейт не принят"""
+        index = shard_for(payload, self.workers)
+        backlog = self.backlogs[index]
+        if not backlog and self._offer(index, payload):
+            return True
+        if len(backlog) >= SHARD_BACKLOG_SIZE:
+            self.refused[index] += 1
+            logging.error(f"Shard {index} is overloaded, update {payload.get('update_id')} will be redelivered")
+            return False
+        backlog.append(payload)
+        return True
+
+    def _offer(self, index, payload):
+        try:
+            self.queues[index].put_nowait(payload)
+            return True
+        except queue.Full:
+            return False
+
+    async def supervise(self, interval=1.0):
+        """Досылает отложенные апдейты и перезапускает упавшие обработчики"""
+        while True:
+            await asyncio.sleep(interval)
+            for index in range(self.workers):
+                process = self.processes[index]
+                if process is not None and not process.is_alive():
+                    logging.error(f"Shard worker {index} exited with code {process.exitcode}, restarting")
+                    self._spawn(index)
+                backlog = self.backlogs[index]
+                while backlog and self._offer(index, backlog[0]):
+                    backlog.popleft()
+
+    def stop(self, timeout=30):
+        """
+        Досылает отложенные апдейты и останавливает обработчики.
+
+        На все отводится timeout секунд: обработчик, который за это время не разобрал
+        свою очередь или не завершился, останавливается принудительно.
+        """
+        deadline = time.monotonic() + timeout
+        stuck = set()
+        for index in range(self.workers):
+            backlog = self.backlogs[index]
+            try:
+                while backlog:
+                    self.queues[index].put(backlog[0], timeout=max(0.0, deadline - time.monotonic()))
+                    backlog.popleft()
+                self.queues[index].put(None, timeout=max(0.0, deadline - time.monotonic()))
+            except queue.Full:
+                logging.error(f"Shard {index} does not drain its queue, {len(backlog)} updates dropped")
+                backlog.clear()
+                stuck.add(index)
+        for index, process in enumerate(self.processes):
+            if process is None:
+                continue
+            if index not in stuck:
+                process.join(max(0.0, deadline - time.monotonic()))
+            if process.is_alive():
+                logging.error(f"Shard worker {index} did not stop in {timeout}s, terminating")
+                process.terminate()
+                process.join(5)
+
+
+async def _poll_updates(bot: Bot, router: ShardRouter):
+    # Апдейты, накопившиеся во время простоя, не пропускаем
+    await bot.delete_webhook()
+    offset = None
+    while True:
+        try:
+            # offset=None нельзя передавать: aiogram превратит его в строку 'None'
+            params = {'timeout': 20} if offset is None else {'offset': offset, 'timeout': 20}
+            updates = await bot.request('getUpdates', params)
+        except Exception as e:
+            logging.error(f"Ошибка при получении апдейтов: {e}")
+            await asyncio.sleep(1)
+            continue
+        for payload in updates:
+            if not router.route(payload):
+                # Offset не сдвигаем: Telegram вернет этот и следующие апдейты при следующем запросе
+                offset = payload['update_id']
+                await asyncio.sleep(1)
+                break
+            offset = payload['update_id'] + 1
+
+
+def run_ingress(workers):
+    """Входной процесс: получает апдейты (polling или webhook) и раздает их N обработчикам"""
+    import bot as app
+    from utils.webhook import create_webhook_app, get_ssl_context, setup_webhook, require_secret
+
+    if RUN_MODE == 'webhook':
+        # Проверяем до запуска обработчиков и подготовки базы
+        require_secret()
+    # Таблицы и миграции - один раз, до запуска обработчиков
+    app.setup_database()
+    router = ShardRouter(workers)
+    router.start()
+    tasks = []
+
+    async def on_startup(_=None):
+        # Глобальные действия при старте выполняются один раз, во входном процессе
+        await app.on_global_startup(app.dp)
+        tasks.append(asyncio.create_task(router.supervise()))
+
+    async def on_shutdown(_=None):
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        session = await app.bot.get_session()
+        await session.close()
+
+    try:
+        if RUN_MODE == 'webhook':
+            webhook_app = create_webhook_app(router.route)
+
+            async def on_webhook_startup(_):
+                await setup_webhook(app.bot)
+                await on_startup()
+
+            webhook_app.on_startup.append(on_webhook_startup)
+            webhook_app.on_shutdown.append(on_shutdown)
+            web.run_app(webhook_app, host=WEBAPP_HOST, port=WEBAPP_PORT, ssl_context=get_ssl_context())
+        else:
+            async def main():
+                await on_startup()
+                try:
+                    await _poll_updates(app.bot, router)
+                finally:
+                    await on_shutdown()
+
+            asyncio.run(main())
+    except KeyboardInterrupt:
+        pass
+    finally:
+        router.stop()
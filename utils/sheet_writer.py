@@ -0,0 +1,147 @@
+import asyncio
+import contextvars
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from data.config import SHEET_ID, SHEET_NAME
+from utils.misc.metrics import Counter, Gauge, Histogram
+from utils.sheets import open_worksheet, sheets_op
+
+SHEET_QUEUE_WAIT = Histogram('bot_sheet_queue_wait_seconds', 'Ожидание записи в очереди листа', ['sheet'])
+SHEET_QUEUE_SIZE = Gauge('bot_sheet_queue_size', 'Записи в очереди листа', ['sheet'])
+SHEET_QUOTA_WAITS = Counter('bot_sheet_quota_waits_total', 'Записи, ждавшие бюджета запросов листа', ['sheet'])
+
+# Запросов к Sheets API на одну запись: append_row и чтение D1
+REQUESTS_PER_ENTRY = 2
+
+
+class _TargetWriter:
+    """
+    Очередь записей одного листа и ее обработчик.
+
+    Записи идут в лист по одной в своем потоке, не чаще requests_per_minute
+    запросов к API (token bucket), поэтому очередь загруженного листа не
+    задерживает записи в остальные листы. Бюджет делится поровну между
+    processes процессами бота, которые пишут в тот же лист.
+    """
+
+    def __init__(self, target, queue_size, processes=1):
+        self.target = target
+        self.label = f'{target.sheet_id[:8]}/{target.sheet_name}'
+        # Только лист по умолчанию при неверном названии заменяется первым (как раньше);
+        # лист из /sheet_route должен существовать, иначе запись завершается ошибкой
+        self.fallback = (target.sheet_id, target.sheet_name) == (SHEET_ID, SHEET_NAME)
+        self.queue = asyncio.Queue(maxsize=queue_size)
+        self.burst = max(REQUESTS_PER_ENTRY, target.requests_per_minute / processes)
+        self.rate = self.burst / 60
+        self.tokens = float(self.burst)
+        self.refilled_at = time.monotonic()
+        self.worksheet = None
+        self.executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix=f'sheet-{target.sheet_name}')
+        self.task = asyncio.create_task(self.run())
+
+    async def acquire(self, tokens):
+        """Ждет, пока в бюджете листа наберется tokens запросов"""
+        waited = False
+        while True:
+            now = time.monotonic()
+            self.tokens = min(self.burst, self.tokens + (now - self.refilled_at) * self.rate)
+            self.refilled_at = now
+            if self.tokens >= tokens:
+                self.tokens -= tokens
+                return
+            if not waited:
+                SHEET_QUOTA_WAITS.inc(sheet=self.label)
+                waited = True
+            await asyncio.sleep((tokens - self.tokens) / self.rate)
+
+    def write(self, row):
+        """Добавляет строку и читает D1 (остаток); выполняется в потоке листа"""
+        if self.worksheet is None:
+            # Лист открывается один раз на обработчик, а не на каждую запись
+            self.worksheet = open_worksheet(self.target.sheet_id, self.target.sheet_name, fallback=self.fallback)
+        try:
+            with sheets_op('append_row'):
+                self.worksheet.append_row(row)
+        except Exception:
+            # Лист могли переименовать или удалить - в следующий раз откроем заново
+            self.worksheet = None
+            raise
+        try:
+            with sheets_op('acell'):
+                d1_value = self.worksheet.acell('D1').value
+        except Exception:
+            d1_value = None
+        return d1_value or "0"
+
+    async def run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            row, future, context, queued_at = await self.queue.get()
+            SHEET_QUEUE_SIZE.set(self.queue.qsize(), sheet=self.label)
+            try:
+                if future.cancelled():
+                    continue
+                await self.acquire(REQUESTS_PER_ENTRY)
+                SHEET_QUEUE_WAIT.observe(time.perf_counter() - queued_at, sheet=self.label)
+                # Запрос выполняется в контексте хендлера, чтобы попасть в его трассу
+                result = await loop.run_in_executor(self.executor, context.run, self.write, row)
+                if not future.done():
+                    future.set_result(result)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                if not future.done():
+                    future.set_exception(e)
+            finally:
+                self.queue.task_done()
+
+
+class SheetWriters:
+    """
+    Обработчики записи в Google Sheets, по одному на лист (таблица + лист).
+
+    Обработчик создается при первой записи в лист; маршрут объекта к листу
+    выбирает вызывающий (utils/db_api/sheet_routes.py). Token bucket у каждого
+    процесса свой: при работе в нескольких процессах (ingress.py) в processes
+    указывается их число, и каждый получает свою долю бюджета листа.
+    """
+
+    def __init__(self, queue_size=1000, processes=1):
+        self.queue_size = queue_size
+        self.processes = processes
+        self._writers = {}
+        self._retiring = set()
+
+    def _writer(self, target):
+        key = (target.sheet_id, target.sheet_name)
+        writer = self._writers.get(key)
+        if writer is None or writer.target.requests_per_minute != target.requests_per_minute:
+            if writer is not None:
+                # Бюджет листа изменили - новый обработчик примет новые записи, старый допишет свои
+                task = asyncio.create_task(self._retire(writer))
+                self._retiring.add(task)
+                task.add_done_callback(self._retiring.discard)
+            writer = self._writers[key] = _TargetWriter(target, self.queue_size, self.processes)
+        return writer
+
+    async def append(self, target, row):
+        """Добавляет строку в лист target; возвращает значение D1 после записи"""
+        writer = self._writer(target)
+        future = asyncio.get_running_loop().create_future()
+        await writer.queue.put((row, future, contextvars.copy_context(), time.perf_counter()))
+        SHEET_QUEUE_SIZE.set(writer.queue.qsize(), sheet=writer.label)
+        return await future
+
+    @staticmethod
+    async def _retire(writer):
+        await writer.queue.join()
+        writer.task.cancel()
+        writer.executor.shutdown(wait=False)
+
+    async def close(self):
+        """Дописывает очереди всех листов и останавливает обработчики"""
+        writers = list(self._writers.values())
+        self._writers.clear()
+        await asyncio.gather(*(self._retire(writer) for writer in writers), *self._retiring,
+                             return_exceptions=True)
@@ -0,0 +1,76 @@
+import contextlib
+import logging
+import threading
+import time
+
+from data.config import SHEET_ID, SHEET_NAME, CREDENTIALS_FILE
+from utils.misc.metrics import Counter, Histogram
+from utils.misc.tracing import add_span
+
+SCOPES = ['https://www.googleapis.com/auth/spreadsheets']
+
+SHEETS_SECONDS = Histogram('bot_sheets_operation_seconds', 'Длительность операций Google Sheets', ['op'])
+SHEETS_ERRORS = Counter('bot_sheets_errors_total', 'Ошибки операций Google Sheets', ['op'])
+
+_client = None
+_client_lock = threading.Lock()
+
+
+@contextlib.contextmanager
+def sheets_op(op):
+    """Замеряет операцию с таблицей (append_row, acell, ...) и считает ее ошибки"""
+    started = time.perf_counter()
+    try:
+        yield
+    except Exception:
+        SHEETS_ERRORS.inc(op=op)
+        raise
+    finally:
+        elapsed = time.perf_counter() - started
+        SHEETS_SECONDS.observe(elapsed, op=op)
+        add_span('sheets', op, elapsed)
+
+
+def get_client():
+    """Авторизованный клиент gspread; создается один раз на процесс (токен gspread обновляет сам)"""
+    global _client
+    with _client_lock:
+        if _client is None:
+            with sheets_op('authorize'):
+                # gspread и google-auth тянут много модулей - загружаем их только при первой записи
+                import gspread
+                from google.oauth2.service_account import Credentials
+                creds = Credentials.from_service_account_file(CREDENTIALS_FILE, scopes=SCOPES)
+                _client = gspread.authorize(creds)
+        return _client
+
+
+def use_client(client):
+    """Подменяет клиент gspread (нагрузочный тест работает с поддельной таблицей)"""
+    global _client
+    with _client_lock:
+        _client = client
+
+
+def open_spreadsheet(sheet_id=SHEET_ID):
+    with sheets_op('open'):
+        return get_client().open_by_key(sheet_id)
+
+
+def open_worksheet(sheet_id=SHEET_ID, sheet_name=SHEET_NAME, fallback=True):
+    """
+    Лист таблицы по названию; если его нет - первый лист.
+
+    fallback=False - вместо первого листа исключение: так открываются листы из
+    /sheet_route, чтобы опечатка в названии не отправила записи в чужую вкладку.
+    """
+    sh = open_spreadsheet(sheet_id)
+    try:
+        with sheets_op('worksheet'):
+            return sh.worksheet(sheet_name)
+    except Exception as e:
+        if not fallback:
+            raise
+        logging.error(f"Не удалось найти лист '{sheet_name}': {e}")
+        with sheets_op('worksheet'):
+            return sh.get_worksheet(0)
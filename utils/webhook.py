@@ -0,0 +1,136 @@
+import asyncio
+import hmac
+import logging
+import ssl
+
+from aiohttp import web
+from aiogram import Bot, Dispatcher, types
+
+from data.config import (WEBHOOK_HOST, WEBHOOK_PATH, WEBHOOK_SECRET, WEBHOOK_SSL_CERT,
+                         WEBHOOK_SSL_PRIV, WEBAPP_HOST, WEBAPP_PORT)
+from utils.misc.updates import update_user_id
+
+SECRET_HEADER = 'X-Telegram-Bot-Api-Secret-Token'
+
+
+class UpdateProcessor:
+    """
+    Асинхронная обработка апдейтов после мгновенного ответа Telegram.
+
+    Апдейты разных пользователей обрабатываются параллельно, апдейты одного
+    пользователя - строго по очереди, в порядке поступления.
+    """
+
+    def __init__(self, dp: Dispatcher):
+        self.dp = dp
+        self._last = {}
+        self._tasks = set()
+
+    def submit(self, payload: dict):
+        key = update_user_id(payload)
+        previous = self._last.get(key)
+        task = asyncio.create_task(self._process(payload, previous))
+        self._last[key] = task
+        self._tasks.add(task)
+        task.add_done_callback(lambda t: self._done(key, t))
+        return task
+
+    async def _process(self, payload, previous):
+        if previous is not None:
+            await asyncio.gather(previous, return_exceptions=True)
+        Bot.set_current(self.dp.bot)
+        Dispatcher.set_current(self.dp)
+        try:
+            # Через updates_handler, как в polling: иначе on_pre/post_process_update мидлвари не вызываются
+            await self.dp.updates_handler.notify(types.Update(**payload))
+        except Exception as e:
+            logging.error(f"Ошибка при обработке апдейта {payload.get('update_id')}: {e}")
+
+    def _done(self, key, task):
+        self._tasks.discard(task)
+        if self._last.get(key) is task:
+            del self._last[key]
+
+    async def wait_closed(self):
+        if self._tasks:
+            await asyncio.gather(*self._tasks, return_exceptions=True)
+
+
+def require_secret(secret=WEBHOOK_SECRET):
+    """
+    Без секрета любой, кто достучится до адреса webhook, сможет прислать поддельный
+    апдейт от имени любого пользователя (в том числе админа) - такой запуск запрещен.
+    """
+    if not secret:
+        raise RuntimeError('RUN_MODE=webhook requires WEBHOOK_SECRET (X-Telegram-Bot-Api-Secret-Token)')
+    return secret
+
+
+def create_webhook_app(submit, path=WEBHOOK_PATH, secret=WEBHOOK_SECRET):
+    """
+    aiohttp-приложение, которое проверяет секрет и передает апдейт в submit(payload).
+
+    Если submit вернул False, Telegram получает 503 и доставит апдейт повторно.
+    """
+    secret = require_secret(secret)
+    app = web.Application()
+
+    async def handle_update(request: web.Request):
+        if not hmac.compare_digest(request.headers.get(SECRET_HEADER, ''), secret):
+            return web.Response(status=403)
+        try:
+            payload = await request.json()
+        except ValueError:
+            return web.Response(status=400)
+        # Отвечаем Telegram сразу, обработка идет в фоне
+        if submit(payload) is False:
+            # Апдейт не принят (перегрузка) - Telegram повторит доставку
+            return web.Response(status=503)
+        return web.Response(text='ok')
+
+    app.router.add_post(path, handle_update)
+    return app
+
+
+def get_ssl_context():
+    if not (WEBHOOK_SSL_CERT and WEBHOOK_SSL_PRIV):
+        return None
+    context = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+    context.load_cert_chain(WEBHOOK_SSL_CERT, WEBHOOK_SSL_PRIV)
+    return context
+
+
+async def setup_webhook(bot: Bot):
+    certificate = None
+    if WEBHOOK_SSL_CERT:
+        # Самоподписанный сертификат нужно передать Telegram при установке webhook
+        certificate = types.InputFile(WEBHOOK_SSL_CERT)
+    await bot.set_webhook(WEBHOOK_HOST.rstrip('/') + WEBHOOK_PATH,
+                          certificate=certificate,
+                          secret_token=require_secret())
+
+
+def run_webhook(dp: Dispatcher, on_startup=None, on_shutdown=None):
+    """Запускает бота в режиме webhook на встроенном aiohttp-сервере"""
+    require_secret()
+    processor = UpdateProcessor(dp)
+    app = create_webhook_app(processor.submit)
+
+    async def _startup(app):
+        await setup_webhook(dp.bot)
+        if on_startup:
+            await on_startup(dp)
+
+    async def _shutdown(app):
+        # Webhook не удаляем: апдейты, пришедшие во время простоя, Telegram доставит позже
+        await processor.wait_closed()
+        if on_shutdown:
+            await on_shutdown(dp)
+        await dp.storage.close()
+        await dp.storage.wait_closed()
+        session = await dp.bot.get_session()
+        await session.close()
+
+    app.on_startup.append(_startup)
+    app.on_shutdown.append(_shutdown)
+    web.run_app(app, host=WEBAPP_HOST, port=WEBAPP_PORT, ssl_context=get_ssl_context())